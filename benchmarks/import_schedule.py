@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Measures the cost of importing a schedule (as done by ~fetchdb) into the
+# DB, for a new schedule and for the same schedule fetched again.
+
+from collections import OrderedDict
+import argparse
+import os
+import random
+import shutil
+import statistics
+import tempfile
+import time
+
+from ptgbot.db import PTGDataBase
+
+
+DAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday']
+SLOTS = ['A1', 'A2', 'P1', 'P2']
+
+
+def make_schedule(rooms, days, tracks, seed=42):
+    rng = random.Random(seed)
+    track_names = ['track%d' % i for i in range(tracks)]
+    slots = OrderedDict()
+    for day in DAYS[:days]:
+        slots[day] = [{'name': day[:3] + slot, 'desc': slot}
+                      for slot in SLOTS]
+    schedule = OrderedDict()
+    for i in range(rooms):
+        bookings = OrderedDict(
+            [('url', 'https://meet.example.org/room%d' % i)])
+        for day_slots in slots.values():
+            for slot in day_slots:
+                bookings[slot['name']] = rng.choice(track_names + [''])
+        schedule['Room %d' % i] = bookings
+    return OrderedDict([('tracks', track_names), ('slots', slots),
+                        ('schedule', schedule), ('eventid', 'bench')])
+
+
+def import_previous(db, document):
+    # Import as done before documents were validated and diffed
+    db.data.update(document)
+    db.subscription_patterns = None
+    db.build_tracks_index()
+    for room, bookings in db.data['schedule'].items():
+        for btime, track in bookings.items():
+            if btime in ['cap_icon', 'cap_desc', 'url']:
+                continue
+            if track and not db.is_track_valid(track):
+                db.add_tracks([track])
+    db.build_schedule_index()
+    db.build_checkins_index()
+    db.colorize()
+    db.save()
+
+
+def measure(function, document, filename, runs):
+    timings = []
+    writes = []
+    for i in range(runs):
+        shutil.copy('base.json', filename)
+        db = PTGDataBase({'db_filename': filename})
+        write = db.storage.write
+        counter = []
+        db.storage.write = lambda *args: counter.append(1) or write(*args)
+        start = time.perf_counter()
+        function(db, document)
+        timings.append(time.perf_counter() - start)
+        # The same schedule, fetched again
+        start = time.perf_counter()
+        function(db, document)
+        timings.append(time.perf_counter() - start)
+        writes.append(len(counter))
+    return timings[::2], timings[1::2], statistics.mean(writes)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark importing schedules')
+    parser.add_argument('--rooms', type=int, default=50)
+    parser.add_argument('--days', type=int, default=5)
+    parser.add_argument('--tracks', type=int, default=300)
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    document = make_schedule(args.rooms, args.days, args.tracks)
+    tmpdir = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(tmpdir, 'ptg.json')
+        print("%-10s %12s %14s %8s" % ('method', 'import (ms)',
+                                       'reimport (ms)', 'writes'))
+        for name, function in (('previous', import_previous),
+                               ('shadow', PTGDataBase.import_json)):
+            first, again, writes = measure(function, document, filename,
+                                           args.runs)
+            print("%-10s %12.1f %14.1f %8d" % (
+                name, statistics.median(first) * 1000,
+                statistics.median(again) * 1000, writes))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Measures the memory taken by each check-in kept in the DB, as the dicts
+# created by check_in() and the OrderedDicts loaded from JSON used to be,
+# and as CheckIn records.
+
+from collections import OrderedDict
+import argparse
+import json
+import tracemalloc
+
+from ptgbot.records import CheckIn
+from ptgbot.records import to_json
+
+
+def make_dict(nick, location, checked_in):
+    return {'nick': nick, 'location': location, 'in': checked_in,
+            'out': None}
+
+
+def make_ordered_dict(nick, location, checked_in):
+    return OrderedDict([('nick', nick), ('location', location),
+                        ('in', checked_in), ('out', None)])
+
+
+def make_record(nick, location, checked_in):
+    return CheckIn(nick, location, checked_in, None)
+
+
+def measure(factory, nicks):
+    # Returns the bytes allocated per check-in, including the nick and
+    # timestamp strings (shared by all representations)
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    last_check_in = {}
+    for i in range(nicks):
+        nick = 'nick%d' % i
+        last_check_in[nick] = factory(
+            nick, '#room%d' % (i % 50), 'Monday %02d:%02d' % (i % 24, i % 60))
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return used / nicks, last_check_in
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark memory used by check-ins')
+    parser.add_argument('--nicks', type=int, default=10000)
+    args = parser.parse_args()
+
+    print("%-14s %10s %10s" % ('check-in', 'bytes', 'json'))
+    for name, factory in (('dict', make_dict),
+                          ('OrderedDict', make_ordered_dict),
+                          ('CheckIn', make_record)):
+        per_check_in, last_check_in = measure(factory, args.nicks)
+        # All representations should be persisted the same way
+        size = len(json.dumps(last_check_in, default=to_json))
+        print("%-14s %10.0f %10d" % (name, per_check_in, size))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Measures the cost of notifying subscribers of a now/next message, with
+# a growing number of distinct subscriptions.
+
+import argparse
+import re
+import statistics
+import time
+
+from ptgbot.db import PTGDataBase
+from ptgbot.trackcommands import notify
+
+
+def notify_uncompiled(db, botsend, track, adverb, sentence):
+    # Subscription matching as done before patterns were precompiled,
+    # relying on the re module internal cache
+    event_text = " ".join(['#' + track, adverb, sentence])
+    for nick, regexp in db.get_subscriptions().items():
+        if regexp is not None and re.search(regexp, event_text,
+                                            re.IGNORECASE):
+            botsend(nick, sentence)
+
+
+def measure(function, subscribers, messages, base):
+    db = PTGDataBase({'db_filename': base}, write_to_disk=False)
+    tracks = db.list_tracks()
+    for i in range(subscribers):
+        db.set_subscription('nick%d' % i, '#%s.*topic%d\\b' % (
+            tracks[i % len(tracks)], i))
+    sent = []
+    timings = []
+    for i in range(messages):
+        start = time.perf_counter()
+        function(db, lambda nick, msg: sent.append(nick),
+                 tracks[i % len(tracks)], 'now', 'discussing topic%d' % i)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark subscription notifications')
+    parser.add_argument('--subscribers', type=int, nargs='+',
+                        default=[1000, 5000])
+    parser.add_argument('--messages', type=int, default=50)
+    parser.add_argument('--base', default='base.json')
+    args = parser.parse_args()
+
+    print("%-12s %12s %12s" % ('method', 'subscribers', 'median (ms)'))
+    for subscribers in args.subscribers:
+        for name, function in (('uncompiled', notify_uncompiled),
+                               ('compiled', notify)):
+            timings = measure(function, subscribers, args.messages,
+                              args.base)
+            print("%-12s %12d %12.3f" % (
+                name, subscribers, statistics.median(timings) * 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Bytes transferred by ptgbot-web when a browser loads a page, then
+# reloads it (as the signage screens do every minute), with a browser
+# cache honouring Cache-Control, ETag and Last-Modified.
+
+import argparse
+import gzip
+import http.client
+import os
+import re
+import shutil
+import tempfile
+import threading
+
+import ptgbot.web
+
+
+HTML_DIR = os.path.join(os.path.dirname(__file__), '..', 'ptgbot', 'html')
+
+
+class Browser():
+
+    def __init__(self, address, compression, verbose):
+        self.conn = http.client.HTTPConnection(*address)
+        self.compression = compression
+        self.verbose = verbose
+        # path -> response headers
+        self.cache = {}
+        self.pages = {}
+
+    def get(self, path):
+        # Returns the number of bytes received, and the body
+        headers = {}
+        if self.compression:
+            headers['Accept-Encoding'] = 'br, gzip'
+        cached = self.cache.get(path)
+        if cached is not None:
+            if 'max-age' in cached.get('Cache-Control', ''):
+                if self.verbose:
+                    print('  %s: cached' % path)
+                return 0, None
+            if 'ETag' in cached:
+                headers['If-None-Match'] = cached['ETag']
+            elif 'Last-Modified' in cached:
+                headers['If-Modified-Since'] = cached['Last-Modified']
+        self.conn.request('GET', '/' + path, headers=headers)
+        response = self.conn.getresponse()
+        body = response.read()
+        if response.status == 200:
+            self.cache[path] = response.msg
+        size = (len('HTTP/1.0 200 OK\r\n') + len(str(response.msg)) +
+                len(body))
+        if self.verbose:
+            print('  %s: %d %d bytes' % (path, response.status, size))
+        if response.getheader('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        return size, body
+
+    def load(self, page):
+        size, body = self.get(page)
+        requests = 1
+        if not body:
+            # Not modified: use the cached page
+            body = self.pages[page]
+        self.pages[page] = body
+        html = body.decode('utf-8')
+        paths = [p for p in re.findall(r'(?:src|href)="([^"#:]+)"', html)
+                 if not p.endswith('.html')]
+        match = re.search(r'data-json="([^"]*)"', html)
+        paths.extend(match.group(1).split() if match else ['ptg.json'])
+        for path in paths:
+            path_size, body = self.get(path.lstrip('/'))
+            size += path_size
+            requests += 1 if body is not None else 0
+        return size, requests
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--page', default='signage.html')
+    parser.add_argument('--reloads', type=int, default=10)
+    parser.add_argument('--no-compression', dest='compression',
+                        action='store_false',
+                        help='do not send Accept-Encoding')
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='show each response')
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(tmpdir, 'ptg.json')
+        shutil.copy('base.json', filename)
+        ptgbot.web.RequestHandler.db = ptgbot.web.DBCache(filename)
+        ptgbot.web.RequestHandler.log_message = lambda *args: None
+        os.chdir(HTML_DIR)
+        server = ptgbot.web.make_server(0, 0, '127.0.0.1')
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            browser = Browser(server.server_address, args.compression,
+                              args.verbose)
+            size, requests = browser.load(args.page)
+            print('First load: %d bytes in %d requests' % (size, requests))
+            total = 0
+            for i in range(args.reloads):
+                size, requests = browser.load(args.page)
+                total += size
+            print('Reload: %d bytes in %d requests' %
+                  (total / args.reloads, requests))
+        finally:
+            server.shutdown()
+            thread.join()
+            server.server_close()
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
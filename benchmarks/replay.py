@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Replays IRC traffic against PTGBot, without an IRC network: messages are
+# read from channel logs in the eavesdrop format, or generated to look
+# like a PTG morning rush, and fed to on_pubmsg/on_privmsg through a stub
+# connection, as fast as possible or at a multiple of real time. Reports
+# the time taken to handle each kind of command, the messages the bot
+# sent and how much it wrote to disk:
+#
+#   python benchmarks/replay.py --log openstack-ptg.2023-03-27.log.txt
+#   python benchmarks/replay.py --messages 5000 --duration 1800 --speed 60
+
+import argparse
+import collections
+import datetime
+import json
+import os
+import random
+import re
+import shutil
+import tempfile
+import time
+
+from irc.client import Event
+import irc.bot
+
+from ptgbot.bot import PTGBot
+import ptgbot.db
+from ptgbot.usercommands import USER_COMMANDS
+
+import suite
+import synthetic
+
+
+NICK = 'ptgbot'
+CHANNEL = '#openinfra-events'
+# "2023-03-27T13:00:05  <nick> message", or "[13:00:05] <nick> message"
+LOG_LINE = re.compile(r'^\[?(?P<time>[0-9T:.\-]+)Z?\]?\s+'
+                      r'<[@+]?(?P<nick>[^>]+)>\s(?P<text>.*)$')
+
+
+class StubConnection():
+    """Records what the bot sends, instead of sending it to a server."""
+
+    def __init__(self):
+        self.sent = []
+
+    def privmsg(self, target, text):
+        self.sent.append((target, text))
+
+
+def parse_time(value):
+    # Returns a number of seconds, only meaningful relative to other lines
+    if 'T' in value or '-' in value:
+        return datetime.datetime.fromisoformat(value).timestamp()
+    hours, minutes, seconds = value.split(':')
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+
+def read_log(filename):
+    # Yields (time, nick, target, text) for the messages of a channel log.
+    # Joins, parts and actions are ignored.
+    with open(filename, 'r', errors='replace') as fp:
+        for line in fp:
+            match = LOG_LINE.match(line.rstrip('\n'))
+            if match:
+                yield (parse_time(match.group('time')), match.group('nick'),
+                       CHANNEL, match.group('text'))
+
+
+def generate(db, messages, duration, nicks, seed=42):
+    # Yields (time, nick, target, text) for traffic looking like the start
+    # of a PTG day: mostly chatter, attendees checking in, and tracks
+    # announcing what they discuss now and next
+    rng = random.Random(seed)
+    tracks = db.list_tracks()
+    # Slots of the rooms which can be booked from IRC, as ROOM-SLOT
+    names = set(slot['name'] for slots in db.data['slots'].values()
+                for slot in slots)
+    slots = ['%s-%s' % (room, slot)
+             for room, bookings in db.data['schedule'].items()
+             if ' ' not in room
+             for slot in bookings if slot in names]
+    kinds = [
+        (0.55, lambda nick, track: 'Good morning everyone'),
+        (0.15, lambda nick, track: '+in %s' % track),
+        (0.04, lambda nick, track: '#out'),
+        (0.02, lambda nick, track: '+seen nick%d' % rng.randrange(nicks)),
+        (0.12, lambda nick, track: '#%s now discussing topic%d' % (
+            track, rng.randrange(100))),
+        (0.06, lambda nick, track: '#%s next topic%d after the break' % (
+            track, rng.randrange(100))),
+        (0.02, lambda nick, track: '#%s book %s' % (track,
+                                                    rng.choice(slots))),
+        (0.02, lambda nick, track: '#%s location' % track),
+    ]
+    for i in range(messages):
+        when = duration * i / messages
+        nick = 'nick%d' % rng.randrange(nicks)
+        track = rng.choice(tracks)
+        if rng.random() < 0.02:
+            # Subscriptions are usually set privately
+            yield (when, nick, NICK, 'subscribe #%s.*topic%d\\b' % (
+                track, rng.randrange(100)))
+            continue
+        draw = rng.random()
+        for probability, make in kinds:
+            draw -= probability
+            if draw < 0:
+                break
+        yield when, nick, CHANNEL, make(nick, track)
+
+
+def command_kind(text, private):
+    # Groups messages by the command they issue, for reporting
+    words = text.split()
+    if private:
+        return 'private ' + (words[0].lstrip('#+').lower() if words else '')
+    if not words or words[0][0] not in '+#~':
+        return 'chatter'
+    prefix, name = words[0][0], words[0][1:].lower()
+    if prefix == '+' or (prefix == '#' and name in USER_COMMANDS):
+        return 'user ' + name
+    if prefix == '~':
+        return 'admin ' + name
+    return 'track ' + (words[1].lower() if len(words) > 1 else '')
+
+
+def write_totals():
+    # Number of writes of the DB, and bytes written, so far
+    value = ptgbot.db.WRITE_BYTES.values.get((), [None, 0, 0])
+    return value[2], value[1]
+
+
+def replay(bot, messages, speed):
+    # Feeds messages to the bot, returning how long handling each kind of
+    # command took
+    channel = bot.channels[CHANNEL]
+    timings = collections.defaultdict(list)
+    start = time.monotonic()
+    first = next_flush = None
+    for when, nick, target, text in messages:
+        if first is None:
+            first = when
+            next_flush = when + bot.data.flush_interval
+        if speed:
+            delay = (when - first) / speed - (time.monotonic() - start)
+            if delay > 0:
+                time.sleep(delay)
+        if bot.data.flush_interval and when >= next_flush:
+            # Done periodically by the reactor
+            bot.data.flush()
+            next_flush = when + bot.data.flush_interval
+        if not channel.has_user(nick):
+            # Everyone may run track and admin commands
+            channel.add_user(nick)
+            channel.set_mode('o', nick)
+        source = '%s!~%s@example.org' % (nick, nick)
+        private = target == NICK
+        event = Event('privmsg' if private else 'pubmsg', source, target,
+                      [text])
+        handler = bot.on_privmsg if private else bot.on_pubmsg
+        before = time.perf_counter()
+        handler(bot.connection, event)
+        timings[command_kind(text, private)].append(
+            time.perf_counter() - before)
+    bot.data.flush()
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Replay IRC traffic against the bot')
+    parser.add_argument('--log', help='eavesdrop log of the channel to '
+                        'replay (messages are generated otherwise)')
+    parser.add_argument('--scale', default='small',
+                        choices=list(synthetic.SCALES),
+                        help='size of the synthetic event to start from')
+    parser.add_argument('--messages', type=int, default=2000,
+                        help='number of messages to generate')
+    parser.add_argument('--duration', type=float, default=1800,
+                        help='time (in seconds) generated messages span')
+    parser.add_argument('--speed', type=float, default=0,
+                        help='replay at that multiple of real time '
+                        '(as fast as possible by default)')
+    parser.add_argument('--config', help='JSON file with DB options '
+                        '(like db_engine or db_flush_interval)')
+    parser.add_argument('--base', default='base.json')
+    parser.add_argument('--output', help='file to save results to')
+    args = parser.parse_args()
+
+    config = {}
+    if args.config:
+        with open(args.config, 'r') as fp:
+            config = json.load(fp)
+    tmpdir = tempfile.mkdtemp()
+    try:
+        config['db_filename'] = os.path.join(tmpdir, 'ptg.json')
+        scale = synthetic.SCALES[args.scale]
+        synthetic.write_event(config['db_filename'], args.base, args.scale)
+        db = ptgbot.db.PTGDataBase(config)
+        # Replies are counted rather than throttled
+        bot = PTGBot(NICK, '', '', '', CHANNEL, db, send_burst=float('inf'))
+        bot.connection = StubConnection()
+        bot.channels[CHANNEL] = irc.bot.Channel()
+
+        if args.log:
+            messages = read_log(args.log)
+        else:
+            messages = generate(db, args.messages, args.duration,
+                                scale['nicks'])
+        writes, written = write_totals()
+        start = time.perf_counter()
+        timings = replay(bot, messages, args.speed)
+        elapsed = time.perf_counter() - start
+        writes, written = [after - before for before, after in
+                           zip((writes, written), write_totals())]
+    finally:
+        shutil.rmtree(tmpdir)
+
+    results = {}
+    print("%-20s %8s %12s %12s %12s" % (
+        'command', 'count', 'median (ms)', 'p99 (ms)', 'max (ms)'))
+    for kind in sorted(timings):
+        result = results[kind] = suite.stats(timings[kind])
+        result['max_ms'] = max(timings[kind]) * 1000
+        print("%-20s %8d %12.3f %12.3f %12.3f" % (
+            kind, result['count'], result['median_ms'], result['p99_ms'],
+            result['max_ms']))
+    sent = bot.connection.sent
+    summary = {
+        'messages': sum(len(t) for t in timings.values()),
+        'elapsed_s': elapsed,
+        'sent_channel': sum(1 for target, text in sent if target == CHANNEL),
+        'sent_private': sum(1 for target, text in sent if target != CHANNEL),
+        'sent_bytes': sum(len(text) for target, text in sent),
+        'db_writes': writes,
+        'db_written_bytes': written,
+    }
+    print("\n%(messages)d messages handled in %(elapsed_s).2fs" % summary)
+    print("Sent %(sent_channel)d messages to the channel and "
+          "%(sent_private)d privately (%(sent_bytes)d bytes)" % summary)
+    print("Wrote the DB %(db_writes)d times (%(db_written_bytes)d bytes)" %
+          summary)
+
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump({'metadata': suite.metadata(), 'summary': summary,
+                       'results': results}, fp, indent=2)
+
+
+if __name__ == "__main__":
+    main()
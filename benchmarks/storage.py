@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Compares the per-mutation latency of the storage engines, for a DB
+# with a growing number of checked-in nicks.
+
+import argparse
+import os
+import shutil
+import statistics
+import tempfile
+import time
+
+from ptgbot.db import PTGDataBase
+from ptgbot.records import CheckIn
+
+
+ENGINES = {
+    # Full rewrite of the JSON file on every change
+    'json': {'db_engine': 'json'},
+    # Changes appended to the journal, snapshot written on flush
+    'journal': {'db_engine': 'journal', 'db_flush_interval': 3600000},
+    # Changed rows updated in SQLite, JSON rendering written on flush
+    'sqlite': {'db_engine': 'sqlite', 'db_flush_interval': 3600000},
+}
+
+
+def measure(engine, nicks, mutations, fsync, base):
+    tmpdir = tempfile.mkdtemp()
+    try:
+        config = dict(ENGINES[engine],
+                      db_filename=os.path.join(tmpdir, 'ptg.json'),
+                      db_fsync=fsync)
+        shutil.copy(base, config['db_filename'])
+        db = PTGDataBase(config)
+        for i in range(nicks):
+            db.data['last_check_in']['nick%d' % i] = CheckIn(
+                'nick%d' % i, '#swift', '2020-06-01 09:00:00', None)
+        db.save()
+        timings = []
+        for i in range(mutations):
+            start = time.perf_counter()
+            db.check_in('nick%d' % (i % nicks), '#nova')
+            timings.append(time.perf_counter() - start)
+        db.flush()
+        return timings
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark PTGDataBase storage engines')
+    parser.add_argument('--nicks', type=int, nargs='+',
+                        default=[100, 1000, 10000])
+    parser.add_argument('--mutations', type=int, default=200)
+    parser.add_argument('--fsync', default='none',
+                        choices=['none', 'file', 'dir'])
+    parser.add_argument('--base', default='base.json')
+    args = parser.parse_args()
+
+    print("%-8s %8s %12s %12s" % ('engine', 'nicks', 'median (ms)',
+                                  'p99 (ms)'))
+    for nicks in args.nicks:
+        for engine in ENGINES:
+            timings = sorted(measure(engine, nicks, args.mutations,
+                                     args.fsync, args.base))
+            print("%-8s %8d %12.3f %12.3f" % (
+                engine, nicks,
+                statistics.median(timings) * 1000,
+                timings[int(len(timings) * 0.99)] * 1000))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Runs the benchmarks of the bot and web server hot paths on synthetic
+# events of growing size, and saves the results as JSON, so that they can
+# be compared between commits:
+#
+#   tox -e bench -- --output before.json
+#   (change things)
+#   tox -e bench -- --output after.json --compare before.json
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+
+from ptgbot.db import PTGDataBase
+from ptgbot.ics import json2ical
+from ptgbot.trackcommands import notify
+
+import synthetic
+import web
+
+
+def stats(timings):
+    timings = sorted(timings)
+    return {
+        'count': len(timings),
+        'median_ms': statistics.median(timings) * 1000,
+        'mean_ms': statistics.mean(timings) * 1000,
+        'p90_ms': timings[int(len(timings) * 0.9)] * 1000,
+        'p99_ms': timings[int(len(timings) * 0.99)] * 1000,
+    }
+
+
+def timed(function, args_list):
+    timings = []
+    for args in args_list:
+        start = time.perf_counter()
+        function(*args)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def bench_db_mutations(db, filename, iterations):
+    # Mutations as issued by IRC commands, each saved to disk
+    db = PTGDataBase({'db_filename': filename})
+    rng = random.Random(1)
+    tracks = db.list_tracks()
+    slots = [(room, slot) for room, bookings in db.data['schedule'].items()
+             for slot, track in bookings.items() if track == '']
+    timings = []
+    for i in range(iterations):
+        track = rng.choice(tracks)
+        room, slot = rng.choice(slots)
+        timings.extend(timed(db.add_now, [(track, 'Topic %d' % i)]))
+        timings.extend(timed(db.check_in, [('nick%d' % i, '#' + track)]))
+        if db.is_slot_valid_and_empty(room, slot):
+            timings.extend(timed(db.book, [(track, room, slot)]))
+            timings.extend(timed(db.unbook, [(room, slot)]))
+    return stats(timings)
+
+
+def bench_db_save(db, filename, iterations):
+    # Complete writes of the DB to disk
+    db = PTGDataBase({'db_filename': filename})
+    return stats(timed(db.save, [()] * iterations))
+
+
+def bench_get_track_room(db, filename, iterations):
+    rng = random.Random(1)
+    tracks = db.list_tracks()
+    lookups = [(rng.choice(tracks),) for i in range(iterations * 100)]
+    return stats(timed(db.get_track_room, lookups))
+
+
+def bench_notify(db, filename, iterations):
+    # Matching a now/next message against all subscriptions
+    rng = random.Random(1)
+    tracks = db.list_tracks()
+    db.get_subscription_patterns()
+    messages = [(db, lambda nick, message: None, rng.choice(tracks), 'now',
+                 'Discussing topic%d' % rng.randrange(100))
+                for i in range(iterations)]
+    return stats(timed(notify, messages))
+
+
+def bench_json2ical_team(db, filename, iterations):
+    rng = random.Random(1)
+    tracks = db.list_tracks()
+    return stats(timed(json2ical, [(db.data, rng.choice(tracks))
+                                   for i in range(iterations)]))
+
+
+def bench_json2ical_all(db, filename, iterations):
+    return stats(timed(json2ical,
+                       [(db.data, 'ALL')] * max(1, iterations // 10)))
+
+
+def bench_web(db, filename, iterations):
+    # Clients polling now.json, served by 8 workers
+    latencies, errors = web.measure(filename, 8, 50, 3, 0, '/now.json')
+    result = stats(latencies)
+    result['requests_per_second'] = len(latencies) / 3
+    result['errors'] = len(errors)
+    return result
+
+
+BENCHMARKS = {
+    'db_mutations': bench_db_mutations,
+    'db_save': bench_db_save,
+    'get_track_room': bench_get_track_room,
+    'notify': bench_notify,
+    'json2ical_team': bench_json2ical_team,
+    'json2ical_all': bench_json2ical_all,
+    'web': bench_web,
+}
+
+
+def metadata():
+    try:
+        commit = subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL,
+            universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'date': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+    }
+
+
+def compare(results, previous):
+    print("\n%-16s %-8s %14s %14s %8s" % (
+        'benchmark', 'scale', 'before (ms)', 'after (ms)', 'ratio'))
+    for name, scales in results.items():
+        for scale, result in scales.items():
+            before = previous.get(name, {}).get(scale)
+            if before is None:
+                continue
+            print("%-16s %-8s %14.3f %14.3f %8.2f" % (
+                name, scale, before['median_ms'], result['median_ms'],
+                result['median_ms'] / before['median_ms']))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark ptgbot hot paths')
+    parser.add_argument('--scales', nargs='+', default=list(synthetic.SCALES),
+                        choices=list(synthetic.SCALES))
+    parser.add_argument('--benchmarks', nargs='+', default=list(BENCHMARKS),
+                        choices=list(BENCHMARKS))
+    parser.add_argument('--iterations', type=int, default=100)
+    parser.add_argument('--base', default='base.json')
+    parser.add_argument('--output', help='file to save results to')
+    parser.add_argument('--compare',
+                        help='results of a previous run to compare with')
+    args = parser.parse_args()
+
+    results = {}
+    tmpdir = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(tmpdir, 'ptg.json')
+        print("%-16s %-8s %12s %12s" % ('benchmark', 'scale', 'median (ms)',
+                                        'p99 (ms)'))
+        for scale in args.scales:
+            for name in args.benchmarks:
+                # Each benchmark starts from the same synthetic event
+                synthetic.write_event(filename, args.base, scale)
+                db = PTGDataBase({'db_filename': filename},
+                                 write_to_disk=False)
+                result = BENCHMARKS[name](db, filename, args.iterations)
+                results.setdefault(name, {})[scale] = result
+                print("%-16s %-8s %12.3f %12.3f" % (
+                    name, scale, result['median_ms'], result['p99_ms']))
+    finally:
+        shutil.rmtree(tmpdir)
+
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump({'metadata': metadata(), 'results': results}, fp,
+                      indent=2)
+    if args.compare:
+        with open(args.compare, 'r') as fp:
+            compare(results, json.load(fp)['results'])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Synthetic events, scaled up from base.json, for benchmarks.
+
+from collections import OrderedDict
+import json
+import random
+
+
+# Events of growing size: how many times the rooms of base.json are
+# replicated, how many tracks book them, and how many attendees check in
+# and subscribe to notifications
+SCALES = OrderedDict([
+    ('small', {'room_copies': 1, 'tracks': 50, 'nicks': 200}),
+    ('medium', {'room_copies': 4, 'tracks': 200, 'nicks': 2000}),
+    ('large', {'room_copies': 10, 'tracks': 500, 'nicks': 10000}),
+])
+
+
+def make_event(base, room_copies, tracks, nicks, seed=42):
+    # Returns a DB document for an event of that size
+    rng = random.Random(seed)
+    with open(base, 'r') as fp:
+        data = json.load(fp, object_pairs_hook=OrderedDict)
+
+    data['tracks'] = ['track%d' % i for i in range(tracks)]
+    for day, slots in data['slots'].items():
+        for slot in slots:
+            # Calendars are only generated for slots with a realtime
+            slot.setdefault('realtime', '2020-06-01T09:00:00Z')
+    slot_names = [slot['name'] for slots in data['slots'].values()
+                  for slot in slots]
+
+    schedule = OrderedDict()
+    for copy_number in range(room_copies):
+        for room, bookings in data['schedule'].items():
+            name = room if copy_number == 0 else '%s%d' % (room, copy_number)
+            # Room descriptions are left out, as the calendars would take
+            # them for bookings
+            bookings = OrderedDict((key, value)
+                                   for key, value in bookings.items()
+                                   if key == 'url')
+            for slot in slot_names:
+                # Two thirds of the slots are booked
+                bookings[slot] = (rng.choice(data['tracks'])
+                                  if rng.random() < 0.66 else '')
+            schedule[name] = bookings
+    data['schedule'] = schedule
+
+    for track in data['tracks']:
+        if rng.random() < 0.5:
+            data['now'][track] = 'Discussing topic %d' % rng.randrange(100)
+    data['last_check_in'] = OrderedDict()
+    data['subscriptions'] = OrderedDict()
+    for i in range(nicks):
+        nick = 'nick%d' % i
+        data['last_check_in'][nick] = OrderedDict([
+            ('nick', nick),
+            ('location', '#' + rng.choice(data['tracks'])),
+            ('in', '2020-06-01 09:00:00'),
+            ('out', None if rng.random() < 0.5 else '2020-06-01 10:00:00')])
+        if rng.random() < 0.5:
+            data['subscriptions'][nick] = '#%s.*topic%d\\b' % (
+                rng.choice(data['tracks']), rng.randrange(100))
+    return data
+
+
+def write_event(filename, base, scale, seed=42):
+    data = make_event(base, seed=seed, **SCALES[scale])
+    with open(filename, 'w') as fp:
+        json.dump(data, fp)
+    return data
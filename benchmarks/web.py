@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Load test for ptgbot-web: many clients polling the same URL, with the
+# server running in a separate process.
+
+import argparse
+import http.client
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from ptgbot.db import PTGDataBase
+import ptgbot.web
+
+
+def serve(filename, workers, port_queue):
+    ptgbot.web.RequestHandler.db = ptgbot.web.DBCache(filename)
+    ptgbot.web.RequestHandler.log_message = lambda *args: None
+    server = ptgbot.web.make_server(0, workers, '127.0.0.1')
+    port_queue.put(server.server_address[1])
+    server.serve_forever()
+
+
+def poll(address, path, deadline, interval, latencies, errors):
+    conn = None
+    while time.monotonic() < deadline:
+        start = time.monotonic()
+        try:
+            if conn is None:
+                conn = http.client.HTTPConnection(*address, timeout=30)
+            conn.request('GET', path)
+            response = conn.getresponse()
+            response.read()
+            if response.will_close:
+                conn.close()
+                conn = None
+            latencies.append(time.monotonic() - start)
+        except (OSError, http.client.HTTPException):
+            errors.append(time.monotonic() - start)
+            if conn is not None:
+                conn.close()
+            conn = None
+        time.sleep(interval)
+    if conn is not None:
+        conn.close()
+
+
+def measure(filename, workers, clients, duration, interval, path):
+    port_queue = multiprocessing.Queue()
+    server = multiprocessing.Process(target=serve,
+                                     args=(filename, workers, port_queue))
+    server.start()
+    try:
+        address = ('127.0.0.1', port_queue.get())
+        latencies = []
+        errors = []
+        deadline = time.monotonic() + duration
+        threads = [threading.Thread(target=poll,
+                                    args=(address, path, deadline, interval,
+                                          latencies, errors))
+                   for i in range(clients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return sorted(latencies), errors
+    finally:
+        server.terminate()
+        server.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test ptgbot-web')
+    parser.add_argument('--workers', type=int, nargs='+', default=[0, 32])
+    parser.add_argument('--clients', type=int, default=500)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--interval', type=float, default=0.1,
+                        help='Delay between two requests of a client')
+    parser.add_argument('--path', default='/ptg.json')
+    parser.add_argument('--base', default='base.json')
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(tmpdir, 'ptg.json')
+        shutil.copy(args.base, filename)
+        PTGDataBase({'db_filename': filename})
+        print("%-8s %8s %10s %12s %12s %8s" % (
+            'workers', 'clients', 'req/s', 'median (ms)', 'p99 (ms)',
+            'errors'))
+        for workers in args.workers:
+            latencies, errors = measure(filename, workers, args.clients,
+                                        args.duration, args.interval,
+                                        args.path)
+            if not latencies:
+                latencies = [float('nan')]
+            print("%-8d %8d %10.1f %12.1f %12.1f %8d" % (
+                workers, args.clients, len(latencies) / args.duration,
+                latencies[len(latencies) // 2] * 1000,
+                latencies[int(len(latencies) * 0.99)] * 1000,
+                len(errors)))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == "__main__":
+    main()
@@ -13,76 +13,123 @@
 # limitations under the License.
 
 
-def process_admin_command(db, command, params):
+from ptgbot.commands import CommandTable
 
-    if command == 'emptydb':
-        db.empty()
+ADMIN_COMMANDS = CommandTable('admin', permission='op')
+MOTD_COMMANDS = CommandTable('motd')
 
-    elif command == 'fetchdb':
-        if len(params) < 1:
-            return "Missing URL to fetch (~fetch URL)"
-        url = params[0]
+
+# Admin commands are given a fetch(url, callback) function, fetching url
+# in the background and then calling callback with the future of the JSON
+# document (and whether it changed since last fetched). What callback
+# returns is sent to the admin who issued the command.
+
+
+def process_admin_command(db, fetch, command, params):
+    if command not in ADMIN_COMMANDS:
+        return "Unknown command '%s'" % command
+    return ADMIN_COMMANDS.dispatch(command, db, fetch, params)
+
+
+@ADMIN_COMMANDS.register('emptydb')
+def emptydb(db, fetch, params):
+    db.empty()
+
+
+@ADMIN_COMMANDS.register('fetchdb', min_args=1,
+                         usage="Missing URL to fetch (~fetch URL)")
+def fetchdb(db, fetch, params):
+    url = params[0]
+
+    def load(future):
         try:
-            db.import_json(url)
-            return "Loaded DB from %s" % url
+            document, changed = future.result()
+            summary = db.import_json(document)
+            return "Loaded DB from %s (%s%s)" % (
+                url, summary,
+                "" if changed else ", unchanged since last fetched")
         except Exception as e:
             return "Error loading DB: %s" % e
 
-    elif command == 'newday':
-        db.new_day_cleanup()
-
-    elif command == 'motd':
-        if len(params) < 1:
-            return "Missing subcommand (~motd add|del|clean|reorder ...)"
-
-        if params[0] == "add":
-            if len(params) < 3:
-                return "Missing parameters (~motd add LEVEL MSG)"
-            if params[1] not in ['info', 'success', 'warning', 'danger']:
-                return ("Incorrect message level '%s' (should be info, "
-                        "success, warning or danger)" % params[1])
-            db.motd_add(params[1], str.join(' ', params[2:]))
-
-        elif params[0] == "del":
-            if len(params) < 2:
-                return "Missing message number (~motd del NUM)"
-            if not db.motd_has(params[1]):
-                return "Incorrect message number %s" % params[1]
-            db.motd_del(params[1])
-
-        elif params[0] in ("clean", "clear"):
-            if len(params) > 1:
-                return "'~motd clean' does not take parameters"
-            db.motd_clean()
-
-        elif params[0] == "reorder":
-            if len(params) < 2:
-                return "Missing params (~motd reorder X Y...)"
-            order = []
-            for num in params[1:]:
-                if not db.motd_has(num):
-                    return "Incorrect message number %s" % num
-                order.append(num)
-            db.motd_reorder(order)
-
-        else:
-            return "Unknown motd subcommand %s" % params[0]
-
-    elif command == 'requirevoice':
-        db.require_voice()
-
-    elif command == 'alloweveryone':
-        db.allow_everyone()
-
-    elif command == 'list':
-        return 'Available tracks: ' + str.join(' ', db.list_tracks())
-
-    elif command in ('clean', 'clear', 'add', 'del'):
-        if command == 'clear':
-            command = 'clean'
-        if len(params) < 1:
-            return "This command takes one or more arguments"
-        getattr(db, command + '_tracks')(params)
-
-    else:
-        return "Unknown command '%s'" % command
+    fetch(url, load)
+
+
+@ADMIN_COMMANDS.register('newday')
+def newday(db, fetch, params):
+    db.new_day_cleanup()
+
+
+@ADMIN_COMMANDS.register('motd', min_args=1,
+                         usage="Missing subcommand "
+                               "(~motd add|del|clean|reorder ...)")
+def motd(db, fetch, params):
+    if params[0] not in MOTD_COMMANDS:
+        return "Unknown motd subcommand %s" % params[0]
+    return MOTD_COMMANDS.dispatch(params[0], db, params[1:])
+
+
+@MOTD_COMMANDS.register('add', min_args=2,
+                        usage="Missing parameters (~motd add LEVEL MSG)")
+def motd_add(db, params):
+    if params[0] not in ['info', 'success', 'warning', 'danger']:
+        return ("Incorrect message level '%s' (should be info, "
+                "success, warning or danger)" % params[0])
+    db.motd_add(params[0], str.join(' ', params[1:]))
+
+
+@MOTD_COMMANDS.register('del', min_args=1,
+                        usage="Missing message number (~motd del NUM)")
+def motd_del(db, params):
+    if not db.motd_has(params[0]):
+        return "Incorrect message number %s" % params[0]
+    db.motd_del(params[0])
+
+
+@MOTD_COMMANDS.register('clean', 'clear', max_args=0,
+                        usage="'~motd clean' does not take parameters")
+def motd_clean(db, params):
+    db.motd_clean()
+
+
+@MOTD_COMMANDS.register('reorder', min_args=1,
+                        usage="Missing params (~motd reorder X Y...)")
+def motd_reorder(db, params):
+    order = []
+    for num in params:
+        if not db.motd_has(num):
+            return "Incorrect message number %s" % num
+        order.append(num)
+    db.motd_reorder(order)
+
+
+@ADMIN_COMMANDS.register('requirevoice')
+def requirevoice(db, fetch, params):
+    db.require_voice()
+
+
+@ADMIN_COMMANDS.register('alloweveryone')
+def alloweveryone(db, fetch, params):
+    db.allow_everyone()
+
+
+@ADMIN_COMMANDS.register('list')
+def list_tracks(db, fetch, params):
+    return 'Available tracks: ' + str.join(' ', db.list_tracks())
+
+
+@ADMIN_COMMANDS.register('clean', 'clear', min_args=1,
+                         usage="This command takes one or more arguments")
+def clean_tracks(db, fetch, params):
+    db.clean_tracks(params)
+
+
+@ADMIN_COMMANDS.register('add', min_args=1,
+                         usage="This command takes one or more arguments")
+def add_tracks(db, fetch, params):
+    db.add_tracks(params)
+
+
+@ADMIN_COMMANDS.register('del', min_args=1,
+                         usage="This command takes one or more arguments")
+def del_tracks(db, fetch, params):
+    db.del_tracks(params)
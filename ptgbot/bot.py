@@ -21,14 +21,23 @@ import irc.bot
 import json
 import logging.config
 import os
+import signal
 import ssl
 import time
 import textwrap
 
 import ptgbot.db
+from ptgbot.admincommands import ADMIN_COMMANDS
 from ptgbot.admincommands import process_admin_command
+from ptgbot.fetch import FETCH_TIMEOUT
+from ptgbot.fetch import Fetcher
+from ptgbot.metrics import REGISTRY
+from ptgbot.sync import SCHEDULE_SYNC_INTERVAL
+from ptgbot.sync import ScheduleSync
 from ptgbot.trackcommands import process_track_command
+from ptgbot.trackcommands import TRACK_COMMANDS
 from ptgbot.usercommands import process_user_command
+from ptgbot.usercommands import USER_COMMANDS
 
 
 try:
@@ -42,13 +51,31 @@ except ImportError:
 # irc-client-should-not-crash-on-failed
 # ^ This is why pep8 is a bad idea.
 irc.client.ServerConnection.buffer_class.errors = 'replace'
-# If a long message is split, how long to sleep between sending parts
-# of a message.  This is lower than the general recommended interval,
-# but in practice IRC networks allows short bursts at a higher rate.
-MESSAGE_CONTINUATION_SLEEP = 0.5
-# The amount of time to sleep between messages.
+# Outgoing messages are queued and sent at a sustained rate of one every
+# ANTI_FLOOD_SLEEP seconds. In practice IRC networks allow short bursts
+# at a higher rate, so up to SEND_BURST messages (or parts of a long
+# message) can be sent at once after a quiet period.
 ANTI_FLOOD_SLEEP = 2
+SEND_BURST = 4
 DOC_URL = 'https://opendev.org/openstack/ptgbot/src/branch/master/README.rst'
+# Characters starting commands on the channel: '+' for user commands,
+# '#' for track (and user) commands and '~' for admin commands
+COMMAND_PREFIXES = '+#~'
+# How often (in seconds) to write metrics to metrics_filename, if set
+METRICS_INTERVAL = 15
+# How often (in seconds) to check for completed background fetches
+FETCH_POLL_INTERVAL = 0.5
+
+MESSAGE_SECONDS = REGISTRY.histogram(
+    'ptgbot_message_seconds', 'Time spent handling IRC messages',
+    ('kind',))
+SEND_QUEUE_LENGTH = REGISTRY.gauge(
+    'ptgbot_send_queue_length', 'Messages waiting to be sent')
+SENT_MESSAGES = REGISTRY.counter(
+    'ptgbot_sent_messages_total', 'Messages (or parts of messages) sent')
+DROPPED_MESSAGES = REGISTRY.counter(
+    'ptgbot_dropped_messages_total',
+    'Messages dropped because the bot was not connected')
 
 
 def make_safe(func):
@@ -56,16 +83,33 @@ def make_safe(func):
         try:
             func(*args, **kwargs)
         except Exception as e:
-            msg = "Bot airbag activated: " + str(e)
-            args[0].log.error(msg, exc_info=True)
-            args[0].send(args[0].channel, msg)
+            args[0].airbag(e)
     return inner
 
 
+class BatchReactor(irc.client.Reactor):
+    """A reactor saving the changes of all the messages read at once.
+
+    Lines pasted together on IRC usually reach the bot together: the DB
+    is then only saved once for all of them. As that happens outside of
+    the command handlers, errors saving the DB are passed to on_error.
+    """
+
+    db = None
+    on_error = None
+
+    def process_data(self, sockets):
+        with self.db.batch(self.on_error):
+            super(BatchReactor, self).process_data(sockets)
+
+
 class PTGBot(irc.bot.SingleServerIRCBot):
     log = logging.getLogger("ptgbot.bot")
+    reactor_class = BatchReactor
 
-    def __init__(self, nickname, password, server, port, channel, db):
+    def __init__(self, nickname, password, server, port, channel, db,
+                 send_rate=1.0 / ANTI_FLOOD_SLEEP, send_burst=SEND_BURST,
+                 fetch_timeout=FETCH_TIMEOUT):
         connect_params = {}
         if port == 6697:
             # Taken from the example in the Factory class docstring at
@@ -85,6 +129,50 @@ class PTGBot(irc.bot.SingleServerIRCBot):
         self.password = password
         self.channel = channel
         self.data = db
+        self.reactor.db = db
+        self.reactor.on_error = self.airbag
+        if db.flush_interval:
+            # Write coalesced DB changes to disk periodically
+            self.reactor.scheduler.execute_every(db.flush_interval,
+                                                 self.flush_db)
+
+        # Fetches run in a worker thread, and their results are processed
+        # on the reactor
+        self.fetcher = Fetcher(fetch_timeout)
+        self.reactor.scheduler.execute_every(FETCH_POLL_INTERVAL,
+                                             self.fetcher.process_results)
+
+        # Outgoing messages queue, throttled by a token bucket
+        self.send_queue = collections.deque()
+        self.send_rate = send_rate
+        self.send_burst = send_burst
+        self.send_tokens = send_burst
+        self.send_refilled = time.monotonic()
+        self.send_scheduled = False
+
+    def airbag(self, e):
+        # Report errors which would otherwise stop the bot
+        msg = "Bot airbag activated: " + str(e)
+        self.log.error(msg, exc_info=True)
+        self.send(self.channel, msg)
+
+    def flush_db(self):
+        # Scheduled on the reactor, where errors would stop the bot. The
+        # changes stay pending after a failed write, so the next flush
+        # retries it.
+        try:
+            self.data.flush()
+        except Exception:
+            self.log.exception("Error writing the DB to disk")
+
+    def write_metrics(self, filename):
+        # Scheduled on the reactor too: exporting metrics must never stop
+        # the bot
+        try:
+            REGISTRY.write(filename)
+        except OSError as e:
+            self.log.warning("Error writing metrics to %s: %s" %
+                             (filename, e))
 
     def on_welcome(self, c, e):
         time.sleep(5)
@@ -106,6 +194,7 @@ class PTGBot(irc.bot.SingleServerIRCBot):
             self.send(channel, "There are no active tracks defined yet")
 
     @make_safe
+    @MESSAGE_SECONDS.time(kind='private')
     def on_privmsg(self, c, e):
         nick = e.source.split('!')[0]
         args = e.arguments[0]
@@ -130,41 +219,55 @@ class PTGBot(irc.bot.SingleServerIRCBot):
         return (self.channels[chan].is_voiced(nick) or
                 self.channels[chan].is_oper(nick))
 
-    def handle_public_command(self, chan, nick, args):
-        words = args.split()
+    def check_permission(self, commands, chan, nick):
+        # Returns why nick may not run commands from that table, if so
+        if (commands.permission == 'voice' and
+                self.data.is_voice_required() and
+                not self.is_voiced(nick, chan)):
+            return "Need voice to issue commands"
+        if commands.permission == 'op' and not self.is_chanop(nick, chan):
+            return "Need op for admin commands"
 
-        # Some messages are empty or only contain spaces.
-        # Do nothing in that case.
-        if not words:
+    def handle_public_command(self, chan, nick, args):
+        # Most messages are not for us: only look further into those
+        # starting with a command prefix, or with something like '!help'
+        start = args.lstrip()
+        if (not start or start[0] not in COMMAND_PREFIXES and
+                start[1:5].lower() != 'help'):
             return
 
+        words = args.split()
         cmd = words[0].lower()
 
         if len(cmd) > 1 and cmd[1:] == 'help':
             return "See PTGbot documentation at: " + DOC_URL
 
-        if cmd.startswith('+'):
-            return process_user_command(self.data, nick, cmd[1:], words[1:])
-
-        if cmd.startswith('#'):
-            if cmd in ['#in', '#out', '#seen', '#subscribe', '#unsubscribe']:
-                return process_user_command(self.data, nick,
-                                            cmd[1:], words[1:])
-            else:
-                if (self.data.is_voice_required() and
-                        not self.is_voiced(nick, chan)):
-                    return "Need voice to issue commands"
-                track = words[0][1:].lower()
-                return process_track_command(self.data, self.send, track,
-                                             words[1:])
-
-        if cmd.startswith('~'):
-            if not self.is_chanop(nick, chan):
-                return "Need op for admin commands"
-            directive = words[0][1:].lower()
-            return process_admin_command(self.data, directive, words[1:])
+        prefix, name = cmd[0], cmd[1:]
+        if prefix == '+' or (prefix == '#' and name in USER_COMMANDS):
+            return process_user_command(self.data, nick, name, words[1:])
+
+        if prefix == '#':
+            return (self.check_permission(TRACK_COMMANDS, chan, nick) or
+                    process_track_command(self.data, self.send, name,
+                                          words[1:]))
+
+        if prefix == '~':
+            return (self.check_permission(ADMIN_COMMANDS, chan, nick) or
+                    process_admin_command(
+                        self.data, functools.partial(self.fetch, chan, nick),
+                        name, words[1:]))
+
+    def fetch(self, chan, nick, url, callback):
+        # Fetch url in the background, and send nick what callback returns
+        # once done
+        def reply(future):
+            msg = callback(future)
+            if msg:
+                self.send(chan, ("%s: " % nick) + msg)
+        self.fetcher.fetch(url, reply)
 
     @make_safe
+    @MESSAGE_SECONDS.time(kind='public')
     def on_pubmsg(self, c, e):
         nick = e.source.split('!')[0]
         args = e.arguments[0]
@@ -180,11 +283,46 @@ class PTGBot(irc.bot.SingleServerIRCBot):
         chunks = textwrap.wrap(msg, 400)
         if len(chunks) > 10:
             raise Exception("Unusually large message: %s" % (msg,))
-        for count, chunk in enumerate(chunks):
-            self.connection.privmsg(channel, chunk)
-            if count:
-                time.sleep(MESSAGE_CONTINUATION_SLEEP)
-        time.sleep(ANTI_FLOOD_SLEEP)
+        for chunk in chunks:
+            self.send_queue.append((channel, chunk))
+        if not self.send_scheduled:
+            self.send_pending()
+        SEND_QUEUE_LENGTH.set(len(self.send_queue))
+
+    def send_pending(self):
+        # Send as many queued messages as the token bucket allows, and
+        # schedule sending the rest on the reactor, so that we never block
+        # the processing of incoming messages
+        self.send_scheduled = False
+        now = time.monotonic()
+        self.send_tokens = min(
+            self.send_burst,
+            self.send_tokens + (now - self.send_refilled) * self.send_rate)
+        self.send_refilled = now
+        while self.send_queue and self.send_tokens >= 1:
+            channel, chunk = self.send_queue.popleft()
+            try:
+                self.connection.privmsg(channel, chunk)
+            except irc.client.ServerNotConnectedError:
+                self.log.warning("Not connected, dropping %d queued "
+                                 "messages" % (len(self.send_queue) + 1))
+                DROPPED_MESSAGES.inc(len(self.send_queue) + 1)
+                self.send_queue.clear()
+                SEND_QUEUE_LENGTH.set(0)
+                return
+            self.send_tokens -= 1
+            SENT_MESSAGES.inc()
+        SEND_QUEUE_LENGTH.set(len(self.send_queue))
+        if self.send_queue:
+            self.send_scheduled = True
+            self.reactor.scheduler.execute_after(
+                (1 - self.send_tokens) / self.send_rate, self.send_pending)
+
+
+def terminate(signum, frame):
+    # Stopping the bot with a signal (like SIGTERM in containers) unwinds
+    # start(), which writes pending DB changes
+    raise SystemExit("Terminated by signal %d" % signum)
 
 
 def start(configpath):
@@ -207,8 +345,27 @@ def start(configpath):
                  config['irc_server'],
                  config['irc_port'],
                  config['irc_channel'],
-                 db)
-    bot.start()
+                 db,
+                 config.get('send_rate', 1.0 / ANTI_FLOOD_SLEEP),
+                 config.get('send_burst', SEND_BURST),
+                 config.get('fetch_timeout', FETCH_TIMEOUT))
+    if 'metrics_filename' in config:
+        # Published by ptgbot-web, along with its own metrics
+        bot.reactor.scheduler.execute_every(
+            config.get('metrics_interval', METRICS_INTERVAL),
+            functools.partial(bot.write_metrics, config['metrics_filename']))
+    if 'schedule_url' in config:
+        sync = ScheduleSync(db, bot.fetcher, config['schedule_url'])
+        bot.reactor.scheduler.execute_every(
+            config.get('schedule_sync_interval', SCHEDULE_SYNC_INTERVAL),
+            sync.poll)
+        sync.poll()
+    for signum in (signal.SIGTERM, signal.SIGHUP):
+        signal.signal(signum, terminate)
+    try:
+        bot.start()
+    finally:
+        db.flush()
 
 
 def main():
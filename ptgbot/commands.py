@@ -0,0 +1,76 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from collections import OrderedDict
+
+from ptgbot.metrics import REGISTRY
+
+
+COMMAND_SECONDS = REGISTRY.histogram(
+    'ptgbot_command_seconds', 'Time spent running commands',
+    ('table', 'command'))
+
+
+class Command():
+    """A command, as registered in a CommandTable."""
+
+    def __init__(self, name, func, min_args, max_args, usage):
+        self.name = name
+        self.func = func
+        self.min_args = min_args
+        self.max_args = max_args
+        self.usage = usage
+
+    def accepts(self, params):
+        return (len(params) >= self.min_args and
+                (self.max_args is None or len(params) <= self.max_args))
+
+
+class CommandTable():
+    """A set of commands, looked up by name.
+
+    Commands are functions registered under the name (and aliases) they
+    are invoked with, along with the number of parameters they accept and
+    the message returned when they are given another number of them. All
+    commands of a table take the same arguments, followed by the list of
+    parameters.
+
+    Each table also says which permission is required to run its commands
+    from the channel: None, 'voice' (only when the channel requires it)
+    or 'op'. Its name is used to label the metrics of its commands.
+    """
+
+    def __init__(self, name, permission=None):
+        self.name = name
+        self.permission = permission
+        self.commands = OrderedDict()
+
+    def register(self, *names, min_args=0, max_args=None, usage=None):
+        def decorator(func):
+            command = Command(names[0], func, min_args, max_args, usage)
+            for name in names:
+                self.commands[name] = command
+            return func
+        return decorator
+
+    def __contains__(self, name):
+        return name in self.commands
+
+    def dispatch(self, name, *args):
+        # Runs the command and returns its message. Unknown commands are
+        # left to the caller, which should check for them first.
+        params = args[-1]
+        command = self.commands[name]
+        if not command.accepts(params):
+            return command.usage
+        with COMMAND_SECONDS.time(table=self.name, command=command.name):
+            return command.func(*args)
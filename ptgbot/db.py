@@ -12,14 +12,30 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import bisect
 import calendar
 from collections import OrderedDict
+import contextlib
 import copy
 import datetime
-import json
-import os
 import random
-import requests
+import time
+
+from ptgbot.metrics import REGISTRY
+from ptgbot.metrics import SIZE_BUCKETS
+from ptgbot.records import CheckIn
+from ptgbot.records import Subscription
+from ptgbot.storage import get_storage
+
+
+SAVE_SECONDS = REGISTRY.histogram(
+    'ptgbot_db_save_seconds',
+    'Time spent saving changes to the DB (including writing it, if due)')
+WRITE_SECONDS = REGISTRY.histogram(
+    'ptgbot_db_write_seconds', 'Time spent writing the DB to disk')
+WRITE_BYTES = REGISTRY.histogram(
+    'ptgbot_db_write_bytes', 'Size of the DB written to disk',
+    buckets=SIZE_BUCKETS)
 
 
 class PTGDataBase():
@@ -38,58 +54,180 @@ class PTGDataBase():
             'links': OrderedDict(),
             'urls': OrderedDict(),
             # Keys for last_check_in are lower-cased nicks;
-            # values are in the same format as BASE_CHECK_IN
+            # values are CheckIn records
             'last_check_in': OrderedDict(),
+            # Keys for checkins are locations; values are the sorted
+            # nicks currently checked in there (derived from last_check_in)
+            'checkins': OrderedDict(),
+            # Keys for subscriptions are nicks; values are Subscription
+            # records
             'subscriptions': OrderedDict()}
 
-    BASE_CHECK_IN = {
-        'nick': None,  # original case for use in output
-        'location': None, 'in': None, 'out': None
-    }
-
     def __init__(self, config, write_to_disk=True):
         self.filename = config['db_filename']
         self.write_to_disk = write_to_disk
-
-        if os.path.isfile(self.filename):
-            with open(self.filename, 'r') as fp:
-                self.data = json.load(fp, object_pairs_hook=OrderedDict)
-
-            # Migrate from old format where motd was a single-message dict
-            if isinstance(self.data['motd'], dict):
-                if self.data['motd']['message']:
-                    self.data['motd'] = [self.data['motd']]
-                else:
-                    self.data['motd'] = []
-        else:
-            self.data = copy.deepcopy(self.BASE)
-
+        self.storage = get_storage(config)
+        # Changes are written to disk at most once every db_flush_interval
+        # milliseconds (by default, depending on the storage engine). In
+        # between, the DB is only marked dirty, the storage engine records
+        # the changes, and they are written on the next flush().
+        self.flush_interval = config.get(
+            'db_flush_interval', self.storage.FLUSH_INTERVAL) / 1000.0
+        self.dirty = False
+        self.last_flush = None
+        # Paths of the changes not recorded by the storage engine yet,
+        # kept until they are written (None if the DB must be written
+        # completely)
+        self.unrecorded = []
+        # Within batch(), the paths of the changes saved so far
+        self.batch_paths = None
+        self.data = self.storage.load(self.BASE)
+        self.load_records(self.data)
+        self.subscription_patterns = None
+
+        # Migrate from old format where motd was a single-message dict
+        if isinstance(self.data['motd'], dict):
+            if self.data['motd']['message']:
+                self.data['motd'] = [self.data['motd']]
+            else:
+                self.data['motd'] = []
+
+        self.build_tracks_index()
+        self.build_schedule_index()
+        self.build_checkins_index()
         self.save()
 
-    def import_json(self, url):
-        # Update the DB with the JSON data found at URL
-        self.data.update(requests.get(url).json(object_pairs_hook=OrderedDict))
-
-        # Add tracks mentioned in configuration that are not in track list
-        for room, bookings in self.data['schedule'].items():
-            for time, track in bookings.items():
-                if time in ['cap_icon', 'cap_desc', 'url']:
-                    continue
-                if track and track not in self.data['tracks']:
-                    self.add_tracks([track])
-
-        self.colorize()
-        self.save()
+    def import_json(self, document):
+        # Update the DB with a JSON document (as fetched by ~fetchdb), and
+        # return a summary of the changes. The document is merged into a
+        # copy of the DB, which only replaces it if valid, and is saved
+        # once. If saving fails, the DB is left as it was.
+        if not isinstance(document, dict):
+            raise ValueError("the DB should be a JSON object")
+        shadow = OrderedDict(self.data)
+        shadow.update(copy.deepcopy(document))
+        self.validate(shadow)
+        self.load_records(shadow)
+
+        # Add tracks booked in the schedule that are not in track list
+        slot_names = set(slot['name'] for slots in shadow['slots'].values()
+                         for slot in slots)
+        shadow['tracks'] = sorted(set(shadow['tracks']).union(
+            track for bookings in shadow['schedule'].values()
+            for btime, track in bookings.items()
+            if track and btime in slot_names))
+
+        changed = [key for key in shadow
+                   if key not in self.data or shadow[key] != self.data[key]]
+        if not changed:
+            return "no changes"
+        summary = self.diff_summary(self.data, shadow, changed)
+        added = set(shadow['tracks']) - self.track_set
+
+        # Colors of added tracks are set in the copy only
+        shadow['colors'] = OrderedDict(shadow['colors'])
+        previous = self.data
+        self.data = shadow
+        if 'subscriptions' in changed:
+            self.subscription_patterns = None
+        self.build_tracks_index()
+        self.build_schedule_index()
+        self.build_checkins_index()
+        try:
+            with self.batch():
+                self.colorize(sorted(added))
+                self.save()
+        except Exception:
+            self.data = previous
+            self.subscription_patterns = None
+            self.build_tracks_index()
+            self.build_schedule_index()
+            self.build_checkins_index()
+            raise
+        return summary
+
+    def validate(self, data):
+        # Raise ValueError if parts of data do not have the types the bot
+        # relies on
+        json_types = ((dict, 'object'), (list, 'list'), (int, 'number'),
+                      (str, 'string'))
+        for key, base in self.BASE.items():
+            for json_type, name in json_types:
+                if (isinstance(base, json_type) and
+                        not isinstance(data.get(key, base), json_type)):
+                    raise ValueError("'%s' should be a JSON %s" % (key, name))
+        if not all(isinstance(track, str) for track in data['tracks']):
+            raise ValueError("'tracks' should only list names")
+        for day, slots in data['slots'].items():
+            if not (isinstance(slots, list) and
+                    all(isinstance(slot, dict) and
+                        isinstance(slot.get('name'), str)
+                        for slot in slots)):
+                raise ValueError("slots of %s should be a list of JSON "
+                                 "objects with a name" % day)
+        for room, bookings in data['schedule'].items():
+            if not (isinstance(bookings, dict) and
+                    all(isinstance(value, str)
+                        for value in bookings.values())):
+                raise ValueError("schedule of %s should map slots to "
+                                 "tracks" % room)
+        for track, sessions in data['next'].items():
+            if not (isinstance(sessions, list) and
+                    all(isinstance(session, str) for session in sessions)):
+                raise ValueError("next sessions of %s should be a list of "
+                                 "strings" % track)
+        if not all(isinstance(motd, dict) and
+                   isinstance(motd.get('level'), str) and
+                   isinstance(motd.get('message'), str)
+                   for motd in data['motd']):
+            raise ValueError("'motd' should list JSON objects with a level "
+                             "and a message")
+        if not all(isinstance(check_in, (dict, CheckIn))
+                   for check_in in data.get('last_check_in', {}).values()):
+            raise ValueError("'last_check_in' should map nicks to JSON "
+                             "objects")
+        if not all(isinstance(regexp, (str, type(None), Subscription))
+                   for regexp in data.get('subscriptions', {}).values()):
+            raise ValueError("'subscriptions' should map nicks to regexps")
+
+    def load_records(self, data):
+        # Replace the JSON objects of data which are kept as records
+        for key, check_in in data.get('last_check_in', {}).items():
+            data['last_check_in'][key] = CheckIn.from_json(check_in)
+        for nick, regexp in data.get('subscriptions', {}).items():
+            data['subscriptions'][nick] = Subscription.from_json(regexp)
+
+    def diff_summary(self, old, new, changed):
+        # Describe the changes between two versions of the DB
+        parts = []
+        added = len(set(new['tracks']) - set(old['tracks']))
+        removed = len(set(old['tracks']) - set(new['tracks']))
+        if added or removed:
+            parts.append("tracks: %d added, %d removed" % (added, removed))
+        bookings = sum(
+            1 for room in set(old['schedule']) | set(new['schedule'])
+            for slot in (set(old['schedule'].get(room, {})) |
+                         set(new['schedule'].get(room, {})))
+            if (old['schedule'].get(room, {}).get(slot) !=
+                new['schedule'].get(room, {}).get(slot)))
+        if bookings:
+            parts.append("bookings: %d changed" % bookings)
+        others = [key for key in changed
+                  if key not in ('tracks', 'schedule', 'timestamp')]
+        if others:
+            parts.append("replaced %s" % ", ".join(others))
+        return "; ".join(parts) or "no changes"
 
     def add_now(self, track, session):
         self.data['now'][track] = session
-        # Update location if none manually provided yet
-        room = self.get_track_room(track)
-        if room and track not in self.data['location']:
-            self.add_location(track, room)
-        if track in self.data['next']:
-            del self.data['next'][track]
-        self.save()
+        with self.batch():
+            # Update location if none manually provided yet
+            room = self.get_track_room(track)
+            if room and track not in self.data['location']:
+                self.add_location(track, room)
+            if track in self.data['next']:
+                del self.data['next'][track]
+            self.save([('now', track), ('next', track)])
 
     def add_etherpad(self, track, etherpad):
         if etherpad == 'auto':
@@ -97,7 +235,7 @@ class PTGDataBase():
                 del self.data['etherpads'][track]
         else:
             self.data['etherpads'][track] = etherpad
-        self.save()
+        self.save([('etherpads', track)])
 
     def add_url(self, track, url):
         if url == 'none':
@@ -105,14 +243,14 @@ class PTGDataBase():
                 del self.data['urls'][track]
         else:
             self.data['urls'][track] = url
-        self.save()
+        self.save([('urls', track)])
 
     def add_color(self, track, color):
         self.data['colors'][track] = color
-        self.save()
+        self.save([('colors', track)])
 
-    def colorize(self):
-        for track in self.data['tracks']:
+    def colorize(self, tracks=None):
+        for track in self.data['tracks'] if tracks is None else tracks:
             if track not in self.data['colors']:
                 self.add_color(track, random.choice([
                     '#596468',
@@ -129,23 +267,62 @@ class PTGDataBase():
                     '#dc0d0e',
                 ]))
 
+    def build_tracks_index(self):
+        # The track list is kept sorted (and without duplicates) as tracks
+        # are added and deleted, along with a set of them for lookups
+        self.data['tracks'] = sorted(set(self.data['tracks']))
+        self.track_set = set(self.data['tracks'])
+
+    def build_schedule_index(self):
+        # Index the schedule so that get_track_room() does not have to
+        # scan it. book() and unbook() keep the index up to date.
+        # Slot name -> days with a slot of that name
+        self.slot_days = {}
+        for day, slots in self.data['slots'].items():
+            for slot in slots:
+                self.slot_days.setdefault(slot['name'], []).append(day)
+        # Room -> position in schedule
+        self.room_order = {
+            room: i for i, room in enumerate(self.data['schedule'])}
+        # Day -> track -> first room (in schedule order) booked that day
+        self.track_rooms = {day: {} for day in self.data['slots']}
+        for room, bookings in self.data['schedule'].items():
+            for btime, btrack in bookings.items():
+                for day in self.slot_days.get(btime, []):
+                    if btrack:
+                        self.track_rooms[day].setdefault(btrack, room)
+
+    def index_booking(self, track, room, timeslot):
+        for day in self.slot_days.get(timeslot, []):
+            current = self.track_rooms[day].get(track)
+            if (current is None or
+                    self.room_order[room] < self.room_order[current]):
+                self.track_rooms[day][track] = room
+
+    def unindex_booking(self, track, room, timeslot):
+        for day in self.slot_days.get(timeslot, []):
+            if self.track_rooms[day].get(track) != room:
+                continue
+            # Look for another room booked for that track on that day
+            del self.track_rooms[day][track]
+            for r, bookings in self.data['schedule'].items():
+                if any(btrack == track and day in self.slot_days.get(btime, [])
+                       for btime, btrack in bookings.items()):
+                    self.track_rooms[day][track] = r
+                    break
+
     def get_track_room(self, track):
         # This simplified version returns the first room the track is
         # scheduled in for the day. If the event does not run on this
         # day, pick the first day.
         today = calendar.day_name[datetime.date.today().weekday()]
         if today not in self.data['slots']:
-            today = next(iter(self.data['slots']))
-        for room, bookings in self.data['schedule'].items():
-            for btime, btrack in bookings.items():
-                for slot in self.data['slots'].get(today, []):
-                    if btrack == track and btime == slot['name']:
-                        return room
-        return None
+            today = next(iter(self.data['slots']), None)
+        return self.track_rooms.get(today, {}).get(track)
 
     def add_location(self, track, location):
         self.data['location'][track] = location
-        self.save()
+        self.save([('location', track)])
 
     def get_location(self, track):
         return self.data['location'].get(track)
@@ -154,34 +331,42 @@ class PTGDataBase():
         if track not in self.data['next']:
             self.data['next'][track] = []
         self.data['next'][track].append(session)
-        self.save()
+        self.save([('next', track)])
 
     def is_track_valid(self, track):
-        return track in self.data['tracks']
+        return track in self.track_set
 
     def list_tracks(self):
-        return sorted(self.data['tracks'])
+        return list(self.data['tracks'])
 
     def add_tracks(self, tracks):
+        added = []
         for track in tracks:
-            if track not in self.data['tracks']:
-                self.data['tracks'].append(track)
-        self.colorize()
-        self.save()
+            if track not in self.track_set:
+                bisect.insort(self.data['tracks'], track)
+                self.track_set.add(track)
+                added.append(track)
+        with self.batch():
+            self.colorize(added)
+            self.save([('tracks',)])
 
     def del_tracks(self, tracks):
         for track in tracks:
-            if track in self.data['tracks']:
-                self.data['tracks'].remove(track)
-        self.save()
+            if track in self.track_set:
+                del self.data['tracks'][
+                    bisect.bisect_left(self.data['tracks'], track)]
+                self.track_set.remove(track)
+        self.save([('tracks',)])
 
     def clean_tracks(self, tracks):
+        paths = []
         for track in tracks:
             if track in self.data['now']:
                 del self.data['now'][track]
             if track in self.data['next']:
                 del self.data['next'][track]
-        self.save()
+            paths += [('now', track), ('next', track)]
+        self.save(paths)
 
     def is_slot_valid_and_empty(self, room, timeslot):
         try:
@@ -197,34 +382,43 @@ class PTGDataBase():
 
     def book(self, track, room, timeslot):
         self.data['schedule'][room][timeslot] = track
-        self.save()
+        self.index_booking(track, room, timeslot)
+        self.save([('schedule', room, timeslot)])
 
     def unbook(self, room, timeslot):
         if room in self.data['schedule'].keys():
             if timeslot in self.data['schedule'][room].keys():
+                track = self.data['schedule'][room][timeslot]
                 self.data['schedule'][room][timeslot] = ""
-        self.save()
+                self.unindex_booking(track, room, timeslot)
+        self.save([('schedule', room, timeslot)])
 
     def is_voice_required(self):
         return self.data['voice'] == 1
 
     def require_voice(self):
         self.data['voice'] = 1
-        self.save()
+        self.save([('voice',)])
 
     def allow_everyone(self):
         self.data['voice'] = 0
-        self.save()
+        self.save([('voice',)])
 
     def new_day_cleanup(self):
         self.data['now'] = OrderedDict()
         self.data['next'] = OrderedDict()
         self.data['location'] = OrderedDict()
         self.data['last_check_in'] = OrderedDict()
-        self.save()
+        self.build_checkins_index()
+        self.save([('now',), ('next',), ('location',), ('last_check_in',),
+                   ('checkins',)])
 
     def empty(self):
         self.data = copy.deepcopy(self.BASE)
+        self.subscription_patterns = None
+        self.build_tracks_index()
+        self.build_schedule_index()
+        self.build_checkins_index()
         self.save()
 
     def motd_has(self, num):
@@ -236,43 +430,66 @@ class PTGDataBase():
 
     def motd_add(self, level, message):
         self.data['motd'].append({'level': level, 'message': message})
-        self.save()
+        self.save([('motd',)])
 
     def motd_del(self, num):
         del self.data['motd'][int(num) - 1]
-        self.save()
+        self.save([('motd',)])
 
     def motd_clean(self):
         self.data['motd'] = []
-        self.save()
+        self.save([('motd',)])
 
     def motd_reorder(self, order):
         new = []
         for index in order:
             new.append(self.data['motd'][int(index) - 1])
         self.data['motd'] = new
-        self.save()
-
-    def _blank_check_in(self):
-        # No need for a copy here
-        return OrderedDict(self.BASE_CHECK_IN)
+        self.save([('motd',)])
 
     def get_last_check_in(self, nick):
         if 'last_check_in' not in self.data:
-            return self._blank_check_in()
-        return self.data['last_check_in'].get(
-            nick.lower(), self._blank_check_in())
+            return CheckIn()
+        return self.data['last_check_in'].get(nick.lower(), CheckIn())
+
+    def build_checkins_index(self):
+        # Open check-ins, as location -> {lower-cased nick: nick}
+        self.checked_in = {}
+        for key, check_in in self.data.get('last_check_in', {}).items():
+            if (check_in.location and check_in.checked_in and
+                    not check_in.checked_out):
+                self.checked_in.setdefault(
+                    check_in.location, {})[key] = check_in.nick
+        self.data['checkins'] = OrderedDict()
+        for location in sorted(self.checked_in):
+            self.update_checkins(location)
+
+    def update_checkins(self, location):
+        # Refresh the nicks listed as checked into location, and return
+        # the DB path that changed
+        nicks = self.checked_in.get(location)
+        if nicks:
+            self.data['checkins'][location] = sorted(nicks.values())
+        else:
+            self.checked_in.pop(location, None)
+            self.data['checkins'].pop(location, None)
+        return ('checkins', location)
 
     def check_in(self, nick, location):
         if 'last_check_in' not in self.data:
             self.data['last_check_in'] = OrderedDict()
-        self.data['last_check_in'][nick.lower()] = {
-            'nick': nick,
-            'location': location,
-            'in': self.serialise_timestamp(datetime.datetime.now()),
-            'out': None  # no check-out yet
-        }
-        self.save()
+        paths = [('last_check_in', nick.lower())]
+        previous = self.data['last_check_in'].get(nick.lower())
+        if previous and previous.location in self.checked_in:
+            self.checked_in[previous.location].pop(nick.lower(), None)
+            paths.append(self.update_checkins(previous.location))
+        self.data['last_check_in'][nick.lower()] = CheckIn(
+            nick, location,
+            self.serialise_timestamp(datetime.datetime.now()),
+            None)  # no check-out yet
+        self.checked_in.setdefault(location, {})[nick.lower()] = nick
+        paths.append(self.update_checkins(location))
+        self.save(paths)
 
     # Returns location if successfully checked out, otherwise None
     def check_out(self, nick):
@@ -280,34 +497,110 @@ class PTGDataBase():
             self.data['last_check_in'] = OrderedDict()
         if nick.lower() not in self.data['last_check_in']:
             return None
-        self.data['last_check_in'][nick.lower()]['out'] = \
-            self.serialise_timestamp(datetime.datetime.now())
-        self.save()
-        return self.data['last_check_in'][nick]['location']
+        check_in = self.data['last_check_in'][nick.lower()]
+        check_in.checked_out = self.serialise_timestamp(
+            datetime.datetime.now())
+        paths = [('last_check_in', nick.lower())]
+        if check_in.location in self.checked_in:
+            self.checked_in[check_in.location].pop(nick.lower(), None)
+            paths.append(self.update_checkins(check_in.location))
+        self.save(paths)
+        return check_in.location
 
     def get_subscription(self, nick):
         if 'subscriptions' not in self.data:
             return None
-        return self.data['subscriptions'].get(nick)
+        subscription = self.data['subscriptions'].get(nick)
+        return subscription.regexp if subscription else None
 
     def get_subscriptions(self):
+        # Returns subscriptions as nick -> regexp (None if unsubscribed)
         if 'subscriptions' not in self.data:
             return {}
-        return self.data['subscriptions']
+        return OrderedDict(
+            (nick, subscription.regexp)
+            for nick, subscription in self.data['subscriptions'].items())
+
+    def get_subscription_patterns(self):
+        # Returns active subscriptions as (nick, compiled regexp) tuples.
+        # Each record compiles its regexp once, and the list is kept
+        # until subscriptions change.
+        if self.subscription_patterns is None:
+            self.subscription_patterns = [
+                (nick, subscription.pattern) for nick, subscription
+                in self.data.get('subscriptions', {}).items()
+                # Skipped if person did #unsubscribe (or regexp is invalid)
+                if subscription.pattern is not None]
+        return self.subscription_patterns
 
     def set_subscription(self, nick, regexp):
         if 'subscriptions' not in self.data:
             self.data['subscriptions'] = OrderedDict()
-        self.data['subscriptions'][nick] = regexp
-        self.save()
-
-    def save(self):
+        self.data['subscriptions'][nick] = Subscription(regexp)
+        self.subscription_patterns = None
+        self.save([('subscriptions', nick)])
+
+    @contextlib.contextmanager
+    def batch(self, on_error=None):
+        # Changes made within the block are saved once, when it ends.
+        # Nested blocks are part of the outermost one. Errors saving them
+        # are passed to on_error, if set, instead of being raised.
+        if self.batch_paths is not None:
+            yield
+            return
+        self.batch_paths = []
+        try:
+            yield
+        finally:
+            batch_paths, self.batch_paths = self.batch_paths, None
+            try:
+                if None in batch_paths:
+                    self.save()
+                elif batch_paths:
+                    self.save(list(OrderedDict.fromkeys(
+                        path for paths in batch_paths for path in paths)))
+            except Exception as e:
+                if on_error is None:
+                    raise
+                on_error(e)
+
+    @SAVE_SECONDS.time()
+    def save(self, paths=None):
+        # paths lists the parts of the DB that were changed, as tuples of
+        # keys (for example ('now', 'swift')). None means anything may
+        # have changed, which requires writing the DB completely.
+        if self.batch_paths is not None:
+            self.batch_paths.append(paths)
+            return
         timestamp = datetime.datetime.now()
         self.data['timestamp'] = self.serialise_timestamp(timestamp)
-        self.data['tracks'] = sorted(self.data['tracks'])
+        self.dirty = True
+        if paths is None or self.unrecorded is None:
+            self.unrecorded = None
+        else:
+            self.unrecorded = self.unrecorded + paths + [('timestamp',)]
+        if (self.unrecorded is None or self.last_flush is None or
+                time.monotonic() - self.last_flush >= self.flush_interval):
+            # No need to record changes written right away
+            self.flush()
+        else:
+            if self.write_to_disk:
+                self.storage.record(self.data, self.unrecorded)
+            self.unrecorded = []
+
+    def flush(self):
+        # Write pending changes (if any) to disk, along with those not
+        # recorded by the storage engine yet. They are kept if writing
+        # fails, for the next flush to retry.
+        if not self.dirty:
+            return
         if self.write_to_disk:
-            with open(self.filename, 'w') as fp:
-                json.dump(self.data, fp)
+            with WRITE_SECONDS.time():
+                WRITE_BYTES.observe(
+                    self.storage.write(self.data, self.unrecorded))
+        self.unrecorded = []
+        self.dirty = False
+        self.last_flush = time.monotonic()
 
     def serialise_timestamp(self, timestamp):
         return '{:%Y-%m-%d %H:%M:%S}'.format(timestamp)
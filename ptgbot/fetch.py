@@ -0,0 +1,87 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from collections import deque
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import logging
+
+import requests
+
+from ptgbot.metrics import REGISTRY
+
+
+# Maximum time (in seconds) to wait for the server to accept the
+# connection, and then between bytes of the response
+FETCH_TIMEOUT = 30
+
+FETCH_SECONDS = REGISTRY.histogram(
+    'ptgbot_fetch_seconds', 'Time spent fetching JSON documents')
+
+
+class Fetcher():
+    """Fetches JSON documents over HTTP, in a worker thread.
+
+    Connections are kept open between fetches, and documents are fetched
+    again with conditional requests, so that fetching an unchanged
+    document costs a mere 304 response. Callbacks are given the future
+    of the fetch, in the thread calling process_results() (the reactor
+    for the bot), so that they can safely change the DB.
+    """
+
+    log = logging.getLogger("ptgbot.fetch")
+
+    def __init__(self, timeout=FETCH_TIMEOUT):
+        self.timeout = timeout
+        self.session = requests.Session()
+        # URL -> conditional request headers, and the document fetched
+        self.validators = {}
+        self.documents = {}
+        # Fetches are run one at a time, in order
+        self.executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix='ptgbot-fetch')
+        self.done = deque()
+
+    def get_json(self, url):
+        # Returns the JSON document at url, and whether it changed since
+        # it was last fetched
+        headers = self.validators.get(url, {})
+        with FETCH_SECONDS.time():
+            response = self.session.get(url, headers=headers,
+                                        timeout=self.timeout)
+        if response.status_code == 304 and url in self.documents:
+            return self.documents[url], False
+        response.raise_for_status()
+        document = response.json(object_pairs_hook=OrderedDict)
+        validators = {}
+        if 'ETag' in response.headers:
+            validators['If-None-Match'] = response.headers['ETag']
+        if 'Last-Modified' in response.headers:
+            validators['If-Modified-Since'] = response.headers['Last-Modified']
+        self.validators[url] = validators
+        self.documents[url] = document
+        return document, True
+
+    def fetch(self, url, callback):
+        future = self.executor.submit(self.get_json, url)
+        future.add_done_callback(
+            lambda future: self.done.append((callback, future)))
+        return future
+
+    def process_results(self):
+        # Runs the callbacks of completed fetches
+        while self.done:
+            callback, future = self.done.popleft()
+            try:
+                callback(future)
+            except Exception:
+                self.log.exception("Error processing fetch of JSON")
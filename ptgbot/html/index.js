@@ -4,6 +4,6 @@ var source = document.getElementById("LinksTemplate").innerHTML;
 // Handlebars compiles the above source into a template
 var template = Handlebars.compile(source);
 
-$.getJSON("ptg.json", function(json) {
+$.getJSON("links.json", function(json) {
   document.getElementById("ExtraLinks").innerHTML = template(json);
 });
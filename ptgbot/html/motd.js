@@ -12,6 +12,16 @@ Handlebars.registerHelper('linkify', function(str) {
     return new Handlebars.SafeString(str2);
 });
 
-$.getJSON("ptg.json", function(json) {
-  document.getElementById("MOTD").innerHTML = dtemplate(json);
+function load_motd() {
+  $.getJSON("motd.json", function(json) {
+    document.getElementById("MOTD").innerHTML = dtemplate(json);
+  });
+}
+
+load_motd();
+// Sent by ptg.js when the DB changed
+$(document).on('ptgbot:reload', function(e, keys) {
+  if (keys == undefined || keys.indexOf('motd') >= 0) {
+    load_motd();
+  }
 });
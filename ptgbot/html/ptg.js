@@ -4,6 +4,27 @@ var source = document.getElementById("PTGtemplate").innerHTML;
 // Handlebars compiles the above source into a template
 var template = Handlebars.compile(source);
 
+// The template says which parts of the DB it needs, and how often (in
+// seconds) the page should be refreshed
+var sources = (document.getElementById("PTGtemplate")
+               .getAttribute("data-json") || "ptg.json").split(" ");
+var refresh = parseInt(document.getElementById("PTGtemplate")
+                       .getAttribute("data-refresh") || "180");
+
+// Fetch all JSON urls and call callback with their merged content
+function getJSONs(urls, callback) {
+  var json = {};
+  var pending = urls.length;
+  $.each(urls, function(i, url) {
+    $.getJSON(url, function(data) {
+      $.extend(json, data);
+      if (--pending == 0) {
+        callback(json);
+      }
+    });
+  });
+}
+
 Handlebars.registerHelper('trackContentLine', function(options) {
   var words = options.fn(this).split(" ");
   var sentence = "";
@@ -41,16 +62,13 @@ Handlebars.registerHelper('checkedin', function(track) {
 
 function checkins_count(track) {
   var room_checkins = checkins['#' + track];
-  return room_checkins ? Object.keys(room_checkins).length : 0;
+  return room_checkins ? room_checkins.length : 0;
 }
 
 function checkins_tooltip(track) {
   var room_checkins = checkins['#' + track];
   if (room_checkins) {
-    var attendees = room_checkins.map(function(checkin) {
-      return checkin.nick;
-    }).sort();
-    return 'Checked in here: ' + attendees.join(", ");
+    return 'Checked in here: ' + room_checkins.join(", ");
   } else {
     return "No one is checked in here. " +
       "DM the bot 'in #" + track + "' to check in.";
@@ -139,35 +157,31 @@ Handlebars.registerHelper('activetime',
   return new Handlebars.SafeString('');
 });
 
-// What is the day today ?
-// Return Monday until Tuesday 1 UTC
-var now = new Date();
-now.setHours(now.getHours()-1);
 var days = ['Sunday','Monday','Tuesday','Wednesday','Thursday','Friday','Saturday'];
-var day = days[ now.getUTCDay() ];
+var selected_day = null;
 var checkins = {};
+// The last version of the DB received
+var ptg = null;
 
-$.getJSON("ptg.json", function(json) {
-  if ('last_check_in' in json) {
-    // Compile lists of who's checked into each location
-    for (var attendee in json['last_check_in']) {
-      var checkin = json['last_check_in'][attendee];
-      if (checkin.location) {
-        if (checkin['in'] && ! checkin['out']) {
-          if (! (checkin.location in checkins)) {
-            checkins[checkin.location] = [];
-          }
-          checkins[checkin.location].push(checkin);
-        }
-      }
-    }
-  }
-  json['checkins'] = checkins;
-  document.getElementById("PTGsessions").innerHTML = template(json);
+// Keep showing the day picked by the user across refreshes
+$(document).on('shown.bs.tab', 'a[data-toggle="tab"]', function(e) {
+  selected_day = e.target.id.substring(2);
+});
+
+function render() {
+  // What is the day today ?
+  // Return Monday until Tuesday 1 UTC
+  var now = new Date();
+  now.setHours(now.getHours()-1);
+  var day = selected_day || days[ now.getUTCDay() ];
+
+  // Sorted lists of who's checked into each location, kept by the bot
+  checkins = ptg['checkins'] || {};
+  document.getElementById("PTGsessions").innerHTML = template(ptg);
   // if the current day doesn't exist, default to first existing one
-  if ($('#st'+day).length == 0) {
+  if ($('#st'+day).length == 0 && $('#at'+day).length == 0) {
       for (var i = 0; i < days.length; i++) {
-          if ($('#st'+days[i]).length) {
+          if ($('#st'+days[i]).length || $('#at'+days[i]).length) {
               day = days[i];
               break;
           }
@@ -175,4 +189,80 @@ $.getJSON("ptg.json", function(json) {
   }
   $('#st'+day).tab('show');
   $('#at'+day).tab('show');
-});
+}
+
+// Fetch the DB (again). keys lists what changed (undefined if unknown),
+// which is also passed to other scripts of the page in a ptgbot:reload
+// event.
+function reload(keys) {
+  if (ptg != null) {
+    $(document).trigger('ptgbot:reload', [keys]);
+  }
+  if (ptg != null && keys != undefined && !keys.some(function(key) {
+        return key in ptg;
+      })) {
+    return;
+  }
+  getJSONs(sources, function(json) {
+    ptg = json;
+    render();
+  });
+}
+
+// Apply the changes pushed by the bot, in place
+function update(data) {
+  if (ptg == null) {
+    return;
+  }
+  data.changes.forEach(function(change) {
+    if (change.field in ptg) {
+      if (change.value == null) {
+        delete ptg[change.field][change.track];
+      } else {
+        ptg[change.field][change.track] = change.value;
+      }
+    }
+  });
+  if ('timestamp' in ptg) {
+    ptg['timestamp'] = data.timestamp;
+  }
+  render();
+}
+
+// Whether changes are currently pushed through the event stream. If not,
+// fetch the whole DB every refresh seconds.
+var streaming = false;
+
+if (window.EventSource) {
+  var events = new EventSource("events");
+  events.onopen = function() {
+    // After a reconnection, catch up with what was missed
+    if (streaming) {
+      reload();
+    }
+    streaming = true;
+  };
+  events.onerror = function() {
+    // The browser reconnects by itself, unless the server does not
+    // support event streams at all
+    if (events.readyState == EventSource.CLOSED) {
+      streaming = false;
+    }
+  };
+  events.addEventListener('update', function(e) {
+    update(JSON.parse(e.data));
+  });
+  events.addEventListener('reload', function(e) {
+    reload(JSON.parse(e.data).keys);
+  });
+}
+
+reload();
+setInterval(function() {
+  if (streaming) {
+    // Only update the current time slot and day
+    render();
+  } else {
+    reload();
+  }
+}, refresh * 1000);
@@ -2,49 +2,85 @@
 import datetime
 import icalendar
 
+from ptgbot.metrics import REGISTRY
 
-def json2ical(db, include_teams="ALL"):
-    teams = {}
-    slots = {}
-    eventid = db["eventid"]
-
-    # FIXME: The unused label and the _slots here are irritating.
-    for label, _slots in db["slots"].items():
-        for slot in _slots:
-            slots[slot["name"]] = slot
-
-    for location, schedule in db["schedule"].items():
-        for slot in schedule:
-            team = schedule[slot]
-            # FIXME: This is possibly wrong as teams can globally override the
-            # VC url and ignore the setting in the room/slot/table
-            if slot == "url" or team == "":
-                continue
-            teams.setdefault(team, []).append((location, slot))
-
-    if include_teams in ["ALL", "ptg"]:
-        include_teams = list(teams.keys())
-    if isinstance(include_teams, str):
-        include_teams = [include_teams]
-
-    c = icalendar.Calendar()
-    c.add("prodid", "-//Opendev PTGBot//ptg.opendev.org//")
-    c.add("version", "2.0")
-
-    for team in include_teams:
+
+ICAL_SECONDS = REGISTRY.histogram(
+    'ptgbot_ical_seconds',
+    'Time spent generating calendars, for one, some or ALL teams',
+    ('teams',))
+
+
+class Calendars():
+    """iCalendar data for the teams of a DB.
+
+    Slots and bookings are indexed once, then each team's events are
+    generated the first time they are needed and kept, so calendars for
+    the same DB can be produced repeatedly at little cost. The calendar
+    for all teams is assembled from the per-team events.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.teams = {}
+        self.slots = {}
+        self.events = {}
+        self.calendars = {}
+
+        # FIXME: The unused label and the _slots here are irritating.
+        for label, _slots in db["slots"].items():
+            for slot in _slots:
+                self.slots[slot["name"]] = slot
+
+        for location, schedule in db["schedule"].items():
+            for slot in schedule:
+                team = schedule[slot]
+                # FIXME: This is possibly wrong as teams can globally
+                # override the VC url and ignore the setting in the
+                # room/slot/table
+                if slot == "url" or team == "":
+                    continue
+                self.teams.setdefault(team, []).append((location, slot))
+
+        # Teams calendars can be requested for: those with bookings, and
+        # tracks of the DB. ALL (or ptg) is the calendar for all teams.
+        self.known = set(self.teams).union(db.get("tracks", []),
+                                           ["ALL", "ptg"])
+
+        c = icalendar.Calendar()
+        c.add("prodid", "-//Opendev PTGBot//ptg.opendev.org//")
+        c.add("version", "2.0")
+        self.header, self.footer = c.to_ical().rsplit(b"END:", 1)
+        self.footer = b"END:" + self.footer
+
+    def is_known(self, team):
+        return team in self.known
+
+    def team_events(self, team):
+        if team not in self.teams:
+            # No events, and nothing worth keeping
+            return b""
+        if team not in self.events:
+            self.events[team] = b"".join(
+                e.to_ical() for e in self.build_events(team))
+        return self.events[team]
+
+    def build_events(self, team):
+        db = self.db
+        eventid = db["eventid"]
         default_etherpad = f"https://etherpad.opendev.org/p/{eventid}-{team}"
-        for booking in teams.get(team, []):
+        for booking in self.teams.get(team, []):
             location, slot = booking
             url = (db["urls"].get(team) or
                    db["schedule"].get(location, {}).get("url", ""))
             etherpad = db["etherpads"].get(team, default_etherpad)
-            time = slots.get(slot, {}).get("realtime")
+            time = self.slots.get(slot, {}).get("realtime")
             # TODO(tonyb): 60 mins is a default picked to make the existing
             # DB work unchanged.  We can leave this as is or pick another
             # number. Longer term we could also potentially add a
             # 'default_duration' to the DB as a per-event not hard-coded
             # value to save adding a 'duration' to each slot.
-            duration = slots.get(slot, {}).get("duration", 60)
+            duration = self.slots.get(slot, {}).get("duration", 60)
             dtstart = datetime.datetime.fromisoformat(time)
             name = summary = "[PTG] " + team
             desc = "Etherpad: " + etherpad + "\n"
@@ -61,6 +97,32 @@ def json2ical(db, include_teams="ALL"):
             e.add("uid", uid)
             e.add("location", icalendar.vText(url))
 
-            c.add_component(e)
+            yield e
 
-    return c.to_ical()
+    def to_ical(self, include_teams="ALL"):
+        # How many teams are included, for metrics
+        teams = 'some'
+        if include_teams in ["ALL", "ptg"]:
+            include_teams = list(self.teams.keys())
+            teams = 'ALL'
+        if isinstance(include_teams, str):
+            include_teams = [include_teams]
+            teams = 'one'
+
+        key = tuple(include_teams)
+        if key in self.calendars:
+            return self.calendars[key]
+        with ICAL_SECONDS.time(teams=teams):
+            calendar = b"".join(
+                [self.header] +
+                [self.team_events(team) for team in include_teams] +
+                [self.footer])
+        # Only keep calendars of known teams, so that requests for any
+        # other name cannot make this grow without bound
+        if all(self.is_known(team) for team in include_teams):
+            self.calendars[key] = calendar
+        return calendar
+
+
+def json2ical(db, include_teams="ALL"):
+    return Calendars(db).to_ical(include_teams)
@@ -0,0 +1,143 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Records kept in the PTGDataBase document for the parts of it which grow
+# with the number of attendees (check-ins and subscriptions). They take
+# far less memory than dicts, and are converted from and to JSON when the
+# DB is loaded and written.
+
+from collections import OrderedDict
+import logging
+
+import regex
+
+
+class Record():
+    """A record of the DB, stored as a JSON object.
+
+    FIELDS lists the keys of the JSON object, with the attributes holding
+    their values. Records can also be read and updated like the dicts
+    they replace.
+    """
+
+    __slots__ = ()
+    FIELDS = ()
+
+    def __getitem__(self, key):
+        for name, attribute in self.FIELDS:
+            if name == key:
+                return getattr(self, attribute)
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        for name, attribute in self.FIELDS:
+            if name == key:
+                return setattr(self, attribute, value)
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __eq__(self, other):
+        if isinstance(other, Record):
+            return (type(self) is type(other) and
+                    self.to_json() == other.to_json())
+        if isinstance(other, dict):
+            return self.to_json() == other
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return '%s(%r)' % (type(self).__name__, self.to_json())
+
+    def to_json(self):
+        return OrderedDict((name, getattr(self, attribute))
+                           for name, attribute in self.FIELDS)
+
+    @classmethod
+    def from_json(cls, value):
+        if isinstance(value, cls):
+            return value
+        return cls(**{attribute: value.get(name)
+                      for name, attribute in cls.FIELDS})
+
+
+class CheckIn(Record):
+    """Where someone last checked in, and when."""
+
+    __slots__ = ('nick', 'location', 'checked_in', 'checked_out')
+    FIELDS = (('nick', 'nick'), ('location', 'location'),
+              ('in', 'checked_in'), ('out', 'checked_out'))
+
+    def __init__(self, nick=None, location=None, checked_in=None,
+                 checked_out=None):
+        self.nick = nick  # original case for use in output
+        self.location = location
+        self.checked_in = checked_in
+        self.checked_out = checked_out
+
+
+class Subscription(Record):
+    """A subscription to notifications, stored as its regexp.
+
+    The regexp is None once unsubscribed. It is compiled the first time
+    it is needed, and only then.
+    """
+
+    __slots__ = ('regexp', '_pattern')
+    log = logging.getLogger("ptgbot.records")
+
+    def __init__(self, regexp=None):
+        self.regexp = regexp
+        self._pattern = False
+
+    @property
+    def pattern(self):
+        # The compiled regexp, or None if there is none (or it is invalid)
+        if self._pattern is False:
+            self._pattern = None
+            if self.regexp is not None:
+                try:
+                    self._pattern = regex.compile(self.regexp,
+                                                  regex.IGNORECASE)
+                except regex.error as e:
+                    self.log.warning("Ignoring invalid subscription regexp "
+                                     "%r: %s" % (self.regexp, e))
+        return self._pattern
+
+    def __eq__(self, other):
+        if other is None or isinstance(other, str):
+            return self.regexp == other
+        return super(Subscription, self).__eq__(other)
+
+    __hash__ = None
+
+    def to_json(self):
+        return self.regexp
+
+    @classmethod
+    def from_json(cls, value):
+        if isinstance(value, cls):
+            return value
+        return cls(value)
+
+
+def to_json(value):
+    # Default hook of json.dump(), for the records in the DB
+    if isinstance(value, Record):
+        return value.to_json()
+    raise TypeError("Object of type %s is not JSON serializable" %
+                    type(value).__name__)
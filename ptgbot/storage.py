@@ -0,0 +1,441 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Storage engines persist the PTGDataBase document. The document itself
+# always lives in memory; engines are told which parts of it changed
+# (as paths of keys, like ('now', 'swift'), or None if the whole document
+# may have changed) through record() when writing them is deferred, and
+# are asked to write a complete snapshot of it, along with the changes not
+# recorded yet, through write(). The snapshot is always written to
+# db_filename, as this is what ptgbot-web serves.
+
+from collections import OrderedDict
+import copy
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+
+from ptgbot.records import CheckIn
+from ptgbot.records import Subscription
+from ptgbot.records import to_json
+
+
+FSYNC_POLICIES = ('none', 'file', 'dir')
+
+
+def fsync_dir(dirname):
+    dirfd = os.open(dirname, os.O_RDONLY)
+    try:
+        os.fsync(dirfd)
+    finally:
+        os.close(dirfd)
+
+
+def write_atomically(filename, data, fsync='file', dump=None):
+    # Write to a temporary file in the same directory, then rename it
+    # over the target file, so that readers (like ptgbot-web) always see
+    # either the previous or the new complete version of it. data is
+    # written with dump (json.dump, converting the records of the DB, by
+    # default). Returns the size of the file.
+    if dump is None:
+        def dump(data, fp):
+            json.dump(data, fp, default=to_json)
+    dirname = os.path.dirname(os.path.abspath(filename))
+    fd, tmpname = tempfile.mkstemp(
+        dir=dirname, prefix='.' + os.path.basename(filename) + '.')
+    try:
+        with os.fdopen(fd, 'w') as fp:
+            dump(data, fp)
+            fp.flush()
+            size = fp.tell()
+            if fsync != 'none':
+                os.fsync(fp.fileno())
+        os.chmod(tmpname, 0o644)
+        os.replace(tmpname, filename)
+    except BaseException:
+        os.unlink(tmpname)
+        raise
+    if fsync == 'dir':
+        fsync_dir(dirname)
+    return size
+
+
+def lookup(data, path):
+    for key in path:
+        data = data[key]
+    return data
+
+
+def apply_change(data, change):
+    parent = data
+    for key in change['path'][:-1]:
+        parent = parent.setdefault(key, OrderedDict())
+    if change.get('deleted'):
+        parent.pop(change['path'][-1], None)
+    else:
+        parent[change['path'][-1]] = change['value']
+
+
+class JSONStorage():
+    """Store the DB as a single JSON file, rewritten on every write."""
+
+    # Default db_flush_interval (in milliseconds) for this engine
+    FLUSH_INTERVAL = 0
+
+    def __init__(self, config):
+        self.filename = config['db_filename']
+        # What to fsync when writing: nothing, the file itself, or
+        # both the file and its directory (so that the rename is durable)
+        self.fsync = config.get('db_fsync', 'file')
+        if self.fsync not in FSYNC_POLICIES:
+            raise ValueError("Unknown db_fsync policy '%s' (should be one "
+                             "of %s)" % (self.fsync,
+                                         ', '.join(FSYNC_POLICIES)))
+
+    def load(self, default):
+        if not os.path.isfile(self.filename):
+            return copy.deepcopy(default)
+        with open(self.filename, 'r') as fp:
+            return json.load(fp, object_pairs_hook=OrderedDict)
+
+    def record(self, data, paths):
+        # Changes will be written with the next complete snapshot
+        pass
+
+    def write(self, data, paths=None):
+        # paths lists the changes not recorded yet (None meaning anything
+        # may have changed). Returns the number of bytes written.
+        return write_atomically(self.filename, data, self.fsync)
+
+
+class JournalStorage(JSONStorage):
+    """Append changes to a journal, compacted on every snapshot write.
+
+    Each recorded change is appended as a JSON line to the journal file,
+    which makes it durable at a small, constant cost. Writing a snapshot
+    (which happens every db_flush_interval) compacts the journal into
+    db_filename. On startup the snapshot is loaded and the journal
+    replayed on top of it. Changes are recorded with the hash of the
+    snapshot they were made after, so that those already in a snapshot
+    are not replayed, even if the bot stopped before truncating the
+    journal.
+    """
+
+    FLUSH_INTERVAL = 1000
+
+    def __init__(self, config):
+        super(JournalStorage, self).__init__(config)
+        self.journal_filename = config.get('db_journal_filename',
+                                           self.filename + '.journal')
+        self.journal = None
+        # Hash of the current snapshot
+        self.snapshot = None
+
+    def load(self, default):
+        if not os.path.isfile(self.filename):
+            data = copy.deepcopy(default)
+        else:
+            with open(self.filename, 'rb') as fp:
+                content = fp.read()
+            data = json.loads(content, object_pairs_hook=OrderedDict)
+            self.snapshot = hashlib.sha1(content).hexdigest()
+        if os.path.isfile(self.journal_filename):
+            with open(self.journal_filename, 'r') as fp:
+                for line in fp:
+                    try:
+                        change = json.loads(line,
+                                            object_pairs_hook=OrderedDict)
+                    except ValueError:
+                        # Last change was only partially written
+                        break
+                    if change.get('snapshot') != self.snapshot:
+                        # Already in the snapshot
+                        continue
+                    apply_change(data, change)
+        return data
+
+    def record(self, data, paths):
+        if self.journal is None:
+            self.journal = open(self.journal_filename, 'a')
+        for path in paths:
+            try:
+                change = {'path': path, 'value': lookup(data, path)}
+            except KeyError:
+                change = {'path': path, 'deleted': True}
+            change['snapshot'] = self.snapshot
+            self.journal.write(json.dumps(change, default=to_json) + '\n')
+        self.journal.flush()
+        if self.fsync != 'none':
+            os.fsync(self.journal.fileno())
+
+    def write(self, data, paths=None):
+        content = json.dumps(data, default=to_json)
+        size = write_atomically(self.filename, content, self.fsync,
+                                lambda content, fp: fp.write(content))
+        self.snapshot = hashlib.sha1(content.encode('utf-8')).hexdigest()
+        # All changes are now in the snapshot
+        if self.journal is not None:
+            self.journal.truncate(0)
+            if self.fsync != 'none':
+                os.fsync(self.journal.fileno())
+        elif os.path.isfile(self.journal_filename):
+            os.unlink(self.journal_filename)
+        return size
+
+
+SQLITE_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS properties (
+    key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS tracks (
+    name TEXT PRIMARY KEY);
+CREATE TABLE IF NOT EXISTS slots (
+    day TEXT, name TEXT, data TEXT);
+CREATE TABLE IF NOT EXISTS schedule (
+    room TEXT, key TEXT, value TEXT, PRIMARY KEY (room, key));
+CREATE TABLE IF NOT EXISTS now (
+    track TEXT PRIMARY KEY, session TEXT);
+CREATE TABLE IF NOT EXISTS next (
+    track TEXT, session TEXT);
+-- For replacing the next sessions of a track
+CREATE INDEX IF NOT EXISTS next_track ON next (track);
+CREATE TABLE IF NOT EXISTS mappings (
+    mapping TEXT, key TEXT, value TEXT, PRIMARY KEY (mapping, key));
+CREATE TABLE IF NOT EXISTS check_ins (
+    nick TEXT PRIMARY KEY, display_nick TEXT, location TEXT,
+    checked_in TEXT, checked_out TEXT);
+CREATE TABLE IF NOT EXISTS subscriptions (
+    nick TEXT PRIMARY KEY, regexp TEXT);
+CREATE TABLE IF NOT EXISTS motd (
+    level TEXT, message TEXT);
+'''
+
+
+class SQLiteStorage(JSONStorage):
+    """Store the DB in SQLite tables, updated row by row.
+
+    The SQLite database is the reference copy of the DB. db_filename is
+    only a rendering of it in the format expected by the web pages, which
+    is written on every snapshot. If the SQLite database does not exist
+    yet, it is initialized from db_filename.
+    """
+
+    # Top-level keys stored as track/nick-keyed rows:
+    # key -> (table, key column, value columns, to row, from row)
+    KEYED = {
+        'now': ('now', 'track', ('session',),
+                lambda v: (v,),
+                lambda r: r[0]),
+        'last_check_in': ('check_ins', 'nick',
+                          ('display_nick', 'location',
+                           'checked_in', 'checked_out'),
+                          lambda v: (v.nick, v.location,
+                                     v.checked_in, v.checked_out),
+                          lambda r: CheckIn(*r)),
+        'subscriptions': ('subscriptions', 'nick', ('regexp',),
+                          lambda v: (v.regexp,),
+                          lambda r: Subscription(r[0])),
+    }
+
+    # Top-level keys stored as rows of the generic mappings table
+    MAPPINGS = ('etherpads', 'colors', 'location', 'urls', 'links')
+
+    # What to pass to PRAGMA synchronous for each fsync policy
+    SYNCHRONOUS = {'none': 'OFF', 'file': 'NORMAL', 'dir': 'FULL'}
+
+    FLUSH_INTERVAL = 1000
+
+    def __init__(self, config):
+        super(SQLiteStorage, self).__init__(config)
+        self.sqlite_filename = config.get(
+            'db_sqlite_filename',
+            os.path.splitext(self.filename)[0] + '.sqlite')
+        self.conn = None
+
+    def connect(self):
+        if self.conn is None:
+            self.conn = sqlite3.connect(self.sqlite_filename)
+            self.conn.execute('PRAGMA journal_mode=WAL')
+            self.conn.execute('PRAGMA synchronous=%s' %
+                              self.SYNCHRONOUS[self.fsync])
+            self.conn.executescript(SQLITE_SCHEMA)
+        return self.conn
+
+    def load(self, default):
+        conn = self.connect()
+        if not conn.execute('SELECT COUNT(*) FROM properties').fetchone()[0]:
+            # Migrate from the JSON file (or start from default). The
+            # tables get filled when the loaded document is first saved.
+            return super(SQLiteStorage, self).load(default)
+
+        data = OrderedDict()
+        for key in default:
+            if key in self.KEYED:
+                table, column, columns, to_row, from_row = self.KEYED[key]
+                data[key] = OrderedDict(
+                    (row[0], from_row(row[1:])) for row in conn.execute(
+                        'SELECT %s, %s FROM %s ORDER BY rowid' %
+                        (column, ', '.join(columns), table)))
+            elif key in self.MAPPINGS:
+                data[key] = OrderedDict(conn.execute(
+                    'SELECT key, value FROM mappings WHERE mapping = ? '
+                    'ORDER BY rowid', (key,)))
+        data['tracks'] = [row[0] for row in conn.execute(
+            'SELECT name FROM tracks ORDER BY rowid')]
+        data['slots'] = OrderedDict()
+        for day, slot in conn.execute(
+                'SELECT day, data FROM slots ORDER BY rowid'):
+            data['slots'].setdefault(day, []).append(
+                json.loads(slot, object_pairs_hook=OrderedDict))
+        data['schedule'] = OrderedDict()
+        for room, key, value in conn.execute(
+                'SELECT room, key, value FROM schedule ORDER BY rowid'):
+            data['schedule'].setdefault(room, OrderedDict())[key] = value
+        data['next'] = OrderedDict()
+        for track, session in conn.execute(
+                'SELECT track, session FROM next ORDER BY rowid'):
+            data['next'].setdefault(track, []).append(session)
+        data['motd'] = [
+            OrderedDict([('level', level), ('message', message)])
+            for level, message in conn.execute(
+                'SELECT level, message FROM motd ORDER BY rowid')]
+        for key, value in conn.execute(
+                'SELECT key, value FROM properties ORDER BY rowid'):
+            data[key] = json.loads(value, object_pairs_hook=OrderedDict)
+        return data
+
+    def record(self, data, paths):
+        with self.connect() as conn:
+            self.record_changes(conn, data, paths)
+
+    def record_changes(self, conn, data, paths):
+        if paths is None:
+            paths = [(key,) for key in data]
+            for table in ('properties', 'tracks', 'slots', 'schedule',
+                          'now', 'next', 'mappings', 'check_ins',
+                          'subscriptions', 'motd'):
+                conn.execute('DELETE FROM %s' % table)
+        for path in paths:
+            self.record_path(conn, data, path)
+
+    def write(self, data, paths=None):
+        # The JSON rendering is written within the transaction updating
+        # the tables, so that they are only changed if it succeeds
+        with self.connect() as conn:
+            self.record_changes(conn, data, paths)
+            return super(SQLiteStorage, self).write(data, paths)
+
+    def record_path(self, conn, data, path):
+        key = path[0]
+        if key in self.KEYED:
+            table, column, columns, to_row, from_row = self.KEYED[key]
+            if len(path) == 1:
+                conn.execute('DELETE FROM %s' % table)
+                items = data.get(key, {}).items()
+            elif path[1] in data.get(key, {}):
+                items = [(path[1], data[key][path[1]])]
+            else:
+                conn.execute('DELETE FROM %s WHERE %s = ?' % (table, column),
+                             (path[1],))
+                items = []
+            # Updating existing rows in place preserves their order
+            conn.executemany(
+                'INSERT INTO %s (%s, %s) VALUES (%s) '
+                'ON CONFLICT (%s) DO UPDATE SET %s' % (
+                    table, column, ', '.join(columns),
+                    ', '.join('?' * (len(columns) + 1)), column,
+                    ', '.join('%s = excluded.%s' % (c, c) for c in columns)),
+                [(k,) + tuple(to_row(v)) for k, v in items])
+
+        elif key in self.MAPPINGS:
+            if len(path) == 1:
+                conn.execute('DELETE FROM mappings WHERE mapping = ?', (key,))
+                items = data.get(key, {}).items()
+            elif path[1] in data.get(key, {}):
+                items = [(path[1], data[key][path[1]])]
+            else:
+                conn.execute('DELETE FROM mappings WHERE mapping = ? '
+                             'AND key = ?', (key, path[1]))
+                items = []
+            conn.executemany(
+                'INSERT INTO mappings (mapping, key, value) VALUES (?, ?, ?) '
+                'ON CONFLICT (mapping, key) DO UPDATE '
+                'SET value = excluded.value',
+                [(key, k, v) for k, v in items])
+
+        elif key == 'schedule' and len(path) == 3:
+            room, slot = path[1:]
+            if slot in data['schedule'].get(room, {}):
+                conn.execute(
+                    'INSERT INTO schedule (room, key, value) VALUES (?, ?, ?) '
+                    'ON CONFLICT (room, key) DO UPDATE '
+                    'SET value = excluded.value',
+                    (room, slot, data['schedule'][room][slot]))
+
+        elif key == 'schedule':
+            conn.execute('DELETE FROM schedule')
+            conn.executemany(
+                'INSERT INTO schedule (room, key, value) VALUES (?, ?, ?)',
+                [(room, k, v) for room, bookings in data[key].items()
+                 for k, v in bookings.items()])
+
+        elif key == 'next':
+            if len(path) == 1:
+                conn.execute('DELETE FROM next')
+                items = data[key].items()
+            else:
+                conn.execute('DELETE FROM next WHERE track = ?', (path[1],))
+                items = [(path[1], data[key].get(path[1], []))]
+            conn.executemany(
+                'INSERT INTO next (track, session) VALUES (?, ?)',
+                [(track, session) for track, sessions in items
+                 for session in sessions])
+
+        elif key == 'tracks':
+            conn.execute('DELETE FROM tracks')
+            conn.executemany('INSERT INTO tracks (name) VALUES (?)',
+                             [(track,) for track in data[key]])
+
+        elif key == 'slots':
+            conn.execute('DELETE FROM slots')
+            conn.executemany(
+                'INSERT INTO slots (day, name, data) VALUES (?, ?, ?)',
+                [(day, slot['name'], json.dumps(slot))
+                 for day, slots in data[key].items() for slot in slots])
+
+        elif key == 'motd':
+            conn.execute('DELETE FROM motd')
+            conn.executemany(
+                'INSERT INTO motd (level, message) VALUES (?, ?)',
+                [(motd['level'], motd['message']) for motd in data[key]])
+
+        elif key in data:
+            conn.execute(
+                'INSERT INTO properties (key, value) VALUES (?, ?) '
+                'ON CONFLICT (key) DO UPDATE SET value = excluded.value',
+                (key, json.dumps(data[key])))
+
+
+ENGINES = OrderedDict([
+    ('json', JSONStorage),
+    ('journal', JournalStorage),
+    ('sqlite', SQLiteStorage),
+])
+
+
+def get_storage(config):
+    engine = config.get('db_engine', 'json')
+    if engine not in ENGINES:
+        raise ValueError("Unknown db_engine '%s' (should be one of %s)" %
+                         (engine, ', '.join(ENGINES)))
+    return ENGINES[engine](config)
@@ -0,0 +1,94 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from collections import OrderedDict
+import copy
+import hashlib
+import json
+import logging
+
+
+# How often (in seconds) to fetch the upstream schedule, by default
+SCHEDULE_SYNC_INTERVAL = 300
+# Keys of the upstream document which are imported. The others (like now,
+# last_check_in or subscriptions) are live state, only changed on IRC.
+SCHEDULE_KEYS = ('tracks', 'slots', 'schedule', 'urls', 'etherpads', 'links',
+                 'eventid')
+
+
+class ScheduleSync():
+    """Keeps the DB in sync with an upstream schedule.
+
+    The schedule is fetched periodically (with conditional requests), and
+    only imported when its schedule changed. Bookings made on IRC (with
+    '#TRACK book') are kept, as long as the upstream schedule leaves
+    their slot available.
+    """
+
+    log = logging.getLogger("ptgbot.sync")
+
+    def __init__(self, db, fetcher, url):
+        self.db = db
+        self.fetcher = fetcher
+        self.url = url
+        # Last schedule imported, as fetched, and its hash
+        self.upstream = None
+        self.digest = None
+
+    def poll(self):
+        self.fetcher.fetch(self.url, self.apply)
+
+    def apply(self, future):
+        # Runs on the reactor once the schedule is fetched
+        try:
+            document, changed = future.result()
+        except Exception as e:
+            self.log.warning("Error fetching schedule from %s: %s" %
+                             (self.url, e))
+            return
+        if not isinstance(document, dict):
+            self.log.warning("Invalid schedule at %s: not a JSON object" %
+                             self.url)
+            return
+        document = OrderedDict((key, document[key]) for key in SCHEDULE_KEYS
+                               if key in document)
+        digest = hashlib.sha256(
+            json.dumps(document, sort_keys=True).encode('utf-8')).hexdigest()
+        if digest == self.digest:
+            return
+        try:
+            summary = self.db.import_json(self.keep_local_bookings(document))
+        except ValueError as e:
+            self.log.warning("Invalid schedule at %s: %s" % (self.url, e))
+            return
+        self.log.info("Synced schedule from %s (%s)" % (self.url, summary))
+        self.upstream = document
+        self.digest = digest
+
+    def keep_local_bookings(self, document):
+        # Returns document, with the bookings of the DB in slots that the
+        # upstream schedule leaves available (and did so last time too,
+        # so that bookings removed upstream are removed locally)
+        if not isinstance(document.get('schedule'), dict):
+            return document
+        previous = (self.upstream or {}).get('schedule', {})
+        document = copy.copy(document)
+        document['schedule'] = copy.deepcopy(document['schedule'])
+        for room, bookings in document['schedule'].items():
+            local = self.db.data['schedule'].get(room, {})
+            if not isinstance(bookings, dict):
+                continue
+            for slot, track in bookings.items():
+                if (track == '' and local.get(slot) and
+                        not previous.get(room, {}).get(slot)):
+                    bookings[slot] = local[slot]
+        return document
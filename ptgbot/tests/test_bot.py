@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+test_bot
+--------
+Check that the bot sends messages correctly
+"""
+
+import irc.client
+import os
+import shutil
+import tempfile
+import testtools
+from unittest import mock
+
+from ptgbot.bot import PTGBot
+from ptgbot.bot import terminate
+from ptgbot.db import PTGDataBase
+
+
+class TestSendQueue(testtools.TestCase):
+
+    def setUp(self):
+        super(TestSendQueue, self).setUp()
+        self.db = PTGDataBase(
+            {'db_filename': 'base.json'},
+            write_to_disk=False
+        )
+        self.now = 1000.0
+        patcher = mock.patch('time.monotonic', side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.bot = PTGBot('', '', '', '', '#channel', self.db,
+                          send_rate=0.5, send_burst=2)
+        self.bot.connection = mock.Mock()
+        self.bot.reactor.scheduler = mock.Mock()
+
+    def sent(self):
+        return [c[0] for c in self.bot.connection.privmsg.call_args_list]
+
+    def test_send_burst_then_throttle(self):
+        for i in range(4):
+            self.bot.send('nick%d' % i, 'message %d' % i)
+        self.assertEqual([('nick0', 'message 0'), ('nick1', 'message 1')],
+                         self.sent())
+        # The rest is scheduled for when a token is available
+        self.bot.reactor.scheduler.execute_after.assert_called_once_with(
+            2.0, self.bot.send_pending)
+
+        self.now += 2
+        self.bot.send_pending()
+        self.assertEqual(3, len(self.sent()))
+        self.now += 2
+        self.bot.send_pending()
+        self.assertEqual(('nick3', 'message 3'), self.sent()[-1])
+        self.assertEqual(
+            2, self.bot.reactor.scheduler.execute_after.call_count)
+
+    def test_send_long_message(self):
+        self.bot.send('#channel', 'word ' * 200)
+        self.assertEqual(2, len(self.sent()))
+        self.assertEqual(1, len(self.bot.send_queue))
+
+    def test_send_does_not_block(self):
+        with mock.patch('time.sleep') as mock_sleep:
+            for i in range(10):
+                self.bot.send('#channel', 'message %d' % i)
+            self.assertFalse(mock_sleep.called)
+
+    def test_send_not_connected(self):
+        self.bot.connection.privmsg.side_effect = (
+            irc.client.ServerNotConnectedError)
+        self.bot.send('#channel', 'message')
+        self.bot.send('#channel', 'message')
+        self.assertEqual(0, len(self.bot.send_queue))
+
+
+class TestFlush(testtools.TestCase):
+
+    def test_failed_flush_logged_and_retried(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        db = PTGDataBase({'db_filename': os.path.join(tmpdir, 'ptg.json'),
+                          'db_flush_interval': 60000})
+        bot = PTGBot('', '', '', '', '#channel', db)
+        db.add_now('swift', 'Looking at me')
+        with mock.patch.object(db.storage, 'write',
+                               side_effect=OSError('No space left')), \
+                mock.patch.object(bot.log, 'exception') as mock_log:
+            bot.flush_db()
+            self.assertEqual(1, mock_log.call_count)
+        self.assertTrue(db.dirty)
+        with mock.patch.object(db.storage, 'write', return_value=0):
+            bot.flush_db()
+        self.assertFalse(db.dirty)
+
+    def test_terminate_unwinds(self):
+        self.assertRaises(SystemExit, terminate, 15, None)
+
+
+class TestMetrics(testtools.TestCase):
+
+    def test_failed_metrics_write_logged(self):
+        db = PTGDataBase({'db_filename': 'base.json'}, write_to_disk=False)
+        bot = PTGBot('', '', '', '', '#channel', db)
+        with mock.patch.object(bot.log, 'warning') as mock_warning:
+            bot.write_metrics('/nonexistent/ptgbot/metrics.txt')
+            self.assertEqual(1, mock_warning.call_count)
+
+
+class TestBatchReactor(testtools.TestCase):
+
+    def test_messages_read_at_once_saved_once(self):
+        db = PTGDataBase({'db_filename': 'base.json'}, write_to_disk=False)
+        bot = PTGBot('', '', '', '', '#channel', db)
+
+        def process_data(sockets):
+            db.add_now('swift', 'Looking at me')
+            db.add_now('nova', 'Looking at you')
+
+        with mock.patch('irc.client.Reactor.process_data',
+                        side_effect=process_data), \
+                mock.patch.object(db, 'flush') as mock_flush:
+            bot.reactor.process_data([])
+            self.assertEqual(1, mock_flush.call_count)
+
+    def test_failed_save_reported(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        db = PTGDataBase({'db_filename': os.path.join(tmpdir, 'ptg.json')})
+        bot = PTGBot('', '', '', '', '#channel', db)
+
+        def process_data(sockets):
+            db.add_now('swift', 'Looking at me')
+
+        with mock.patch('irc.client.Reactor.process_data',
+                        side_effect=process_data), \
+                mock.patch.object(db.storage, 'write',
+                                  side_effect=OSError(28, 'No space left')), \
+                mock.patch.object(bot, 'send') as mock_send, \
+                mock.patch.object(bot.log, 'error'):
+            bot.reactor.process_data([])
+            mock_send.assert_called_once_with(
+                '#channel', 'Bot airbag activated: [Errno 28] No space left')
+        self.assertEqual({'swift': 'Looking at me'}, db.data['now'])
+        self.assertTrue(db.dirty)
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+test_commands
+-------------
+Check that commands are dispatched correctly
+"""
+
+import testtools
+from unittest import mock
+
+from ptgbot.bot import PTGBot
+from ptgbot.commands import CommandTable
+from ptgbot.db import PTGDataBase
+
+
+class TestCommandTable(testtools.TestCase):
+
+    def setUp(self):
+        super(TestCommandTable, self).setUp()
+        self.commands = CommandTable('test')
+        self.calls = []
+
+        @self.commands.register('greet', 'hello', min_args=1, max_args=2,
+                                usage="Greet whom?")
+        def greet(who, params):
+            self.calls.append((who, params))
+            return "Hi %s" % params[0]
+
+    def test_dispatch(self):
+        self.assertEqual("Hi you",
+                         self.commands.dispatch('greet', 'me', ['you']))
+        self.assertEqual("Hi all",
+                         self.commands.dispatch('hello', 'me', ['all', 'x']))
+        self.assertEqual([('me', ['you']), ('me', ['all', 'x'])], self.calls)
+
+    def test_arity(self):
+        self.assertEqual("Greet whom?",
+                         self.commands.dispatch('greet', 'me', []))
+        self.assertEqual("Greet whom?",
+                         self.commands.dispatch('greet', 'me', list('abc')))
+        self.assertEqual([], self.calls)
+
+    def test_contains(self):
+        self.assertIn('hello', self.commands)
+        self.assertNotIn('bye', self.commands)
+
+
+class TestPublicCommands(testtools.TestCase):
+
+    def setUp(self):
+        super(TestPublicCommands, self).setUp()
+        self.db = PTGDataBase({'db_filename': 'base.json'},
+                              write_to_disk=False)
+        self.bot = PTGBot('', '', '', '', '#channel', self.db)
+
+    def test_chatter_not_parsed(self):
+        with mock.patch('ptgbot.bot.process_user_command') as mock_user, \
+                mock.patch('ptgbot.bot.process_track_command') as mock_track:
+            for chatter in ['hey ptgbot wazzzup', '', '   ', 'in #swift']:
+                self.assertIsNone(self.bot.handle_public_command(
+                    '#channel', 'johndoe', chatter))
+            self.assertFalse(mock_user.called)
+            self.assertFalse(mock_track.called)
+
+    def test_help_with_any_prefix(self):
+        self.assertIn('documentation', self.bot.handle_public_command(
+            '#channel', 'johndoe', '!HELP me'))
+
+    def test_permissions(self):
+        self.db.require_voice()
+        with mock.patch.object(self.bot, 'is_voiced', return_value=False), \
+                mock.patch.object(self.bot, 'is_chanop', return_value=False):
+            self.assertEqual("Need voice to issue commands",
+                             self.bot.handle_public_command(
+                                 '#channel', 'johndoe', '#swift now foo'))
+            self.assertEqual("Need op for admin commands",
+                             self.bot.handle_public_command(
+                                 '#channel', 'johndoe', '~list'))
+            # User commands do not need any
+            self.assertIn("checked into #swift",
+                          self.bot.handle_public_command(
+                              '#channel', 'johndoe', '#in swift'))
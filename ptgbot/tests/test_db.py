@@ -0,0 +1,475 @@
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+test_db
+-------
+Check that the database is persisted correctly
+"""
+
+import copy
+import datetime
+import json
+import os
+import random
+import shutil
+import tempfile
+import testtools
+from unittest import mock
+
+from ptgbot.db import PTGDataBase
+from ptgbot.records import CheckIn
+from ptgbot.records import Subscription
+from ptgbot.records import to_json
+
+
+class TestDataBase(testtools.TestCase):
+
+    def setUp(self):
+        super(TestDataBase, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.filename = os.path.join(self.tmpdir, 'ptg.json')
+        shutil.copy('base.json', self.filename)
+
+    def load_from_disk(self):
+        with open(self.filename, 'r') as fp:
+            return json.load(fp)
+
+    def test_save_writes_immediately_by_default(self):
+        db = PTGDataBase({'db_filename': self.filename})
+        db.add_now('swift', 'Looking at me')
+        self.assertEqual(self.load_from_disk()['now'],
+                         {'swift': 'Looking at me'})
+
+    def test_save_coalesces_writes(self):
+        db = PTGDataBase({'db_filename': self.filename,
+                          'db_flush_interval': 60000})
+        with mock.patch('ptgbot.storage.json.dump') as mock_dump:
+            db.add_now('swift', 'Looking at me')
+            db.add_next('swift', 'Looking at you')
+            db.check_in('johndoe', '#swift')
+            self.assertFalse(mock_dump.called)
+            self.assertTrue(db.dirty)
+            db.flush()
+            self.assertEqual(1, mock_dump.call_count)
+            self.assertFalse(db.dirty)
+            db.flush()
+            self.assertEqual(1, mock_dump.call_count)
+
+    def test_flush_writes_pending_changes(self):
+        db = PTGDataBase({'db_filename': self.filename,
+                          'db_flush_interval': 60000})
+        db.add_now('swift', 'Looking at me')
+        self.assertEqual(self.load_from_disk()['now'], {})
+        db.flush()
+        self.assertEqual(self.load_from_disk()['now'],
+                         {'swift': 'Looking at me'})
+
+    def test_batch_saves_once(self):
+        db = PTGDataBase({'db_filename': self.filename})
+        with mock.patch.object(db.storage, 'write',
+                               wraps=db.storage.write) as mock_write:
+            with db.batch():
+                db.add_now('swift', 'Looking at me')
+                with db.batch():
+                    db.add_next('swift', 'Looking at you')
+                db.check_in('johndoe', '#swift')
+                self.assertFalse(mock_write.called)
+            self.assertEqual(1, mock_write.call_count)
+            with db.batch():
+                pass
+            self.assertEqual(1, mock_write.call_count)
+        self.assertEqual(self.load_from_disk()['now'],
+                         {'swift': 'Looking at me'})
+
+    def test_save_replaces_file_atomically(self):
+        db = PTGDataBase({'db_filename': self.filename, 'db_fsync': 'dir'})
+        with open(self.filename, 'r') as reader:
+            db.add_now('swift', 'Looking at me')
+            # Readers of the previous version still see it complete
+            self.assertEqual(json.load(reader)['now'], {})
+        self.assertEqual(self.load_from_disk()['now'],
+                         {'swift': 'Looking at me'})
+        self.assertEqual(['ptg.json'], os.listdir(self.tmpdir))
+
+    def test_failed_save_keeps_previous_version(self):
+        db = PTGDataBase({'db_filename': self.filename})
+        with mock.patch('ptgbot.storage.json.dump', side_effect=IOError):
+            self.assertRaises(IOError, db.add_now, 'swift', 'Looking at me')
+        self.assertEqual(self.load_from_disk()['now'], {})
+        self.assertEqual(['ptg.json'], os.listdir(self.tmpdir))
+
+    def test_invalid_fsync_policy(self):
+        self.assertRaises(ValueError, PTGDataBase,
+                          {'db_filename': self.filename, 'db_fsync': 'yes'})
+
+    def test_invalid_engine(self):
+        self.assertRaises(ValueError, PTGDataBase,
+                          {'db_filename': self.filename, 'db_engine': 'csv'})
+
+    def test_journal_records_deferred_changes(self):
+        config = {'db_filename': self.filename,
+                  'db_engine': 'journal',
+                  'db_flush_interval': 60000}
+        db = PTGDataBase(config)
+        db.add_now('swift', 'Looking at me')
+        db.check_in('johndoe', '#swift')
+        db.book('swift', 'Aspen', 'FriP1')
+        self.assertEqual(self.load_from_disk()['now'], {})
+        self.assertTrue(os.path.getsize(self.filename + '.journal'))
+
+        # Simulate a crash: a new instance replays the journal
+        db = PTGDataBase(config)
+        self.assertEqual(db.data['now'], {'swift': 'Looking at me'})
+        self.assertEqual(db.data['last_check_in']['johndoe']['location'],
+                         '#swift')
+        self.assertEqual(db.data['schedule']['Aspen']['FriP1'], 'swift')
+        # ...and compacts it into the snapshot
+        self.assertEqual(self.load_from_disk()['now'],
+                         {'swift': 'Looking at me'})
+        self.assertFalse(os.path.exists(self.filename + '.journal'))
+
+    def test_journal_compacted_on_flush(self):
+        db = PTGDataBase({'db_filename': self.filename,
+                          'db_engine': 'journal',
+                          'db_flush_interval': 60000})
+        db.add_now('swift', 'Looking at me')
+        db.clean_tracks(['swift'])
+        db.flush()
+        self.assertEqual(0, os.path.getsize(self.filename + '.journal'))
+        self.assertEqual(self.load_from_disk()['now'], {})
+
+    def test_journal_ignores_partial_change(self):
+        config = {'db_filename': self.filename,
+                  'db_engine': 'journal',
+                  'db_flush_interval': 60000}
+        db = PTGDataBase(config)
+        db.add_now('swift', 'Looking at me')
+        with open(self.filename + '.journal', 'a') as fp:
+            fp.write('{"path": ["now", "nova"], "val')
+        db = PTGDataBase(config)
+        self.assertEqual(db.data['now'], {'swift': 'Looking at me'})
+
+    def test_journal_skips_changes_in_snapshot(self):
+        config = {'db_filename': self.filename,
+                  'db_engine': 'journal',
+                  'db_flush_interval': 60000}
+        db = PTGDataBase(config)
+        db.add_now('swift', 'Looking at me')
+        with open(self.filename + '.journal', 'r') as fp:
+            journal = fp.read()
+        db.add_now('swift', 'Looking at you')
+        db.flush()
+        # Simulate a crash before the journal was truncated
+        with open(self.filename + '.journal', 'w') as fp:
+            fp.write(journal)
+        db = PTGDataBase(config)
+        self.assertEqual(db.data['now'], {'swift': 'Looking at you'})
+
+    def test_journal_skipped_when_writing_right_away(self):
+        db = PTGDataBase({'db_filename': self.filename,
+                          'db_engine': 'journal',
+                          'db_flush_interval': 0})
+        with mock.patch.object(db.storage, 'record') as mock_record:
+            db.add_now('swift', 'Looking at me')
+            self.assertFalse(mock_record.called)
+        self.assertFalse(os.path.exists(self.filename + '.journal'))
+        self.assertEqual(self.load_from_disk()['now'],
+                         {'swift': 'Looking at me'})
+
+    def test_sqlite_migrates_json(self):
+        config = {'db_filename': self.filename, 'db_engine': 'sqlite'}
+        db = PTGDataBase(config)
+        self.assertTrue(os.path.exists(os.path.join(self.tmpdir,
+                                                    'ptg.sqlite')))
+        # The JSON file is now ignored
+        os.unlink(self.filename)
+        self.assertEqual(json.loads(json.dumps(db.data)),
+                         json.loads(json.dumps(PTGDataBase(config).data)))
+
+    def test_sqlite_records_changes(self):
+        config = {'db_filename': self.filename,
+                  'db_engine': 'sqlite',
+                  'db_flush_interval': 60000}
+        db = PTGDataBase(config)
+        db.add_now('swift', 'Looking at me')
+        db.add_next('swift', 'Looking at you')
+        db.check_in('johndoe', '#swift')
+        db.set_subscription('johndoe', 'swift')
+        db.book('swift', 'Aspen', 'FriP1')
+        db.add_color('swift', '#ffffff')
+        db.motd_add('info', 'foo bar')
+        db.add_tracks(['testtrack'])
+        db.add_url('swift', 'https://meetpad.opendev.org/swift')
+        db.add_url('swift', 'none')
+        self.assertEqual(self.load_from_disk()['now'], {})
+
+        reloaded = PTGDataBase(config)
+        self.assertEqual(json.loads(json.dumps(db.data, default=to_json)),
+                         json.loads(json.dumps(reloaded.data,
+                                               default=to_json)))
+        # ...and the JSON rendering is up to date
+        self.assertEqual(self.load_from_disk()['now'],
+                         {'swift': 'Looking at me'})
+
+    def test_sqlite_writes_changes_right_away(self):
+        config = {'db_filename': self.filename,
+                  'db_engine': 'sqlite',
+                  'db_flush_interval': 0}
+        db = PTGDataBase(config)
+        db.add_now('swift', 'Looking at me')
+        self.assertEqual(self.load_from_disk()['now'],
+                         {'swift': 'Looking at me'})
+        # The SQLite database is up to date too
+        os.unlink(self.filename)
+        self.assertEqual(PTGDataBase(config).data['now'],
+                         {'swift': 'Looking at me'})
+
+    def test_sqlite_retries_failed_write(self):
+        config = {'db_filename': self.filename,
+                  'db_engine': 'sqlite',
+                  'db_flush_interval': 0}
+        db = PTGDataBase(config)
+        with mock.patch('ptgbot.storage.write_atomically',
+                        side_effect=OSError(28, 'No space left')):
+            self.assertRaises(OSError, db.add_now, 'nova', 'hello')
+        self.assertTrue(db.dirty)
+        db.flush()
+        self.assertEqual(PTGDataBase(config).data['now'], {'nova': 'hello'})
+
+    def test_engine_default_flush_interval(self):
+        self.assertEqual(0, PTGDataBase(
+            {'db_filename': self.filename}).flush_interval)
+        self.assertEqual(1, PTGDataBase(
+            {'db_filename': self.filename,
+             'db_engine': 'journal'}).flush_interval)
+
+
+class TestCheckIns(testtools.TestCase):
+
+    def setUp(self):
+        super(TestCheckIns, self).setUp()
+        self.db = PTGDataBase({'db_filename': 'base.json'},
+                              write_to_disk=False)
+
+    def test_check_in_and_out(self):
+        self.db.check_in('JohnDoe', '#swift')
+        self.db.check_in('alice', '#swift')
+        self.db.check_in('bob', 'Aspen')
+        self.assertEqual({'#swift': ['JohnDoe', 'alice'], 'Aspen': ['bob']},
+                         self.db.data['checkins'])
+        # Checking in elsewhere moves you there
+        self.db.check_in('johndoe', 'Aspen')
+        self.assertEqual({'#swift': ['alice'], 'Aspen': ['bob', 'johndoe']},
+                         self.db.data['checkins'])
+        self.assertEqual('#swift', self.db.check_out('Alice'))
+        self.assertEqual({'Aspen': ['bob', 'johndoe']},
+                         self.db.data['checkins'])
+        self.db.new_day_cleanup()
+        self.assertEqual({}, self.db.data['checkins'])
+
+    def test_rebuilt_from_last_check_in(self):
+        self.db.check_in('alice', '#swift')
+        self.db.check_in('bob', '#swift')
+        self.db.check_out('bob')
+        checkins = json.loads(json.dumps(self.db.data['checkins']))
+        self.db.data['checkins'] = {}
+        self.db.build_checkins_index()
+        self.assertEqual({'#swift': ['alice']}, checkins)
+        self.assertEqual(checkins, self.db.data['checkins'])
+
+
+class TestRecords(testtools.TestCase):
+
+    def setUp(self):
+        super(TestRecords, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.filename = os.path.join(self.tmpdir, 'ptg.json')
+        shutil.copy('base.json', self.filename)
+
+    def test_records_persisted_as_json(self):
+        for engine in ('json', 'journal', 'sqlite'):
+            config = {'db_filename': self.filename, 'db_engine': engine,
+                      'db_flush_interval': 60000}
+            db = PTGDataBase(config)
+            db.check_in('JohnDoe', '#swift')
+            db.check_out('JohnDoe')
+            db.set_subscription('johndoe', 'swift')
+            check_in = db.data['last_check_in']['johndoe']
+            self.assertIsInstance(check_in, CheckIn)
+            self.assertEqual('#swift', check_in['location'])
+            db.flush()
+            reloaded = PTGDataBase(config)
+            self.assertEqual(check_in, reloaded.data['last_check_in'][
+                'johndoe'])
+            self.assertEqual('swift', reloaded.get_subscription('johndoe'))
+            with open(self.filename) as fp:
+                on_disk = json.load(fp)
+            self.assertEqual(check_in.to_json(),
+                             on_disk['last_check_in']['johndoe'])
+            self.assertEqual('swift', on_disk['subscriptions']['johndoe'])
+
+    def test_records_from_json(self):
+        check_in = CheckIn.from_json({'nick': 'Bob', 'location': 'Aspen',
+                                      'in': 'Monday 10:00', 'out': None})
+        self.assertEqual(CheckIn('Bob', 'Aspen', 'Monday 10:00'), check_in)
+        self.assertEqual('Monday 10:00', check_in.checked_in)
+        self.assertRaises(KeyError, check_in.__getitem__, 'desc')
+        self.assertRaises(TypeError, json.dumps, {'b': object()},
+                          default=to_json)
+
+    def test_subscription_compiled_once(self):
+        subscription = Subscription('swift')
+        self.assertIs(subscription.pattern, subscription.pattern)
+        self.assertIsNone(Subscription(None).pattern)
+        invalid = Subscription('(invalid')
+        with mock.patch.object(invalid.log, 'warning') as mock_warning:
+            self.assertIsNone(invalid.pattern)
+            self.assertIsNone(invalid.pattern)
+            self.assertEqual(1, mock_warning.call_count)
+        self.assertEqual('swift', subscription)
+
+
+class TestTracks(testtools.TestCase):
+
+    def setUp(self):
+        super(TestTracks, self).setUp()
+        self.db = PTGDataBase({'db_filename': 'base.json'},
+                              write_to_disk=False)
+
+    def test_tracks_kept_sorted(self):
+        tracks = self.db.list_tracks()
+        self.assertEqual(sorted(tracks), tracks)
+        self.db.add_tracks(['zun', 'aodh', 'swift', 'aodh'])
+        self.db.del_tracks(['nova', 'unknown'])
+        expected = sorted(set(tracks + ['zun', 'aodh']) - set(['nova']))
+        self.assertEqual(expected, self.db.list_tracks())
+        self.assertEqual(expected, self.db.data['tracks'])
+        self.assertTrue(self.db.is_track_valid('aodh'))
+        self.assertFalse(self.db.is_track_valid('nova'))
+        self.assertIn('zun', self.db.data['colors'])
+
+    def test_unsorted_tracks_sorted_on_load(self):
+        self.db.data['tracks'] = ['swift', 'nova', 'swift']
+        self.db.build_tracks_index()
+        self.assertEqual(['nova', 'swift'], self.db.list_tracks())
+
+
+class TestImport(testtools.TestCase):
+
+    def setUp(self):
+        super(TestImport, self).setUp()
+        self.db = PTGDataBase({'db_filename': 'base.json'},
+                              write_to_disk=False)
+
+    def test_import_saves_once(self):
+        schedule = copy.deepcopy(self.db.data['schedule'])
+        schedule['Aspen']['MonA1'] = 'zaqar'
+        schedule['Aspen']['MonA2'] = 'zun'
+        with mock.patch.object(self.db, 'flush') as mock_flush:
+            summary = self.db.import_json({'schedule': schedule,
+                                           'eventid': 'ptg2030'})
+            self.assertEqual(1, mock_flush.call_count)
+        self.assertEqual("tracks: 2 added, 0 removed; bookings: 2 changed; "
+                         "replaced eventid", summary)
+        self.assertTrue(self.db.is_track_valid('zun'))
+        self.assertIn('zun', self.db.data['colors'])
+        self.assertEqual("no changes", self.db.import_json(
+            {'schedule': schedule}))
+
+    def test_invalid_import_changes_nothing(self):
+        original = copy.deepcopy(self.db.data)
+        for document in ([], {'tracks': 'swift'},
+                         {'now': {}, 'slots': {'Monday': [{}]}},
+                         {'schedule': {'Aspen': {'MonA1': None}}},
+                         {'motd': ['hello']},
+                         {'motd': [{'level': 'info'}]},
+                         {'next': {'swift': 'oops'}}):
+            self.assertRaises(ValueError, self.db.import_json, document)
+        self.assertEqual(original, self.db.data)
+
+    def test_failed_import_save_changes_nothing(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        filename = os.path.join(tmpdir, 'ptg.json')
+        shutil.copy('base.json', filename)
+        for engine in ('json', 'sqlite'):
+            db = PTGDataBase({'db_filename': filename, 'db_engine': engine})
+            original = copy.deepcopy(db.data)
+            schedule = copy.deepcopy(db.data['schedule'])
+            schedule['Aspen']['MonA1'] = 'zaqar'
+            with mock.patch('ptgbot.storage.write_atomically',
+                            side_effect=OSError(28, 'No space left')):
+                self.assertRaises(OSError, db.import_json,
+                                  {'schedule': schedule})
+            self.assertEqual(original, db.data)
+            self.assertFalse(db.is_track_valid('zaqar'))
+            self.assertNotIn('zaqar', db.data['colors'])
+            # ...and on disk
+            reloaded = PTGDataBase({'db_filename': filename,
+                                    'db_engine': engine}, write_to_disk=False)
+            self.assertEqual(original['schedule'],
+                             reloaded.data['schedule'])
+
+
+class TestScheduleIndex(testtools.TestCase):
+
+    def setUp(self):
+        super(TestScheduleIndex, self).setUp()
+        self.db = PTGDataBase({'db_filename': 'base.json'},
+                              write_to_disk=False)
+
+    def scan_track_room(self, track, day):
+        # Reference implementation, scanning the whole schedule
+        for room, bookings in self.db.data['schedule'].items():
+            for btime, btrack in bookings.items():
+                for slot in self.db.data['slots'].get(day, []):
+                    if btrack == track and btime == slot['name']:
+                        return room
+        return None
+
+    def assertIndexCorrect(self):
+        # 2020-06-01 is a Monday
+        for offset, day in enumerate(self.db.data['slots']):
+            today = datetime.date(2020, 6, 1 + offset)
+            with mock.patch('datetime.date') as mock_date:
+                mock_date.today.return_value = today
+                for track in self.db.list_tracks():
+                    self.assertEqual(self.scan_track_room(track, day),
+                                     self.db.get_track_room(track))
+
+    def test_get_track_room(self):
+        self.assertIndexCorrect()
+
+    def test_index_follows_bookings(self):
+        rng = random.Random(42)
+        slots = [(room, slot)
+                 for room, bookings in self.db.data['schedule'].items()
+                 for slot in bookings if slot not in ('url', 'desc',
+                                                      'cap_icon',
+                                                      'cap_desc')]
+        for i in range(200):
+            room, slot = rng.choice(slots)
+            if self.db.is_slot_valid_and_empty(room, slot):
+                self.db.book(rng.choice(['swift', 'nova', 'oslo']),
+                             room, slot)
+            else:
+                self.db.unbook(room, slot)
+        self.assertIndexCorrect()
+
+    def test_empty_schedule(self):
+        self.db.empty()
+        self.assertIsNone(self.db.get_track_room('swift'))
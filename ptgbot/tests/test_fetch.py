@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+test_fetch
+----------
+Check that JSON documents are fetched in the background
+"""
+
+from irc.client import Event
+import http.server
+import json
+import testtools
+import threading
+import time
+from unittest import mock
+
+import requests
+
+from ptgbot.bot import PTGBot
+from ptgbot.db import PTGDataBase
+from ptgbot.fetch import Fetcher
+
+
+class ScheduleHandler(http.server.BaseHTTPRequestHandler):
+    """Serves the document of the server, with an ETag."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.requests.append(dict(self.headers))
+        time.sleep(self.server.delay)
+        etag = '"%d"' % self.server.version
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        body = self.server.body
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class TestFetcher(testtools.TestCase):
+
+    def setUp(self):
+        super(TestFetcher, self).setUp()
+        self.server = http.server.ThreadingHTTPServer(
+            ('127.0.0.1', 0), ScheduleHandler)
+        self.server.daemon_threads = True
+        self.server.requests = []
+        self.server.delay = 0
+        self.server.version = 1
+        self.server.body = json.dumps(
+            {'tracks': ['swift', 'nova', 'ptgbot']}).encode()
+        thread = threading.Thread(target=self.server.serve_forever,
+                                  kwargs={'poll_interval': 0.05})
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.url = 'http://127.0.0.1:%d/ptg.json' % self.server.server_port
+
+    def wait_for_results(self, fetcher):
+        fetcher.executor.submit(lambda: None).result()
+        fetcher.process_results()
+
+    def test_conditional_requests(self):
+        fetcher = Fetcher()
+        document = {'tracks': ['swift', 'nova', 'ptgbot']}
+        self.assertEqual((document, True), fetcher.get_json(self.url))
+        self.assertEqual((document, False), fetcher.get_json(self.url))
+        self.assertEqual('"1"', self.server.requests[1]['If-None-Match'])
+        self.server.version = 2
+        self.server.body = b'{"tracks": []}'
+        self.assertEqual(({'tracks': []}, True), fetcher.get_json(self.url))
+
+    def test_timeout(self):
+        self.server.delay = 0.5
+        fetcher = Fetcher(timeout=0.1)
+        self.assertRaises(requests.exceptions.Timeout,
+                          fetcher.get_json, self.url)
+
+    def test_callbacks_run_by_process_results(self):
+        fetcher = Fetcher()
+        callback = mock.Mock()
+        future = fetcher.fetch(self.url, callback)
+        future.result()
+        self.assertFalse(callback.called)
+        self.wait_for_results(fetcher)
+        callback.assert_called_once_with(future)
+
+    def test_fetchdb(self):
+        db = PTGDataBase({'db_filename': 'base.json'}, write_to_disk=False)
+        bot = PTGBot('', '', '', '', '#channel', db)
+        bot.is_chanop = mock.MagicMock(return_value=True)
+        msg = Event('',
+                    'johndoe!~johndoe@openstack/member/johndoe',
+                    '#channel',
+                    ['~fetchdb ' + self.url])
+        with mock.patch.object(bot, 'send') as mock_send:
+            bot.on_pubmsg('', msg)
+            self.assertFalse(mock_send.called)
+            self.wait_for_results(bot.fetcher)
+            mock_send.assert_called_once_with(
+                '#channel', "johndoe: Loaded DB from %s (tracks: 1 added, "
+                            "0 removed)" % self.url)
+            self.assertTrue(db.is_track_valid('ptgbot'))
+
+            mock_send.reset_mock()
+            bot.on_pubmsg('', msg)
+            self.wait_for_results(bot.fetcher)
+            mock_send.assert_called_once_with(
+                '#channel', "johndoe: Loaded DB from %s (no changes, "
+                            "unchanged since last fetched)" % self.url)
+
+            mock_send.reset_mock()
+            self.server.version = 2
+            self.server.body = b'not JSON'
+            bot.on_pubmsg('', msg)
+            self.wait_for_results(bot.fetcher)
+            self.assertIn("johndoe: Error loading DB: ",
+                          mock_send.call_args[0][1])
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+test_ics
+--------
+Check that calendars are generated correctly
+"""
+
+import icalendar
+import json
+import testtools
+
+from ptgbot.ics import Calendars
+
+
+class TestCalendars(testtools.TestCase):
+
+    def setUp(self):
+        super(TestCalendars, self).setUp()
+        with open('base.json', 'r') as fp:
+            self.db = json.load(fp)
+        for day, slots in enumerate(self.db['slots'].values()):
+            for hour, slot in enumerate(slots):
+                slot['realtime'] = '2020-06-%02dT%02d:00:00Z' % (day + 1,
+                                                                 hour + 9)
+        # Only keep bookings
+        for room in self.db['schedule'].values():
+            for key in ('cap_icon', 'cap_desc', 'desc'):
+                room.pop(key, None)
+        self.calendars = Calendars(self.db)
+
+    def summaries(self, ical):
+        calendar = icalendar.Calendar.from_ical(ical)
+        return [str(e['summary']) for e in calendar.walk('VEVENT')]
+
+    def test_team_calendar(self):
+        self.assertEqual(['[PTG] swift'] * 17,
+                         self.summaries(self.calendars.to_ical('swift')))
+        self.assertEqual([], self.summaries(self.calendars.to_ical('foo')))
+
+    def test_all_teams_calendar(self):
+        ical = self.calendars.to_ical('ALL')
+        self.assertEqual(ical, self.calendars.to_ical('ptg'))
+        summaries = self.summaries(ical)
+        self.assertEqual(17, summaries.count('[PTG] swift'))
+        self.assertEqual(16, summaries.count('[PTG] nova'))
+        self.assertEqual(
+            len([t for room in self.db['schedule'].values()
+                 for s, t in room.items() if s != 'url' and t]),
+            len(summaries))
+
+    def test_calendars_are_cached(self):
+        self.assertIs(self.calendars.to_ical('swift'),
+                      self.calendars.to_ical('swift'))
+        self.assertIs(self.calendars.team_events('swift'),
+                      self.calendars.team_events('swift'))
+
+    def test_unknown_teams_not_cached(self):
+        self.assertFalse(self.calendars.is_known('foo'))
+        self.assertTrue(self.calendars.is_known('ptg'))
+        self.calendars.to_ical('foo')
+        self.calendars.to_ical(['swift', 'foo'])
+        self.assertEqual({}, self.calendars.calendars)
+        self.assertEqual(['swift'], list(self.calendars.events))
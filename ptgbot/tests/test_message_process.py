@@ -129,6 +129,49 @@ class TestProcessMessage(testtools.TestCase):
         self.bot.on_pubmsg('', msg)
         self.assertFalse('swift' in self.db.data['next'])
 
+    def test_now_several_tracks(self):
+        msg = Event('',
+                    'johndoe!~johndoe@openstack/member/johndoe',
+                    '#channel',
+                    ['#swift,nova now Looking at us'])
+
+        with mock.patch.object(self.db, 'flush') as mock_flush:
+            self.bot.on_pubmsg('', msg)
+            self.assertEqual(1, mock_flush.call_count)
+        self.assertEqual(self.db.data['now'],
+                         {'swift': 'Looking at us', 'nova': 'Looking at us'})
+
+    def test_several_tracks_invalid(self):
+        msg = Event('',
+                    'johndoe!~johndoe@openstack/member/johndoe',
+                    '#channel',
+                    ['#swift,svift now Looking at me'])
+
+        with mock.patch.object(
+            self.bot, 'send',
+        ) as mock_send:
+            self.bot.on_pubmsg('', msg)
+            mock_send.assert_called_with(
+                '#channel',
+                "johndoe: Unknown track 'svift'"
+            )
+        self.assertEqual(self.db.data['now'], {})
+
+    def test_several_tracks_usage(self):
+        msg = Event('',
+                    'johndoe!~johndoe@openstack/member/johndoe',
+                    '#channel',
+                    ['#swift,nova now'])
+
+        with mock.patch.object(
+            self.bot, 'send',
+        ) as mock_send:
+            self.bot.on_pubmsg('', msg)
+            mock_send.assert_called_once_with(
+                '#channel',
+                "johndoe: Missing sentence (#TRACK now ...)"
+            )
+
     def test_etherpad(self):
         msg = Event('',
                     'johndoe!~johndoe@openstack/member/johndoe',
@@ -274,6 +317,9 @@ class TestProcessMessage(testtools.TestCase):
             'seen': "The 'seen' command needs a single nick argument.",
             'seen foo bar': "The 'seen' command needs a single nick argument.",
             'subscribe ***': "Invalid regex: nothing to repeat at position 0",
+            # Valid for re, but not when matching notifications with regex
+            'subscribe [[:foo:]]':
+                "Invalid regex: unknown property at position 8",
             'foo': "Unknown user command. "
                    "Should be: in, out, seen, or subscribe",
         }
@@ -467,6 +513,45 @@ class TestProcessMessage(testtools.TestCase):
             self.bot.on_pubmsg('', msg)
             self.assertFalse(mock_send.called)
 
+    def test_notify_several_tracks(self):
+        self.db.set_subscription('johndoe', 'topic')
+        self.db.set_subscription('janedoe', 'nova')
+        msg = Event('',
+                    'johndoe!~johndoe@openstack/member/johndoe',
+                    '#channel',
+                    ['#swift,nova next topic'])
+
+        with mock.patch.object(
+            self.bot, 'send',
+        ) as mock_send:
+            self.bot.on_pubmsg('', msg)
+            self.assertEqual([
+                mock.call('johndoe',
+                          'next in #swift, #nova: topic'),
+                mock.call('janedoe', 'next in #nova: topic'),
+            ], mock_send.call_args_list)
+
+    def test_subscribe_catastrophic_regex(self):
+        self.db.set_subscription('johndoe', '(a|aa)+c')
+        self.db.set_subscription('janedoe', 'aaa')
+        with mock.patch.object(
+            self.bot, 'send',
+        ) as mock_send:
+            msg = Event('',
+                        'jimdoe!~jimdoe@openstack/member/jimdoe',
+                        '#channel',
+                        ['#swift now ' + 'a' * 40])
+            self.bot.on_pubmsg('', msg)
+            self.assertEqual(1, mock_send.call_count)
+            self.assertEqual('janedoe', mock_send.call_args[0][0])
+
+    def test_subscription_patterns_cached(self):
+        self.db.set_subscription('johndoe', 'swift')
+        patterns = self.db.get_subscription_patterns()
+        self.assertIs(patterns, self.db.get_subscription_patterns())
+        self.db.set_subscription('johndoe', None)
+        self.assertEqual([], self.db.get_subscription_patterns())
+
     def test_admin_cmds_only_admins(self):
         msg = Event('',
                     'johndoe!~johndoe@openstack/member/johndoe',
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+test_metrics
+------------
+Check that metrics are collected and rendered correctly
+"""
+
+import os
+import shutil
+import tempfile
+import testtools
+
+from ptgbot.db import PTGDataBase
+from ptgbot import metrics
+
+
+class TestRegistry(testtools.TestCase):
+
+    def setUp(self):
+        super(TestRegistry, self).setUp()
+        self.registry = metrics.Registry()
+
+    def test_counter_and_gauge(self):
+        counter = self.registry.counter('test_total', 'Things', ('kind',))
+        counter.inc(kind='a')
+        counter.inc(2, kind='b "quoted"')
+        self.registry.gauge('test_length', 'Length').set(3)
+        self.assertEqual(
+            '# HELP test_total Things\n'
+            '# TYPE test_total counter\n'
+            'test_total{kind="a"} 1\n'
+            'test_total{kind="b \\"quoted\\""} 2\n'
+            '# HELP test_length Length\n'
+            '# TYPE test_length gauge\n'
+            'test_length 3\n',
+            self.registry.render())
+
+    def test_histogram(self):
+        histogram = self.registry.histogram('test_seconds', 'Time',
+                                            buckets=(0.1, 1))
+        for value in (0.05, 0.5, 0.5, 2):
+            histogram.observe(value)
+        self.assertEqual(
+            '# HELP test_seconds Time\n'
+            '# TYPE test_seconds histogram\n'
+            'test_seconds_bucket{le="0.1"} 1\n'
+            'test_seconds_bucket{le="1"} 3\n'
+            'test_seconds_bucket{le="+Inf"} 4\n'
+            'test_seconds_sum 3.05\n'
+            'test_seconds_count 4\n',
+            self.registry.render())
+
+    def test_same_metric(self):
+        self.assertIs(self.registry.counter('test_total', 'Things'),
+                      self.registry.counter('test_total', 'Things'))
+
+    def test_write(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        filename = os.path.join(tmpdir, 'metrics.txt')
+        self.registry.counter('test_total', 'Things').inc()
+        self.registry.write(filename)
+        with open(filename) as fp:
+            self.assertEqual(self.registry.render(), fp.read())
+
+
+class TestDataBaseMetrics(testtools.TestCase):
+
+    def test_write_bytes(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        filename = os.path.join(tmpdir, 'ptg.json')
+        shutil.copy('base.json', filename)
+        db = PTGDataBase({'db_filename': filename})
+        before = metrics.REGISTRY.render()
+        db.add_now('swift', 'Looking at me')
+        after = metrics.REGISTRY.render()
+        self.assertNotEqual(before, after)
+        self.assertIn('ptgbot_db_write_bytes_sum', after)
+        self.assertIn('ptgbot_db_save_seconds_count', after)
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+test_sync
+---------
+Check that the DB is kept in sync with the upstream schedule
+"""
+
+from concurrent.futures import Future
+import copy
+import testtools
+from unittest import mock
+
+from ptgbot.db import PTGDataBase
+from ptgbot.sync import ScheduleSync
+
+
+class TestScheduleSync(testtools.TestCase):
+
+    def setUp(self):
+        super(TestScheduleSync, self).setUp()
+        self.db = PTGDataBase({'db_filename': 'base.json'},
+                              write_to_disk=False)
+        self.fetcher = mock.Mock()
+        self.sync = ScheduleSync(self.db, self.fetcher, 'http://upstream')
+        self.schedule = copy.deepcopy(self.db.data['schedule'])
+
+    def fetched(self, document, changed=True):
+        future = Future()
+        future.set_result((copy.deepcopy(document), changed))
+        self.sync.apply(future)
+
+    def test_poll(self):
+        self.sync.poll()
+        self.fetcher.fetch.assert_called_once_with('http://upstream',
+                                                   self.sync.apply)
+
+    def test_imports_changed_content_only(self):
+        with mock.patch.object(self.db, 'import_json',
+                               wraps=self.db.import_json) as mock_import:
+            self.fetched({'eventid': 'ptg1'})
+            self.fetched({'eventid': 'ptg1'})
+            self.fetched({'eventid': 'ptg1'}, changed=False)
+            self.assertEqual(1, mock_import.call_count)
+            self.fetched({'eventid': 'ptg2'})
+            self.assertEqual(2, mock_import.call_count)
+        self.assertEqual('ptg2', self.db.data['eventid'])
+
+    def test_keeps_local_bookings(self):
+        self.fetched({'schedule': self.schedule})
+        self.assertEqual('', self.db.data['schedule']['Aspen']['ThuA1'])
+        self.db.book('swift', 'Aspen', 'ThuA1')
+        self.db.book('swift', 'Aspen', 'ThuA2')
+        self.schedule['Aspen']['ThuA2'] = 'nova'
+        self.schedule['Aspen']['MonA1'] = ''
+        self.fetched({'schedule': self.schedule})
+        # Still available upstream
+        self.assertEqual('swift', self.db.data['schedule']['Aspen']['ThuA1'])
+        # Booked upstream
+        self.assertEqual('nova', self.db.data['schedule']['Aspen']['ThuA2'])
+        # Unbooked upstream
+        self.assertEqual('', self.db.data['schedule']['Aspen']['MonA1'])
+
+    def test_keeps_live_state(self):
+        self.db.add_now('swift', 'Looking at me')
+        self.db.check_in('johndoe', '#swift')
+        self.db.set_subscription('johndoe', 'swift')
+        self.db.motd_add('info', 'Welcome')
+        upstream = copy.deepcopy(self.db.data)
+        upstream['schedule']['Aspen']['ThuA1'] = 'nova'
+        for key in ('now', 'last_check_in', 'subscriptions', 'motd'):
+            upstream[key] = type(upstream[key])()
+        self.fetched(upstream)
+        self.assertEqual('nova', self.db.data['schedule']['Aspen']['ThuA1'])
+        self.assertEqual({'swift': 'Looking at me'}, self.db.data['now'])
+        self.assertEqual({'#swift': ['johndoe']}, self.db.data['checkins'])
+        self.assertEqual('swift', self.db.get_subscription('johndoe'))
+        self.assertEqual(1, len(self.db.data['motd']))
+
+    def test_fetch_errors_logged(self):
+        future = Future()
+        future.set_exception(IOError('unreachable'))
+        with mock.patch.object(self.sync.log, 'warning') as mock_warning:
+            self.sync.apply(future)
+            self.fetched({'tracks': 'swift'})
+            self.assertEqual(2, mock_warning.call_count)
+        self.assertIsNone(self.sync.digest)
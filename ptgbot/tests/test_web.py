@@ -0,0 +1,349 @@
+# -*- coding: utf-8 -*-
+
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""
+test_web
+--------
+Check that the web server serves the DB correctly
+"""
+
+import gzip
+import http.client
+import json
+import os
+import shutil
+import tempfile
+import testtools
+import threading
+from unittest import mock
+
+from ptgbot.db import PTGDataBase
+from ptgbot.web import DBCache
+from ptgbot.web import diff_documents
+from ptgbot.web import EventBroadcaster
+from ptgbot.web import make_server
+from ptgbot.web import RequestHandler
+from ptgbot.web import StaticFiles
+
+
+class TestDBCache(testtools.TestCase):
+
+    def setUp(self):
+        super(TestDBCache, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.filename = os.path.join(self.tmpdir, 'ptg.json')
+        shutil.copy('base.json', self.filename)
+        self.db = PTGDataBase({'db_filename': self.filename})
+        self.cache = DBCache(self.filename, check_interval=0)
+
+    def test_reads_file_once(self):
+        with mock.patch('builtins.open', wraps=open) as mock_open:
+            version = self.cache.get()
+            self.assertIs(version, self.cache.get())
+            self.assertEqual(1, mock_open.call_count)
+
+    def test_reloads_changed_file(self):
+        version = self.cache.get()
+        self.assertEqual({}, version.document['now'])
+        self.db.add_now('swift', 'Looking at me')
+        self.assertEqual({'swift': 'Looking at me'},
+                         self.cache.get().document['now'])
+        self.assertNotEqual(version.etag, self.cache.get().etag)
+
+    def test_check_interval(self):
+        cache = DBCache(self.filename, check_interval=3600)
+        self.assertEqual({}, cache.get().document['now'])
+        self.db.add_now('swift', 'Looking at me')
+        self.assertEqual({}, cache.get().document['now'])
+
+
+class TestDiffDocuments(testtools.TestCase):
+
+    def test_diff(self):
+        old = {'now': {'swift': 'foo', 'nova': 'bar'},
+               'motd': [], 'timestamp': '1'}
+        new = {'now': {'swift': 'baz', 'oslo': 'qux'},
+               'motd': [{'level': 'info', 'message': 'hi'}],
+               'timestamp': '2'}
+        changes, keys = diff_documents(old, new)
+        self.assertEqual([
+            {'field': 'now', 'track': 'swift', 'value': 'baz'},
+            {'field': 'now', 'track': 'oslo', 'value': 'qux'},
+            {'field': 'now', 'track': 'nova', 'value': None},
+        ], changes)
+        self.assertEqual(['motd'], keys)
+
+    def test_no_diff(self):
+        doc = {'now': {'swift': 'foo'}, 'timestamp': '1'}
+        self.assertEqual(([], []), diff_documents(doc, dict(doc)))
+
+
+class TestRequestHandler(testtools.TestCase):
+
+    workers = 0
+
+    def setUp(self):
+        super(TestRequestHandler, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.filename = os.path.join(self.tmpdir, 'ptg.json')
+        shutil.copy('base.json', self.filename)
+        self.db = PTGDataBase({'db_filename': self.filename})
+        # Calendars can only be generated for slots with a realtime
+        for slots in self.db.data['slots'].values():
+            for slot in slots:
+                slot.setdefault('realtime', '2020-06-01T09:00:00Z')
+        self.db.add_now('swift', 'Looking at me')
+
+        cache = DBCache(self.filename, check_interval=0)
+        patcher = mock.patch.object(RequestHandler, 'db', cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        events = EventBroadcaster(cache, check_interval=0.01)
+        self.addCleanup(events.close)
+        patcher = mock.patch.object(RequestHandler, 'events', events)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.server = make_server(0, self.workers, '127.0.0.1')
+        self.addCleanup(self.server.server_close)
+        thread = threading.Thread(target=self.server.serve_forever,
+                                  kwargs={'poll_interval': 0.05})
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(self.server.shutdown)
+
+    def connect(self):
+        conn = http.client.HTTPConnection(*self.server.server_address)
+        self.addCleanup(conn.close)
+        return conn
+
+    def get(self, path, headers={}, conn=None):
+        conn = conn or self.connect()
+        conn.request('GET', path, headers=headers)
+        response = conn.getresponse()
+        return response, response.read()
+
+    def test_ptg_json(self):
+        response, body = self.get('/ptg.json')
+        self.assertEqual(200, response.status)
+        with open(self.filename, 'rb') as fp:
+            self.assertEqual(fp.read(), body)
+        self.assertIsNotNone(response.getheader('ETag'))
+        self.assertIsNotNone(response.getheader('Last-Modified'))
+
+    def test_ptg_json_not_modified(self):
+        response, body = self.get('/ptg.json')
+        etag = response.getheader('ETag')
+        response, body = self.get('/ptg.json', {'If-None-Match': etag})
+        self.assertEqual(304, response.status)
+        self.assertEqual(b'', body)
+        response, body = self.get('/ptg.json', {
+            'If-Modified-Since': response.getheader('Last-Modified')})
+        self.assertEqual(304, response.status)
+
+        self.db.add_now('swift', 'Looking at you')
+        response, body = self.get('/ptg.json', {'If-None-Match': etag})
+        self.assertEqual(200, response.status)
+        self.assertNotEqual(etag, response.getheader('ETag'))
+
+    def test_checkins_json(self):
+        self.db.check_in('johndoe', '#swift')
+        response, body = self.get('/checkins.json')
+        self.assertEqual(200, response.status)
+        self.assertEqual({'#swift': ['johndoe']}, json.loads(body))
+        etag = response.getheader('ETag')
+        response, body = self.get('/checkins.json', {'If-None-Match': etag})
+        self.assertEqual(304, response.status)
+
+    def test_projection(self):
+        response, body = self.get('/now.json')
+        self.assertEqual(200, response.status)
+        now = json.loads(body)
+        self.assertEqual({'swift': 'Looking at me'}, now['now'])
+        self.assertNotIn('subscriptions', now)
+        self.assertNotIn('last_check_in', now)
+        response, body = self.get('/motd.json')
+        self.assertEqual(['motd'], list(json.loads(body)))
+        response, body = self.get('/nothing.json')
+        self.assertEqual(404, response.status)
+
+    def test_projection_not_modified(self):
+        response, body = self.get('/schedule.json')
+        etag = response.getheader('ETag')
+        # The schedule is unchanged, even though the DB is not
+        self.db.add_now('swift', 'Looking at you')
+        response, body = self.get('/schedule.json', {'If-None-Match': etag})
+        self.assertEqual(304, response.status)
+        self.db.book('swift', 'Aspen', 'FriP1')
+        response, body = self.get('/schedule.json', {'If-None-Match': etag})
+        self.assertEqual(200, response.status)
+        schedule = json.loads(body)['schedule']
+        self.assertEqual('swift', schedule['Aspen']['FriP1'])
+
+    def test_gzip(self):
+        response, body = self.get('/ptg.json',
+                                  {'Accept-Encoding': 'gzip, deflate'})
+        self.assertEqual(200, response.status)
+        self.assertEqual('gzip', response.getheader('Content-Encoding'))
+        self.assertEqual('Accept-Encoding', response.getheader('Vary'))
+        with open(self.filename, 'rb') as fp:
+            self.assertEqual(fp.read(), gzip.decompress(body))
+        etag = response.getheader('ETag')
+        response, body = self.get('/ptg.json', {'Accept-Encoding': 'gzip',
+                                                'If-None-Match': etag})
+        self.assertEqual(304, response.status)
+        # The uncompressed version is a different representation
+        response, body = self.get('/ptg.json', {'If-None-Match': etag})
+        self.assertEqual(200, response.status)
+        self.assertIsNone(response.getheader('Content-Encoding'))
+
+    def test_gzip_refused(self):
+        response, body = self.get('/ptg.json',
+                                  {'Accept-Encoding': 'gzip;q=0'})
+        self.assertIsNone(response.getheader('Content-Encoding'))
+
+    def test_static_files(self):
+        conn = self.connect()
+        gzip_ok = {'Accept-Encoding': 'gzip'}
+        response, body = self.get('/ptgbot/html/handlebars-4.0.6.js',
+                                  gzip_ok, conn)
+        self.assertEqual(200, response.status)
+        self.assertEqual('gzip', response.getheader('Content-Encoding'))
+        self.assertIn('immutable', response.getheader('Cache-Control'))
+        with open('ptgbot/html/handlebars-4.0.6.js', 'rb') as fp:
+            self.assertEqual(fp.read(), gzip.decompress(body))
+
+        response, body = self.get('/ptgbot/html/ptg.js', {}, conn)
+        self.assertEqual('no-cache', response.getheader('Cache-Control'))
+        response, body = self.get('/ptgbot/html/ptg.js', {
+            'If-None-Match': response.getheader('ETag')}, conn)
+        self.assertEqual(304, response.status)
+
+        # Images are already compressed
+        response, body = self.get('/ptgbot/html/logo.png', gzip_ok, conn)
+        self.assertIsNone(response.getheader('Content-Encoding'))
+
+        response, body = self.get('/ptgbot/html/nothing.js', {}, conn)
+        self.assertEqual(404, response.status)
+
+    def test_files_next_to_db_not_cached(self):
+        for name in ('ptg.json.journal', 'ptg.sqlite', '.ptg.json.tmp',
+                     'index.html'):
+            with open(os.path.join(self.tmpdir, name), 'w') as fp:
+                fp.write(name)
+        static = StaticFiles()
+        static.preload(self.tmpdir)
+        self.assertEqual([os.path.join(self.tmpdir, 'index.html')],
+                         list(static.files))
+
+    def test_preload_skips_vanished_files(self):
+        static = StaticFiles()
+        with mock.patch.object(static, 'get',
+                               side_effect=FileNotFoundError), \
+                mock.patch('logging.warning') as mock_warning:
+            static.preload('ptgbot/html')
+            self.assertTrue(mock_warning.called)
+
+    def test_metrics(self):
+        self.get('/ptg.json')
+        metrics_filename = os.path.join(self.tmpdir, 'metrics.txt')
+        with open(metrics_filename, 'w') as fp:
+            fp.write('ptgbot_sent_messages_total 42\n')
+        with mock.patch.object(RequestHandler, 'metrics_filename',
+                               metrics_filename):
+            response, body = self.get('/metrics')
+        self.assertEqual(200, response.status)
+        body = body.decode('utf-8')
+        self.assertIn('ptgbot_web_request_seconds_count'
+                      '{path="ptg.json",status="200"}', body)
+        self.assertIn('ptgbot_sent_messages_total 42\n', body)
+
+    def read_event(self, response):
+        event = {}
+        for line in iter(response.readline, b'\n'):
+            field, value = line.decode('utf-8').rstrip('\n').split(': ', 1)
+            event[field] = value
+        return event
+
+    def test_events(self):
+        conn = self.connect()
+        conn.request('GET', '/events')
+        response = conn.getresponse()
+        self.assertEqual(200, response.status)
+        self.assertEqual('text/event-stream',
+                         response.getheader('Content-type'))
+        self.assertIn('retry', self.read_event(response))
+
+        self.db.add_now('swift', 'Looking at you')
+        event = self.read_event(response)
+        self.assertEqual('update', event['event'])
+        self.assertEqual([{'field': 'now', 'track': 'swift',
+                           'value': 'Looking at you'}],
+                         json.loads(event['data'])['changes'])
+
+        self.db.motd_add('info', 'Hello')
+        event = self.read_event(response)
+        self.assertEqual('reload', event['event'])
+        self.assertEqual(['motd'], json.loads(event['data'])['keys'])
+
+        # Other requests are still served
+        response, body = self.get('/ptg.json')
+        self.assertEqual(200, response.status)
+
+    def test_ics_not_modified(self):
+        response, body = self.get('/swift.ics')
+        self.assertEqual(200, response.status)
+        self.assertIn(b'BEGIN:VCALENDAR', body)
+        etag = response.getheader('ETag')
+        response, body = self.get('/nova.ics', {'If-None-Match': etag})
+        self.assertEqual(200, response.status)
+        response, body = self.get('/swift.ics', {'If-None-Match': etag})
+        self.assertEqual(304, response.status)
+
+    def test_ics_unknown_team(self):
+        response, body = self.get('/nosuchteam.ics')
+        self.assertEqual(404, response.status)
+        version = RequestHandler.db.get()
+        self.assertEqual({}, version.calendars.calendars)
+        self.assertEqual({}, version.compressed)
+
+
+class TestThreadPoolRequestHandler(TestRequestHandler):
+
+    workers = 4
+
+    def test_keepalive(self):
+        conn = self.connect()
+        response, body = self.get('/ptg.json', conn=conn)
+        self.assertFalse(response.will_close)
+        response, body = self.get('/ptg.json', conn=conn)
+        self.assertEqual(200, response.status)
+
+    def test_concurrent_clients(self):
+        # An idle keep-alive connection does not block other clients
+        idle = self.connect()
+        self.get('/ptg.json', conn=idle)
+        response, body = self.get('/ptg.json')
+        self.assertEqual(200, response.status)
+
+    def test_ics_cached(self):
+        with mock.patch('icalendar.Event.to_ical',
+                        return_value=b'BEGIN:VEVENT\r\nEND:VEVENT\r\n'
+                        ) as mock_to_ical:
+            response, swift = self.get('/swift.ics')
+            calls = mock_to_ical.call_count
+            self.assertTrue(calls)
+            self.assertEqual(swift, self.get('/swift.ics')[1])
+            self.assertEqual(calls, mock_to_ical.call_count)
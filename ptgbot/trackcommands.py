@@ -12,29 +12,80 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import re
+from collections import OrderedDict
 
+from ptgbot.commands import CommandTable
+from ptgbot.metrics import REGISTRY
 
+# Maximum time (in seconds) spent matching the event against a single
+# subscription, so that a regexp with catastrophic backtracking cannot
+# freeze the bot
+MATCH_TIMEOUT = 0.05
+
+NOTIFY_SECONDS = REGISTRY.histogram(
+    'ptgbot_notify_seconds',
+    'Time spent matching an event against all subscriptions')
+NOTIFICATIONS = REGISTRY.counter(
+    'ptgbot_notifications_total', 'Notifications sent to subscribers')
+
+
+class Notifications():
+    """Notifications of the tracks a command is run for.
+
+    Subscribers matching several of these tracks are sent a single
+    message listing them all, once the command ran for every track.
+    """
+
+    def __init__(self, botsend):
+        self.botsend = botsend
+        # (nick, adverb, sentence) -> tracks (and locations) matched
+        self.pending = OrderedDict()
+
+    def __call__(self, nick, message):
+        # Anything else is sent right away
+        self.botsend(nick, message)
+
+    def add(self, nick, adverb, trackloc, sentence):
+        self.pending.setdefault((nick, adverb, sentence), []).append(trackloc)
+
+    def send(self):
+        for (nick, adverb, sentence), tracklocs in self.pending.items():
+            # Note: there is no guarantee that nick will be online
+            # at this point.  However if not, the bot will receive
+            # a 401 :No such nick/channel message which it will
+            # ignore due to the lack of a nosuchnick handler.
+            # Fortunately this is the behaviour we want.
+            self.botsend(nick, "%s in %s: %s" % (
+                adverb, ', '.join(tracklocs), sentence))
+            NOTIFICATIONS.inc()
+        self.pending.clear()
+
+
+@NOTIFY_SECONDS.time()
 def notify(db, botsend, track, adverb, sentence):
+    # botsend can be the Notifications of a multi-track command, which
+    # sends them when the command is complete
+    notifications = botsend
+    if not isinstance(botsend, Notifications):
+        notifications = Notifications(botsend)
+
     location = db.get_location(track)
     track = '#' + track
     trackloc = track
     if location is not None:
         trackloc = "%s (%s)" % (track, location)
 
-    for nick, regexp in db.get_subscriptions().items():
-        if regexp is None:
-            # Person did #unsubscribe, so skip
+    event_text = " ".join([track, adverb, sentence])
+    for nick, pattern in db.get_subscription_patterns():
+        try:
+            matched = pattern.search(event_text, timeout=MATCH_TIMEOUT)
+        except TimeoutError:
             continue
-        event_text = " ".join([track, adverb, sentence])
-        if re.search(regexp, event_text, re.IGNORECASE):
-            message = "%s in %s: %s" % (adverb, trackloc, sentence)
-            # Note: there is no guarantee that nick will be online
-            # at this point.  However if not, the bot will receive
-            # a 401 :No such nick/channel message which it will
-            # ignore due to the lack of a nosuchnick handler.
-            # Fortunately this is the behaviour we want.
-            botsend(nick, message)
+        if matched:
+            notifications.add(nick, adverb, trackloc, sentence)
+
+    if notifications is not botsend:
+        notifications.send()
 
 
 def not_scheduled_today(db, track):
@@ -43,75 +94,110 @@ def not_scheduled_today(db, track):
                 "appear to have a room scheduled today." % track)
 
 
+TRACK_COMMANDS = CommandTable('track', permission='voice')
+
+
 def process_track_command(db, botsend, track, params):
-    if not db.is_track_valid(track):
-        return "Unknown track '%s'" % track
+    # track can list several tracks, separated by commas, to run the same
+    # command for all of them
+    tracks = list(OrderedDict.fromkeys(track.split(',')))
+    for track in tracks:
+        if not db.is_track_valid(track):
+            return "Unknown track '%s'" % track
 
     if len(params) < 1:
         return "Missing track command (#TRACK [now|next|clean...] ...)"
 
     adverb = params[0].lower()
-    sentence = str.join(' ', params[1:])
-
-    if adverb == 'now':
-        if len(params) < 2:
-            return "Missing sentence (#TRACK now ...)"
-        db.add_now(track, sentence)
-        notify(db, botsend, track, adverb, sentence)
-        return not_scheduled_today(db, track)
-
-    elif adverb == 'next':
-        if len(params) < 2:
-            return "Missing sentence (#TRACK next ...)"
-        db.add_next(track, sentence)
-        notify(db, botsend, track, adverb, sentence)
-        return not_scheduled_today(db, track)
-
-    elif adverb in ('clean', 'clear'):
-        if len(params) > 1:
-            return "'#TRACK clean' does not take any parameter"
-        db.clean_tracks([track])
-
-    elif adverb == 'etherpad':
-        if len(params) != 2:
-            return "'#TRACK etherpad' takes a single URL parameter"
-        db.add_etherpad(track, params[1])
-
-    elif adverb == 'url':
-        if len(params) != 2:
-            return "'#TRACK url' takes a single URL parameter"
-        db.add_url(track, params[1])
-
-    elif adverb == 'color':
-        if len(params) != 2:
-            return "'#TRACK color' takes a single colorcode parameter"
-        db.add_color(track, params[1])
-
-    elif adverb == 'location':
-        db.add_location(track, sentence)
-
-    elif adverb == 'book':
-        if len(params) != 2:
-            return "'#TRACK book' takes a single slotname parameter"
-        room, sep, tslot = params[1].partition('-')
-        if db.is_slot_valid_and_empty(room, tslot):
-            db.book(track, room, tslot)
-            return "Room %s is now booked on %s for %s" % (room, tslot, track)
-        else:
-            return "Slot '%s' is invalid (or booked)" % params[1]
-
-    elif adverb == 'unbook':
-        if len(params) != 2:
-            return "'#TRACK unbook' takes a single slotname parameter"
-        room, sep, tslot = params[1].partition('-')
-        if db.is_slot_booked_for_track(track, room, tslot):
-            db.unbook(room, tslot)
-            return ("Room %s (previously booked for %s) is now free on %s" %
-                    (room, track, tslot))
-        else:
-            return ("Slot '%s' is invalid (or not booked for %s)" %
-                    (params[1], track))
-
-    else:
+    if adverb not in TRACK_COMMANDS:
         return ("Unknown command '%s'. Did you mean: %s now %s... ?" %
-                (adverb, track, adverb))
+                (adverb, tracks[0], adverb))
+    if len(tracks) == 1:
+        return TRACK_COMMANDS.dispatch(adverb, db, botsend, track,
+                                       params[1:])
+
+    # Changes are saved once, and identical replies (like usage messages)
+    # are only returned once
+    notifications = Notifications(botsend)
+    with db.batch():
+        replies = [TRACK_COMMANDS.dispatch(adverb, db, notifications, track,
+                                           params[1:])
+                   for track in tracks]
+    notifications.send()
+    replies = list(OrderedDict.fromkeys(reply for reply in replies if reply))
+    return ' '.join(replies) or None
+
+
+@TRACK_COMMANDS.register('now', min_args=1,
+                         usage="Missing sentence (#TRACK now ...)")
+def set_now(db, botsend, track, params):
+    sentence = str.join(' ', params)
+    db.add_now(track, sentence)
+    notify(db, botsend, track, 'now', sentence)
+    return not_scheduled_today(db, track)
+
+
+@TRACK_COMMANDS.register('next', min_args=1,
+                         usage="Missing sentence (#TRACK next ...)")
+def set_next(db, botsend, track, params):
+    sentence = str.join(' ', params)
+    db.add_next(track, sentence)
+    notify(db, botsend, track, 'next', sentence)
+    return not_scheduled_today(db, track)
+
+
+@TRACK_COMMANDS.register('clean', 'clear', max_args=0,
+                         usage="'#TRACK clean' does not take any parameter")
+def clean(db, botsend, track, params):
+    db.clean_tracks([track])
+
+
+@TRACK_COMMANDS.register('etherpad', min_args=1, max_args=1,
+                         usage="'#TRACK etherpad' takes a single URL "
+                               "parameter")
+def set_etherpad(db, botsend, track, params):
+    db.add_etherpad(track, params[0])
+
+
+@TRACK_COMMANDS.register('url', min_args=1, max_args=1,
+                         usage="'#TRACK url' takes a single URL parameter")
+def set_url(db, botsend, track, params):
+    db.add_url(track, params[0])
+
+
+@TRACK_COMMANDS.register('color', min_args=1, max_args=1,
+                         usage="'#TRACK color' takes a single colorcode "
+                               "parameter")
+def set_color(db, botsend, track, params):
+    db.add_color(track, params[0])
+
+
+@TRACK_COMMANDS.register('location')
+def set_location(db, botsend, track, params):
+    db.add_location(track, str.join(' ', params))
+
+
+@TRACK_COMMANDS.register('book', min_args=1, max_args=1,
+                         usage="'#TRACK book' takes a single slotname "
+                               "parameter")
+def book(db, botsend, track, params):
+    room, sep, tslot = params[0].partition('-')
+    if db.is_slot_valid_and_empty(room, tslot):
+        db.book(track, room, tslot)
+        return "Room %s is now booked on %s for %s" % (room, tslot, track)
+    else:
+        return "Slot '%s' is invalid (or booked)" % params[0]
+
+
+@TRACK_COMMANDS.register('unbook', min_args=1, max_args=1,
+                         usage="'#TRACK unbook' takes a single slotname "
+                               "parameter")
+def unbook(db, botsend, track, params):
+    room, sep, tslot = params[0].partition('-')
+    if db.is_slot_booked_for_track(track, room, tslot):
+        db.unbook(room, tslot)
+        return ("Room %s (previously booked for %s) is now free on %s" %
+                (room, track, tslot))
+    else:
+        return ("Slot '%s' is invalid (or not booked for %s)" %
+                (params[0], track))
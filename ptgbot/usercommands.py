@@ -21,7 +21,9 @@
 # it will be lower-cased.  This assumes that all registered tracks
 # are lower-case.
 
-import re
+import regex
+
+from ptgbot.commands import CommandTable
 
 
 def normalize_location(tracks, location):
@@ -39,80 +41,92 @@ def normalize_location(tracks, location):
             return location
 
 
+USER_COMMANDS = CommandTable('user')
+
+
 def process_user_command(db, nick, cmd, params):
-    if cmd == 'in':
-        if len(params) == 0:
-            return "The 'in' command should be followed by a location."
+    if cmd not in USER_COMMANDS:
+        return "Unknown user command. Should be: in, out, seen, or subscribe"
+    return USER_COMMANDS.dispatch(cmd, db, nick, params)
+
+
+@USER_COMMANDS.register('in', min_args=1,
+                        usage="The 'in' command should be followed by a "
+                              "location.")
+def check_in(db, nick, params):
+    location = " ".join(params)
+    try:
+        location = normalize_location(db.track_set, location)
+    except ValueError as e:
+        return "Unrecognised track #%s" % e
+
+    db.check_in(nick, location)
+    return "OK, checked into %s - thanks for the update!" % location
+
+
+@USER_COMMANDS.register('out', max_args=0,
+                        usage="The 'out' command does not accept any extra "
+                              "parameters.")
+def check_out(db, nick, params):
+    last_check_in = db.get_last_check_in(nick)
+    if last_check_in.location is None:
+        return "You weren't checked in anywhere yet!"
+
+    if last_check_in.checked_out is not None:
+        return ("You already checked out of %s at %s!" %
+                (last_check_in.location, last_check_in.checked_out))
+
+    location = db.check_out(nick)
+    return "OK, checked out of %s - thanks for the update!" % location
+
+
+@USER_COMMANDS.register('seen', min_args=1, max_args=1,
+                        usage="The 'seen' command needs a single nick "
+                              "argument.")
+def seen(db, nick, params):
+    seen_nick = params[0]
+    last_check_in = db.get_last_check_in(seen_nick)
+
+    if last_check_in.location is None:
+        return "%s never checked in anywhere" % seen_nick
+    elif last_check_in.checked_out is None:
+        return ("%s was last seen in %s at %s" % (
+                last_check_in.nick,
+                last_check_in.location,
+                last_check_in.checked_in))
+    else:
+        return ("%s checked out of %s at %s" % (
+                last_check_in.nick,
+                last_check_in.location,
+                last_check_in.checked_out))
 
-        location = " ".join(params)
-        try:
-            location = normalize_location(db.list_tracks(), location)
-        except ValueError as e:
-            return "Unrecognised track #%s" % e
-
-        db.check_in(nick, location)
-        return "OK, checked into %s - thanks for the update!" % location
-
-    elif cmd == 'out':
-        if len(params) > 0:
-            return "The 'out' command does not accept any extra parameters."
-
-        last_check_in = db.get_last_check_in(nick)
-        if last_check_in['location'] is None:
-            return "You weren't checked in anywhere yet!"
-
-        if last_check_in['out'] is not None:
-            return ("You already checked out of %s at %s!" %
-                    (last_check_in['location'], last_check_in['out']))
-
-        location = db.check_out(nick)
-        return "OK, checked out of %s - thanks for the update!" % location
-
-    elif cmd == 'seen':
-        if len(params) != 1:
-            return "The 'seen' command needs a single nick argument."
-
-        seen_nick = params[0]
-        last_check_in = db.get_last_check_in(seen_nick)
-
-        if last_check_in['location'] is None:
-            return "%s never checked in anywhere" % seen_nick
-        elif last_check_in['out'] is None:
-            return ("%s was last seen in %s at %s" % (
-                    last_check_in['nick'],
-                    last_check_in['location'],
-                    last_check_in['in']))
-        else:
-            return ("%s checked out of %s at %s" % (
-                    last_check_in['nick'],
-                    last_check_in['location'],
-                    last_check_in['out']))
-
-    elif cmd == 'subscribe':
-        new_re = str.join(' ', params)
-        existing_re = db.get_subscription(nick)
-        if new_re == "":
-            if existing_re is None:
-                return "You don't have a subscription regex set yet"
-            else:
-                return "Your current subscription regex is: " + existing_re
-        else:
-            try:
-                re.compile(new_re)
-            except Exception as e:
-                return "Invalid regex: %s" % e
-            else:
-                db.set_subscription(nick, new_re)
-                return ("Subscription set to " + new_re +
-                        (" (was %s)" % existing_re if existing_re else ""))
-
-    elif cmd == 'unsubscribe':
-        existing_re = db.get_subscription(nick)
+
+@USER_COMMANDS.register('subscribe')
+def subscribe(db, nick, params):
+    new_re = str.join(' ', params)
+    existing_re = db.get_subscription(nick)
+    if new_re == "":
         if existing_re is None:
             return "You don't have a subscription regex set yet"
         else:
-            db.set_subscription(nick, None)
-            return "Cancelled subscription %s" % existing_re
+            return "Your current subscription regex is: " + existing_re
+    else:
+        try:
+            # Compiled as when matching notifications
+            regex.compile(new_re, regex.IGNORECASE)
+        except Exception as e:
+            return "Invalid regex: %s" % e
+        else:
+            db.set_subscription(nick, new_re)
+            return ("Subscription set to " + new_re +
+                    (" (was %s)" % existing_re if existing_re else ""))
+
 
+@USER_COMMANDS.register('unsubscribe')
+def unsubscribe(db, nick, params):
+    existing_re = db.get_subscription(nick)
+    if existing_re is None:
+        return "You don't have a subscription regex set yet"
     else:
-        return "Unknown user command. Should be: in, out, seen, or subscribe"
+        db.set_subscription(nick, None)
+        return "Cancelled subscription %s" % existing_re
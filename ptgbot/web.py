@@ -1,37 +1,553 @@
 import argparse
+import concurrent.futures
 import daemon
 import daemon.pidfile
+import datetime
+import email.utils
+import gzip
+import hashlib
 import http.server
 import importlib.resources
 import json
 import logging
+import mimetypes
 import os
+import re
 import socketserver
+import threading
+import time
 
 import ptgbot.ics
+from ptgbot.metrics import REGISTRY
+
+try:
+    import brotli
+except ImportError:
+    # Brotli is optional: without it, responses are only gzip-compressed
+    brotli = None
 
 
 CONFIG = {}
+# How often (in seconds) to check whether the DB file changed
+DB_CHECK_INTERVAL = 1
+# How long (in seconds) to keep idle keep-alive connections open when
+# serving requests with a pool of workers
+KEEPALIVE_TIMEOUT = 2
+# Subsets of the DB served as <name>.json, so that each page only
+# downloads what it renders
+PROJECTIONS = {
+    'now': ('tracks', 'now', 'next', 'location', 'colors', 'checkins',
+            'timestamp'),
+    'schedule': ('slots', 'schedule', 'urls'),
+    'etherpads': ('tracks', 'etherpads', 'eventid'),
+    'motd': ('motd',),
+    'links': ('links',),
+}
+# Keys of the DB for which the event stream sends changes track by track.
+# For other keys, it only tells which ones changed, so that pages reload
+# them.
+EVENT_KEYS = ('now', 'next', 'location', 'colors', 'urls', 'checkins')
+# How often (in seconds) to send something on idle event streams, so that
+# proxies keep them open and disconnected clients are noticed
+EVENTS_KEEPALIVE = 15
+# How long (in seconds) to wait for a client to accept an event
+EVENTS_SEND_TIMEOUT = 1
+# How long (in milliseconds) clients wait before reconnecting to the
+# event stream
+EVENTS_RETRY = 3000
+# Content encodings supported, in order of preference
+ENCODINGS = ('br', 'gzip') if brotli else ('gzip',)
+# Besides text/*, content types worth compressing
+COMPRESSIBLE_TYPES = ('application/json', 'image/svg+xml', 'font/ttf',
+                      'application/vnd.ms-fontobject')
+# Static files with a version in their name never change, so browsers can
+# keep them for this long (in seconds) without checking with us
+VERSIONED_FILE = re.compile(r'-\d+(\.\d+)+\.')
+VERSIONED_MAX_AGE = 365 * 24 * 3600
+# Extensions of the static files of the web pages, which are kept in
+# memory. Other files (like the DB and what the bot keeps next to it) may
+# change, so they are read from disk on every request.
+STATIC_EXTENSIONS = ('.html', '.js', '.css', '.png', '.jpg', '.gif', '.ico',
+                     '.svg', '.eot', '.ttf', '.woff', '.woff2')
+
+REQUEST_SECONDS = REGISTRY.histogram(
+    'ptgbot_web_request_seconds', 'Time spent serving requests',
+    ('path', 'status'))
+
+
+def path_label(path):
+    # Requests are counted per endpoint, with all calendars and all
+    # static files together, so that there is a bounded number of them
+    name = os.path.basename(path.split('?')[0])
+    if name.endswith('.ics'):
+        return '*.ics'
+    if (name in ('ptg.json', 'checkins.json', 'events', 'metrics') or
+            name.endswith('.json') and name[:-5] in PROJECTIONS):
+        return name
+    return 'static'
+
+
+def is_compressible(content_type):
+    return (content_type.startswith('text/') or
+            content_type in COMPRESSIBLE_TYPES)
+
+
+def compress(content, encoding):
+    if encoding == 'br':
+        return brotli.compress(content)
+    # mtime=0 makes the output only depend on the content
+    return gzip.compress(content, compresslevel=9, mtime=0)
+
+
+def encoded_etag(etag, encoding):
+    # Each encoding of some content is a different representation of it,
+    # which needs its own ETag
+    return '%s-%s"' % (etag[:-1], encoding)
+
+
+class DBVersion():
+    """A version of the DB file, as read from disk."""
+
+    def __init__(self, content, mtime):
+        self.content = content
+        self.mtime = mtime
+        self.etag = '"%s"' % hashlib.sha1(content).hexdigest()
+        self._document = None
+        self._calendars = None
+        self._checkins = None
+        self._projections = {}
+        # Compressed content generated from this version, by ETag
+        self.compressed = {}
+
+    @property
+    def document(self):
+        # The parsed DB. It must not be modified, as it is shared by all
+        # requests served from this version.
+        if self._document is None:
+            self._document = json.loads(self.content)
+        return self._document
+
+    @property
+    def calendars(self):
+        # Calendars are built from the DB once per version
+        if self._calendars is None:
+            self._calendars = ptgbot.ics.Calendars(self.document)
+        return self._calendars
+
+    @property
+    def checkins(self):
+        # Who is checked in where, without the rest of the DB
+        if self._checkins is None:
+            self._checkins = json.dumps(
+                self.document.get('checkins', {})).encode('utf-8')
+        return self._checkins
+
+    def projection(self, name):
+        # Returns the content of a projection of this version and its
+        # ETag. As it only depends on the projected keys, the ETag stays
+        # the same across versions where none of them changed.
+        if name not in self._projections:
+            content = json.dumps(dict(
+                (key, self.document[key]) for key in PROJECTIONS[name]
+                if key in self.document)).encode('utf-8')
+            self._projections[name] = (
+                content, '"%s"' % hashlib.sha1(content).hexdigest())
+        return self._projections[name]
+
+    def derived_etag(self, name):
+        # ETag of content generated from this version of the DB
+        return '"%s"' % hashlib.sha1(
+            (self.etag + name).encode('utf-8')).hexdigest()
+
+
+class DBCache():
+    """Keep the current version of the DB file in memory.
+
+    The file is only read again when its inode, size or modification time
+    changed, which is what happens when the bot writes a new version of it.
+    This is checked at most once every DB_CHECK_INTERVAL seconds.
+    """
+
+    def __init__(self, filename, check_interval=DB_CHECK_INTERVAL):
+        self.filename = filename
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        self.signature = None
+        self.version = None
+        self.last_check = None
+
+    def refresh(self):
+        now = time.monotonic()
+        if (self.last_check is not None and
+                now - self.last_check < self.check_interval):
+            return
+        self.last_check = now
+        st = os.stat(self.filename)
+        if (st.st_ino, st.st_size, st.st_mtime_ns) == self.signature:
+            return
+        with open(self.filename, 'rb') as fp:
+            # Use the signature of the file actually read, in case it was
+            # replaced since the stat() above
+            st = os.fstat(fp.fileno())
+            self.version = DBVersion(fp.read(), st.st_mtime)
+        self.signature = (st.st_ino, st.st_size, st.st_mtime_ns)
+
+    def get(self):
+        # Returns the current DBVersion
+        with self.lock:
+            self.refresh()
+            return self.version
+
+
+def diff_documents(old, new):
+    # Returns the changes between two versions of the DB, as a list of
+    # per-track changes of EVENT_KEYS and a list of other changed keys
+    changes = []
+    keys = []
+    for key in sorted(set(old) | set(new)):
+        if key == 'timestamp' or old.get(key) == new.get(key):
+            continue
+        if key not in EVENT_KEYS:
+            keys.append(key)
+            continue
+        before = old.get(key) or {}
+        after = new.get(key) or {}
+        for track in after:
+            if before.get(track) != after[track]:
+                changes.append({'field': key, 'track': track,
+                                'value': after[track]})
+        for track in before:
+            if track not in after:
+                changes.append({'field': key, 'track': track,
+                                'value': None})
+    return changes, keys
+
+
+class StaticFiles():
+    """Keep the static files served by ptgbot-web in memory.
+
+    The files and their compressed versions are only read and compressed
+    once, as they do not change while ptgbot-web runs. Only static assets
+    of the web pages (see is_static()) are kept.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.files = {}
+        # Compressed content of the files, by ETag
+        self.compressed = {}
+
+    @staticmethod
+    def is_static(path):
+        name = os.path.basename(path)
+        return (not name.startswith('.') and
+                os.path.splitext(name)[1] in STATIC_EXTENSIONS)
+
+    def get(self, path):
+        # Returns the content, ETag and modification time of the file
+        with self.lock:
+            if path not in self.files:
+                with open(path, 'rb') as fp:
+                    content = fp.read()
+                    mtime = os.fstat(fp.fileno()).st_mtime
+                self.files[path] = (
+                    content, '"%s"' % hashlib.sha1(content).hexdigest(),
+                    mtime)
+            return self.files[path]
+
+    def preload(self, directory):
+        # Read and compress all files in directory, so that none of this
+        # happens while serving requests
+        for root, dirs, files in os.walk(directory):
+            dirs[:] = [name for name in dirs if not name.startswith('.')]
+            for name in files:
+                path = os.path.join(root, name)
+                if not self.is_static(path):
+                    continue
+                try:
+                    content, etag, mtime = self.get(path)
+                except OSError as e:
+                    logging.warning('Could not preload %s: %s', path, e)
+                    continue
+                content_type = mimetypes.guess_type(path)[0]
+                if content_type and is_compressible(content_type):
+                    for encoding in ENCODINGS:
+                        self.compressed[encoded_etag(etag, encoding)] = \
+                            compress(content, encoding)
+
+
+class EventBroadcaster():
+    """Push the changes of the DB to the clients of the event stream.
+
+    Request handlers hand their connection over once they sent the
+    headers of the event stream, so that clients keeping the page open do
+    not hold a worker (or the only server thread). A single thread then
+    watches the DB and writes its changes to all of them, as Server-Sent
+    Events.
+    """
+
+    def __init__(self, db, check_interval=DB_CHECK_INTERVAL,
+                 keepalive=EVENTS_KEEPALIVE):
+        self.db = db
+        self.check_interval = check_interval
+        self.keepalive = keepalive
+        self.lock = threading.Lock()
+        self.clients = []
+        self.version = None
+        self.thread = None
+        self.stopped = threading.Event()
+
+    def add(self, sock):
+        sock.settimeout(EVENTS_SEND_TIMEOUT)
+        with self.lock:
+            if self.thread is None:
+                self.version = self.db.get()
+                self.thread = threading.Thread(
+                    target=self.run, name='ptgbot-events', daemon=True)
+                self.thread.start()
+            if self.send_to(sock, b'retry: %d\n\n' % EVENTS_RETRY):
+                self.clients.append(sock)
+
+    def send_to(self, sock, message):
+        # Returns whether the client is still connected
+        try:
+            sock.sendall(message)
+            return True
+        except OSError:
+            sock.close()
+            return False
+
+    def send(self, message):
+        with self.lock:
+            self.clients = [sock for sock in self.clients
+                            if self.send_to(sock, message)]
+
+    def format_events(self, old, new):
+        changes, keys = diff_documents(old.document, new.document)
+        timestamp = new.document.get('timestamp')
+        message = b''
+        if changes:
+            message += b'event: update\ndata: %s\n\n' % json.dumps(
+                {'timestamp': timestamp, 'changes': changes}).encode('utf-8')
+        if keys:
+            message += b'event: reload\ndata: %s\n\n' % json.dumps(
+                {'timestamp': timestamp, 'keys': keys}).encode('utf-8')
+        return message
+
+    def run(self):
+        last_sent = time.monotonic()
+        while not self.stopped.wait(self.check_interval):
+            try:
+                version = self.db.get()
+            except OSError:
+                logging.exception('Could not read the DB')
+                continue
+            if version is not self.version:
+                message = self.format_events(self.version, version)
+                self.version = version
+            elif time.monotonic() - last_sent >= self.keepalive:
+                message = b': keepalive\n\n'
+            else:
+                continue
+            if message:
+                self.send(message)
+                last_sent = time.monotonic()
+
+    def close(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+        with self.lock:
+            for sock in self.clients:
+                sock.close()
+            self.clients = []
 
 
 class RequestHandler(http.server.SimpleHTTPRequestHandler):
+    db = None
+    events = None
+    static = StaticFiles()
+    # Where the bot writes its metrics, served along with ours
+    metrics_filename = None
+
     def do_GET(self):
+        start = time.perf_counter()
+        self.status = None
+        try:
+            self.serve()
+        finally:
+            REQUEST_SECONDS.observe(time.perf_counter() - start,
+                                    path=path_label(self.path),
+                                    status=self.status)
+
+    def send_response(self, code, message=None):
+        self.status = code
+        super(RequestHandler, self).send_response(code, message)
+
+    def serve(self):
+        name, ext = os.path.splitext(os.path.basename(self.path))
         if self.path.endswith('ptg.json'):
-            with open(CONFIG['db_filename'], 'rb') as fp:
-                self.send_response(200)
-                self.send_header('Content-type', 'application/json')
-                self.end_headers()
-                self.wfile.write(fp.read())
-        elif self.path.endswith('.ics'):
-            team = os.path.basename(self.path)[:-4]
-            with open(CONFIG['db_filename'], 'rb') as fp:
-                ics = ptgbot.ics.json2ical(json.load(fp), team)
+            version = self.db.get()
+            self.send_content(version.content, 'application/json',
+                              version.etag, version.mtime,
+                              version.compressed)
+        elif self.path.endswith('checkins.json'):
+            version = self.db.get()
+            self.send_content(version.checkins, 'application/json',
+                              version.derived_etag('checkins'),
+                              version.mtime, version.compressed)
+        elif ext == '.json' and name in PROJECTIONS:
+            version = self.db.get()
+            content, etag = version.projection(name)
+            self.send_content(content, 'application/json', etag,
+                              version.mtime, version.compressed)
+        elif self.path.endswith('/events') and self.events is not None:
             self.send_response(200)
-            self.send_header('Content-type', 'text/calendar')
+            self.send_header('Content-type', 'text/event-stream')
+            self.send_header('Cache-Control', 'no-cache')
             self.end_headers()
-            self.wfile.write(ics)
+            # From now on, events are sent by the broadcaster
+            self.close_connection = True
+            self.server.detach_request(self.request)
+            self.events.add(self.request)
+        elif self.path.endswith('/metrics'):
+            self.send_metrics()
+        elif self.path.endswith('.ics'):
+            team = os.path.basename(self.path)[:-4]
+            version = self.db.get()
+            if not version.calendars.is_known(team):
+                self.send_error(404, "Unknown team")
+                return
+            # Calendars only depend on the DB version and the team, and
+            # are only generated when they need to be sent
+            self.send_content(
+                lambda: version.calendars.to_ical(team), 'text/calendar',
+                version.derived_etag(team), version.mtime,
+                version.compressed)
         else:
+            self.send_static()
+
+    def send_metrics(self):
+        content = REGISTRY.render()
+        if self.metrics_filename:
+            try:
+                with open(self.metrics_filename, 'r') as fp:
+                    content += fp.read()
+            except OSError as e:
+                logging.warning('Could not read bot metrics: %s', e)
+        content = content.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(content)))
+        self.send_header('Cache-Control', 'no-store')
+        self.end_headers()
+        self.wfile.write(content)
+
+    def send_static(self):
+        path = self.translate_path(self.path)
+        content = None
+        if os.path.isfile(path) and self.static.is_static(path):
+            try:
+                content, etag, mtime = self.static.get(path)
+            except OSError:
+                pass
+        if content is None:
+            # Let SimpleHTTPRequestHandler deal with directories, errors
+            # and files which may change
             http.server.SimpleHTTPRequestHandler.do_GET(self)
+            return
+        if VERSIONED_FILE.search(os.path.basename(path)):
+            cache_control = 'public, max-age=%d, immutable' % (
+                VERSIONED_MAX_AGE)
+        else:
+            cache_control = 'no-cache'
+        self.send_content(content, self.guess_type(path), etag, mtime,
+                          self.static.compressed, cache_control)
+
+    def choose_encoding(self, content_type):
+        # Returns the preferred encoding accepted by the client, if any
+        if not is_compressible(content_type):
+            return None
+        accepted = {}
+        for item in self.headers.get('Accept-Encoding', '').split(','):
+            coding, _, params = item.partition(';')
+            quality = 1.0
+            for param in params.split(';'):
+                name, _, value = param.strip().partition('=')
+                if name == 'q':
+                    try:
+                        quality = float(value)
+                    except ValueError:
+                        pass
+            accepted[coding.strip().lower()] = quality
+        for encoding in ENCODINGS:
+            if accepted.get(encoding, 0) > 0:
+                return encoding
+        return None
+
+    def is_not_modified(self, etag, mtime):
+        # If-None-Match takes precedence over If-Modified-Since (RFC 9110)
+        if 'If-None-Match' in self.headers:
+            tags = [t.strip() for t in
+                    self.headers['If-None-Match'].split(',')]
+            return etag in tags or '*' in tags
+        if 'If-Modified-Since' in self.headers:
+            try:
+                since = email.utils.parsedate_to_datetime(
+                    self.headers['If-Modified-Since'])
+            except (TypeError, ValueError):
+                return False
+            if since.tzinfo is None:
+                since = since.replace(tzinfo=datetime.timezone.utc)
+            return int(mtime) <= since.timestamp()
+        return False
+
+    def send_validators(self, etag, mtime, cache_control='no-cache',
+                        vary=False):
+        # By default, let browsers cache the content, but always check
+        # with us whether it is still current
+        self.send_header('Cache-Control', cache_control)
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified',
+                         email.utils.formatdate(mtime, usegmt=True))
+        if vary:
+            self.send_header('Vary', 'Accept-Encoding')
+
+    def send_not_modified(self, etag, mtime, cache_control='no-cache',
+                          vary=False):
+        self.send_response(304)
+        self.send_validators(etag, mtime, cache_control, vary)
+        self.end_headers()
+
+    def send_content(self, content, content_type, etag, mtime,
+                     compressed=None, cache_control='no-cache'):
+        # content can also be a function returning it, which is then only
+        # called when it needs to be sent. Compressed versions of it are
+        # kept in the compressed dict, if any.
+        vary = is_compressible(content_type)
+        encoding = self.choose_encoding(content_type)
+        if encoding:
+            etag = encoded_etag(etag, encoding)
+        if self.is_not_modified(etag, mtime):
+            self.send_not_modified(etag, mtime, cache_control, vary)
+            return
+        if callable(content):
+            content = content()
+        if encoding:
+            body = compressed.get(etag) if compressed is not None else None
+            if body is None:
+                body = compress(content, encoding)
+                if compressed is not None:
+                    compressed[etag] = body
+            content = body
+        self.send_response(200)
+        self.send_header('Content-type', content_type)
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        self.send_header('Content-Length', str(len(content)))
+        self.send_validators(etag, mtime, cache_control, vary)
+        self.end_headers()
+        self.wfile.write(content)
 
     def log_message(self, format, *args):
         logging.debug("%s - - [%s] %s" % (self.address_string(),
@@ -39,21 +555,113 @@ class RequestHandler(http.server.SimpleHTTPRequestHandler):
                                           format % args))
 
 
+class KeepAliveRequestHandler(RequestHandler):
+    # HTTP/1.1 keeps connections open between requests, which is only
+    # reasonable when other clients can be served in the meantime
+    protocol_version = 'HTTP/1.1'
+    timeout = KEEPALIVE_TIMEOUT
+
+    def end_headers(self):
+        # Rather than waiting for this client's next request, let this
+        # worker serve the connections waiting for one
+        if self.server.waiting:
+            self.send_header('Connection', 'close')
+        super(KeepAliveRequestHandler, self).end_headers()
+
+
+class Server(socketserver.TCPServer):
+    """TCPServer where request handlers can keep their connection open."""
+
+    def __init__(self, *args, **kwargs):
+        super(Server, self).__init__(*args, **kwargs)
+        self.detached = set()
+
+    def detach_request(self, request):
+        # The connection is not closed once the handler returns, it is
+        # now up to whoever it was handed over to
+        self.detached.add(request)
+
+    def shutdown_request(self, request):
+        if request in self.detached:
+            self.detached.discard(request)
+            return
+        super(Server, self).shutdown_request(request)
+
+
+class ThreadPoolServer(Server):
+    """TCPServer handling requests in a bounded pool of threads.
+
+    Unlike socketserver.ThreadingTCPServer, which starts a thread per
+    connection, no more than `workers` connections are served at the same
+    time. Others wait in the queue until a worker is available.
+    """
+
+    request_queue_size = 128
+
+    def __init__(self, server_address, handler, workers,
+                 bind_and_activate=True):
+        super(ThreadPoolServer, self).__init__(server_address, handler,
+                                               bind_and_activate)
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix='ptgbot-web')
+        # Number of accepted connections waiting for a worker
+        self.waiting = 0
+        self.waiting_lock = threading.Lock()
+
+    def process_request(self, request, client_address):
+        with self.waiting_lock:
+            self.waiting += 1
+        self.executor.submit(self.process_request_thread,
+                             request, client_address)
+
+    def process_request_thread(self, request, client_address):
+        with self.waiting_lock:
+            self.waiting -= 1
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super(ThreadPoolServer, self).server_close()
+        self.executor.shutdown(wait=True)
+
+
+def make_server(port, workers=0, address=''):
+    # With no workers, serve requests one at a time in the main thread
+    if workers:
+        server = ThreadPoolServer((address, port), KeepAliveRequestHandler,
+                                  workers, bind_and_activate=False)
+    else:
+        server = Server((address, port), RequestHandler,
+                        bind_and_activate=False)
+    # In a fast restart of the service we don't have time for all the TCP
+    # sessions to drain the sockets in TIME_WAIT.  So the service fails to
+    # restart with a "bind address in use".   To avoid this we want to add
+    # SO_REUSEADDR and SO_REUSEPORT.  To do so we have to disable
+    # bind_and_activate so we can then set allow_reuse_address and
+    # allow_reuse_address on the TCPServer before we bind.
+    server.allow_reuse_address = True
+    server.allow_reuse_port = True
+    try:
+        server.server_bind()
+        server.server_activate()
+    except Exception:
+        server.server_close()
+        raise
+    return server
+
+
 def start():
+    RequestHandler.db = DBCache(CONFIG['db_filename'])
+    RequestHandler.events = EventBroadcaster(RequestHandler.db)
+    RequestHandler.metrics_filename = CONFIG['metrics_filename']
     with importlib.resources.as_file(CONFIG['source_dir']) as html_dir:
         os.chdir(html_dir)
-        # In a fast restart of the service we don't have time for all the TCP
-        # sessions to drain the sockets in TIME_WAIT.  So the service fails to
-        # restart with a "bind address in use".   To avoid this we want to add
-        # SO_REUSEADDR and SO_REUSEPORT.  To do so we have to disable
-        # bind_and_activate so we can then set allow_reuse_address and
-        # allow_reuse_address on the TCPServer before we bind.
-        with socketserver.TCPServer(("", CONFIG['port']), RequestHandler,
-                                    bind_and_activate=False) as httpd:
-            httpd.allow_reuse_address = True
-            httpd.allow_reuse_port = True
-            httpd.server_bind()
-            httpd.server_activate()
+        RequestHandler.static.preload(os.getcwd())
+        with make_server(CONFIG['port'], CONFIG['workers']) as httpd:
             httpd.serve_forever()
 
 
@@ -65,20 +673,29 @@ def main():
                         help='do not run as daemon')
     parser.add_argument('-p', '--port', dest='port', help='Port to listen on',
                         default=8000)
+    parser.add_argument('-w', '--workers', dest='workers', type=int,
+                        default=0,
+                        help='Number of threads serving requests '
+                             'concurrently, with keep-alive (default: 0, '
+                             'serve requests one at a time)')
     parser.add_argument('--debug', dest='debug', action='store_true')
     args = parser.parse_args()
 
     CONFIG['debug'] = True if args.debug else False
     CONFIG['port'] = int(args.port)
+    CONFIG['workers'] = args.workers
 
     with open(args.configfile, 'r') as fp:
         file_config = json.load(fp)
         CONFIG['db_filename'] = file_config['db_filename']
+        CONFIG['metrics_filename'] = file_config.get('metrics_filename')
 
     CONFIG['source_dir'] = importlib.resources.files() / 'html'
 
     logging.basicConfig(level=logging.DEBUG if args.debug else logging.INFO)
     logging.info('Starting daemon on port: %s' % args.port)
+    if args.workers:
+        logging.info('Serving with %d workers' % args.workers)
     logging.info('Serving files from: %s' % CONFIG['source_dir'])
     logging.info('JSON from: %s' % CONFIG['db_filename'])
     logging.debug('Debugging on')